@@ -0,0 +1,311 @@
+"""
+Non-blocking control of an EPS300 motion controller.
+
+Every method of AsyncStageController and AsyncStage returns a Future at once
+while a dedicated I/O thread owns the serial port, writes the commands in order
+and pairs each query with its reply through a queries.QueryEngine. The command
+methods are generated from the mnemonics tables, as those of the blocking
+StageController and Stage are. Motion waits are polled by the I/O thread only
+when no other command is queued, so the caller is free to read the camera
+while the stages move::
+
+    from motioncontrol import asynchronous, camera
+
+    eps = asynchronous.AsyncStageController('/dev/ttyUSB0')
+    lbp = camera.LaserBeamProfiler('/dev/ttyUSB1')
+    eps.groupMoveLine(1, [10, -125])
+    stopped = eps.pauseForGroup(1)
+    while not stopped.done():
+      print lbp.read()['power']
+    print eps.groupPosition(1).result()
+"""
+
+import Queue
+import batching
+import mnemonics
+import queries
+import serial
+import threading
+
+class Future(object):
+  """
+  The eventual result of a command handled by the I/O thread.
+  """
+
+  def __init__(self):
+    self._event = threading.Event()
+    self._lock = threading.Lock()
+    self._callbacks = []
+    self._value = None
+    self._exception = None
+
+  def done(self):
+    """
+    Returns True once a result or an exception has been set.
+    """
+    return self._event.is_set()
+
+  def result(self, timeout=None):
+    """
+    Blocks until the result is available and returns it.
+
+    The exception set by the I/O thread is raised instead if there is one.
+    """
+    if not self._event.wait(timeout):
+      raise IOError('Timed out waiting for a controller reply.')
+    if self._exception is not None:
+      raise self._exception
+    return self._value
+
+  def exception(self, timeout=None):
+    """
+    Blocks until the future is done and returns its exception or None.
+    """
+    self._event.wait(timeout)
+    return self._exception
+
+  def addDoneCallback(self, callback):
+    """
+    Calls callback(future) once the future is done.
+
+    Callbacks run in the thread that completes the future.
+    """
+    with self._lock:
+      if not self.done():
+        self._callbacks.append(callback)
+        return
+    callback(self)
+
+  def setResult(self, value):
+    self._value = value
+    self._finish()
+
+  def setException(self, exception):
+    self._exception = exception
+    self._finish()
+
+  def _finish(self):
+    with self._lock:
+      self._event.set()
+      callbacks, self._callbacks = self._callbacks, []
+    for callback in callbacks:
+      callback(self)
+
+def gather(futures):
+  """
+  Returns a Future of the list of results of all given futures.
+  """
+  futures = list(futures)
+  combined = Future()
+  remaining = [len(futures)]
+  lock = threading.Lock()
+  def collect(future):
+    with lock:
+      remaining[0] -= 1
+      finished = remaining[0] == 0
+    if future.exception() is not None and not combined.done():
+      combined.setException(future.exception())
+    elif finished and not combined.done():
+      combined.setResult([f.result() for f in futures])
+  if not futures:
+    combined.setResult([])
+  for future in futures:
+    future.addDoneCallback(collect)
+  return combined
+
+class SerialWorker(threading.Thread):
+  """
+  Thread owning a serial port that executes queued command lines in order.
+
+  Replies are read by a queries.QueryEngine, which validates them, drops
+  strays and resynchronizes after a timeout, so a lost or extra line fails
+  one Future with ControllerTimeout instead of shifting all later replies.
+  """
+
+  def __init__(self, io, terminator='\r', poll_interval=0.01):
+    """
+    Arguments:
+    io -- Open serial port.
+    terminator -- String appended to every command line.
+    poll_interval -- Seconds to idle between rounds of motion polls.
+    """
+    threading.Thread.__init__(self)
+    self.daemon = True
+    self.io = io
+    self.terminator = terminator
+    self.poll_interval = poll_interval
+    self.engine = queries.QueryEngine(io, terminator)
+    self.requests = Queue.Queue()
+    self.watches = []
+    self.running = True
+
+  def submit(self, line, reply=False, parse=None):
+    """
+    Queues a command line and returns a Future of its parsed reply.
+
+    Commands without a reply resolve to None once written to the port.
+    """
+    future = Future()
+    self.requests.put((line, reply, parse, future))
+    return future
+
+  def watch(self, line, parse, predicate):
+    """
+    Repeats a query whenever the port is idle until predicate(reply) is true.
+
+    Returns a Future resolved with the first reply satisfying the predicate.
+    """
+    future = Future()
+    self.requests.put((None, (line, parse, predicate), None, future))
+    return future
+
+  def stop(self):
+    """
+    Stops the thread after all queued commands have been written.
+    """
+    self.running = False
+    self.requests.put(None)
+
+  def run(self):
+    while self.running or not self.requests.empty():
+      try:
+        timeout = self.poll_interval if self.watches else None
+        request = self.requests.get(timeout=timeout)
+      except Queue.Empty:
+        request = None
+      if request is not None:
+        line, reply, parse, future = request
+        if line is None:
+          self.watches.append(reply + (future,))
+        else:
+          self._execute(line, reply, parse, future)
+      if self.requests.empty():
+        self._poll()
+    for watch in self.watches:
+      watch[-1].setException(IOError('Serial worker stopped.'))
+
+  def _query(self, line, parse):
+    if not batching.expectsReply(line):
+      raise ValueError('%r has no reply.' % line)
+    self.io.write(line + self.terminator)
+    response = self.engine.collect(self.engine.sent(line))
+    return parse(response.strip()) if parse else response
+
+  def _execute(self, line, reply, parse, future):
+    try:
+      if reply:
+        future.setResult(self._query(line, parse))
+      else:
+        self.io.write(line + self.terminator)
+        self.engine.sent(line)
+        future.setResult(None)
+    except Exception, error:
+      future.setException(error)
+
+  def _poll(self):
+    for watch in list(self.watches):
+      line, parse, predicate, future = watch
+      try:
+        value = self._query(line, parse)
+      except Exception, error:
+        self.watches.remove(watch)
+        future.setException(error)
+        continue
+      if predicate(value):
+        self.watches.remove(watch)
+        future.setResult(value)
+
+class AsyncStageController(object):
+  """
+  Non-blocking counterpart of controller.StageController.
+  """
+
+  def __init__(self, serial_device, poll_interval=0.01):
+    """
+    Creates a non-blocking handle on an EPS300 and its axes.
+
+    Arguments:
+    serial_device -- Path string to serial port used by the controller, or an
+                     already open serial port object.
+    poll_interval -- Seconds between motion polls while nothing else is queued.
+    """
+    if isinstance(serial_device, basestring):
+      self.io = serial.Serial(serial_device, 19200, timeout = 1)
+    else:
+      self.io = serial_device
+    self.worker = SerialWorker(self.io, '\r', poll_interval)
+    self.worker.start()
+    self.axis1 = AsyncStage(1, self)
+    self.axis2 = AsyncStage(2, self)
+    self.axis3 = AsyncStage(3, self)
+    self.firmware = self.query('VE', '?', parse=str.strip)
+
+  def close(self):
+    """
+    Stops the I/O thread once all queued commands are written.
+    """
+    self.worker.stop()
+    self.worker.join()
+
+  def send(self, command, parameter = '', axis = ''):
+    """
+    Queue a command for the controller.
+    """
+    return self.worker.submit(str(axis) + str(command) + str(parameter))
+
+  def query(self, command, parameter = '?', axis = '', parse = None):
+    """
+    Queue a query and return a Future of its (parsed) reply.
+    """
+    return self.worker.submit(str(axis) + str(command) + str(parameter),
+                              True, parse)
+
+  def pauseForGroup(self, group_id):
+    """
+    Returns a Future resolved once the group has stopped.
+    """
+    return _watchStopped(self, self.groupIsMoving.command, group_id)
+
+class AsyncStage(object):
+  """
+  Non-blocking counterpart of stage.Stage.
+  """
+
+  def __init__(self, axis, controller):
+    self.axis = str(axis)
+    self.controller = controller
+
+  def send(self, command, parameter=''):
+    """
+    Queue a command for this axis.
+    """
+    return self.controller.send(command, str(parameter), self.axis)
+
+  def query(self, command, parse=float):
+    """
+    Queue a query for this axis and return a Future of its parsed reply.
+    """
+    return self.controller.query(command, '', self.axis, parse)
+
+  def pauseForStage(self):
+    """
+    Returns a Future resolved once the stage has stopped.
+    """
+    return _watchStopped(self.controller, self.getMotionStatus.command,
+                         self.axis)
+
+def _watchStopped(controller, command, prefix):
+  """
+  Watches a motion status query of the command tables until it reports no
+  motion.
+  """
+  line = str(prefix) + command.mnemonic + command.parameter
+  return controller.worker.watch(line, command.parse,
+                                 lambda moving: not moving)
+
+mnemonics.defineMethods(AsyncStageController, mnemonics.CONTROLLER_COMMANDS,
+                        'controller', mnemonics.Command.submit)
+mnemonics.defineMethods(AsyncStageController, mnemonics.PREFIXED_COMMANDS,
+                        'prefixed', mnemonics.Command.submit)
+mnemonics.defineMethods(AsyncStage, mnemonics.AXIS_COMMANDS, 'axis',
+                        mnemonics.Command.submit)
@@ -0,0 +1,99 @@
+"""
+Merging of EPS300 commands into compound command lines.
+
+The EPS300 executes several commands written on one line separated by ';'.
+Queued commands are packed into as few lines as the controller's input buffer
+allows. A command that produces a reply always ends its line so that every
+line yields at most one reply and replies keep the order of the queries.
+"""
+
+import re
+
+# Mnemonics that produce a reply without a '?' parameter.
+REPLY_MNEMONICS = set(['DV', 'HB', 'HP', 'HZ', 'ID', 'TB', 'TE', 'TP', 'TS',
+                       'TX', 'VE'])
+
+_command_pattern = re.compile(r'^\s*\d*\s*([A-Za-z]{2})(.*)$')
+
+def expectsReply(command):
+  """
+  Returns True if the controller answers the given command string.
+  """
+  match = _command_pattern.match(command)
+  if not match:
+    return False
+  mnemonic, parameter = match.groups()
+  return parameter.strip().endswith('?') or mnemonic.upper() in REPLY_MNEMONICS
+
+def packLines(commands, max_length):
+  """
+  Joins commands into compound lines no longer than max_length.
+
+  The length includes the line terminator. Commands that expect a reply close
+  the line they are placed on.
+  """
+  lines = []
+  line = []
+  length = 0
+  for command in commands:
+    if line and length + len(command) + 2 > max_length:
+      lines.append(';'.join(line))
+      line, length = [], 0
+    length += len(command) + (1 if line else 0)
+    line.append(command)
+    if expectsReply(command):
+      lines.append(';'.join(line))
+      line, length = [], 0
+  if line:
+    lines.append(';'.join(line))
+  return lines
+
+class PendingReply(object):
+  """
+  The reply to a query queued in a command batch.
+  """
+
+  def __init__(self, command):
+    self.command = command
+    self.response = None
+    self.ready = False
+
+  def set(self, response):
+    self.response = response
+    self.ready = True
+
+  def value(self):
+    """
+    Returns the reply line once the batch holding the query has been flushed.
+    """
+    if not self.ready:
+      raise RuntimeError('Reply to %s requested before its batch was flushed.'
+                         % self.command)
+    return self.response
+
+class CommandBatch(object):
+  """
+  Context in which commands sent to a StageController are held back.
+
+  Held commands are written as compound lines when the outermost batch ends,
+  when a reply is read, or when StageController.flush() is called. Commands
+  held when an exception leaves the batch are discarded. With check set, the
+  outermost batch asks for an error check ahead of its commands.
+  """
+
+  def __init__(self, controller, check=False):
+    self.controller = controller
+    self.check = check
+
+  def __enter__(self):
+    self.controller._batch_depth += 1
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.controller._batch_depth -= 1
+    if self.controller._batch_depth == 0:
+      if exc_type is None:
+        self.controller.flush(check=self.check)
+      else:
+        del self.controller._pending[:]
+    return False
@@ -0,0 +1,75 @@
+"""
+Persistent beam trajectory calibrations.
+
+The beam path across a bench hardly moves between sessions, so the trajectory
+found by ConstrainToBeam.findSlope() is saved in a JSON file keyed by bench,
+group and axis configuration. A later findSlope() probes each cached end of
+the trajectory once and only searches for the beam again at an end where it
+is not found within max_drift of the cached position::
+
+    calibrations = calibration.CalibrationStore('calibrations.json')
+    beam = utilities.ConstrainToBeam(eps, 1, lbp, calibrations=calibrations,
+                                     bench='north')
+    beam.findSlope()
+"""
+
+import json
+import os
+import time
+
+def configurationKey(bench, group_id, axes, limits):
+  """
+  Returns the key of a calibration.
+
+  Arguments:
+  bench -- Name of the bench.
+  group_id -- Group carrying the camera.
+  axes -- Group axes as reported by HN?.
+  limits -- (lower x, upper x, lower z, upper z) travel limits of the search.
+  """
+  return '%s/group%s/axes%s/%s' % (bench, group_id,
+                                   ','.join(str(axis).strip() for axis in axes),
+                                   ','.join('%g' % limit for limit in limits))
+
+class CalibrationStore(object):
+  """
+  Trajectory calibrations kept in a JSON file.
+  """
+
+  def __init__(self, path):
+    """
+    Loads the calibrations saved at path, if any.
+    """
+    self.path = path
+    self.entries = {}
+    if os.path.exists(path):
+      with open(path) as stored:
+        self.entries = json.load(stored)
+
+  def load(self, key):
+    """
+    Returns the calibration saved under key as a dictionary, or None.
+    """
+    return self.entries.get(key)
+
+  def save(self, key, r_initial, r_final):
+    """
+    Saves the ends of a trajectory under key and writes the file.
+    """
+    self.entries[key] = {'r_initial': list(r_initial),
+                         'r_final': list(r_final),
+                         'saved': time.time()}
+    self._write()
+
+  def discard(self, key):
+    """
+    Forgets the calibration saved under key.
+    """
+    if self.entries.pop(key, None) is not None:
+      self._write()
+
+  def _write(self):
+    temporary = self.path + '.tmp'
+    with open(temporary, 'w') as output:
+      json.dump(self.entries, output, indent=1, sort_keys=True)
+    os.rename(temporary, self.path)
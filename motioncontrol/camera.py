@@ -2,24 +2,234 @@
 A class to read the data from a Newport HD-LBP laser beam profiler.
 """
 
+import collections
 import serial
+import threading
+import time
+
+class FrameParser(object):
+  """
+  Incremental parser of HD-LBP frames held in a preallocated ring buffer.
+
+  Bytes are copied into the ring as they arrive and every complete ' \\n'
+  terminated frame is decoded into a list of floats. The bytes before the
+  first terminator, and after a buffer overflow, are discarded because the
+  frame they belong to is incomplete.
+  """
+
+  def __init__(self, n_values=14, capacity=8192):
+    self.n_values = n_values
+    self.capacity = capacity
+    self.buffer = bytearray(capacity)
+    self.start = 0
+    self.end = 0
+    self.synced = False
+    self.statistics = {'frames': 0, 'malformed': 0, 'overflows': 0}
+
+  def feed(self, data):
+    """
+    Adds received bytes and returns the frames they complete.
+
+    Each frame is returned as (values, bytes_after) where bytes_after is the
+    number of bytes of data received after the frame's terminator.
+    """
+    n = len(data)
+    if n == 0:
+      return []
+    if n > self.capacity - (self.end - self.start):
+      self.statistics['overflows'] += 1
+      self.start = self.end
+      self.synced = False
+      if n > self.capacity:
+        data = data[-self.capacity:]
+        n = self.capacity
+    first = self.end % self.capacity
+    head = min(n, self.capacity - first)
+    self.buffer[first:first + head] = data[:head]
+    self.buffer[:n - head] = data[head:]
+    scan = self.end
+    self.end += n
+    frames = []
+    while True:
+      terminator = self._find(scan)
+      if terminator < 0:
+        break
+      line = self._slice(self.start, terminator)
+      self.start = scan = terminator + 1
+      if not self.synced:
+        self.synced = True
+        continue
+      values = self.decode(line)
+      if values is None:
+        self.statistics['malformed'] += 1
+      else:
+        self.statistics['frames'] += 1
+        frames.append((values, self.end - self.start))
+    return frames
+
+  def decode(self, line):
+    """
+    Returns the values of one frame without its terminator, or None.
+    """
+    fields = line.split(None, 1)
+    if len(fields) != 2:
+      return None
+    try:
+      values = [float(x) for x in fields[1].split()]
+    except ValueError:
+      return None
+    if len(values) != self.n_values:
+      return None
+    return values
+
+  def _find(self, begin):
+    """
+    Returns the absolute position of the next newline at or after begin.
+    """
+    while begin < self.end:
+      offset = begin % self.capacity
+      stop = min(self.capacity, offset + self.end - begin)
+      found = self.buffer.find('\n', offset, stop)
+      if found >= 0:
+        return begin + found - offset
+      begin += stop - offset
+    return -1
+
+  def _slice(self, begin, end):
+    """
+    Returns the bytes between the absolute positions begin and end.
+    """
+    offset = begin % self.capacity
+    if offset + end - begin <= self.capacity:
+      return str(self.buffer[offset:offset + end - begin])
+    return str(self.buffer[offset:] + self.buffer[:end - begin - self.capacity
+                                                  + offset])
 
 class LaserBeamProfiler(object):
   """
   Provides an interface to a Newport HD-LBP over serial link.
   """
 
-  def __init__(self, device):
+  def __init__(self, device, history=1024):
     """
     Establish serial communication with an HD-LBP.
+
+    The device is either the path to the serial port or an already open serial
+    port object such as a simulator.SimulatedProfiler. Up to history frames
+    are kept for drain().
     """
     self.device = device
-    self.io = serial.Serial(device, 57600, timeout=1)
+    if isinstance(device, basestring):
+      self.io = serial.Serial(device, 57600, timeout=1)
+    else:
+      self.io = device
     self.keys = ['time', 'centroid_x', 'centroid_y', 'centroid_r',
                  'level_1', 'level_2', 'level_3',
                  'width_1', 'width_2', 'width_3',
                  'height_1', 'height_2', 'height_3',
                  'power']
+    self.byte_time = 10.0 / getattr(self.io, 'baudrate', 57600)
+    self.parser = FrameParser(len(self.keys))
+    self.frames = collections.deque(maxlen=history)
+    self.dropped = 0
+    self.sequence = 0
+    self.newest = None
+    self.condition = threading.Condition()
+    self.reader = None
+    self.instruments = None
+
+  def _receive(self):
+    """
+    Reads the bytes waiting on the port, blocking up to the port timeout for
+    at least one, and records the frames they complete.
+    """
+    data = self.io.read(max(1, self.io.inWaiting()))
+    now = time.time()
+    if self.instruments is not None:
+      self.instruments.cameraRead(len(data))
+    records = []
+    for values, bytes_after in self.parser.feed(data):
+      record = dict(zip(self.keys, values))
+      record['host_time'] = now - bytes_after * self.byte_time
+      record['sequence'] = self.sequence
+      self.sequence += 1
+      records.append(record)
+    self._store(records)
+    return records
+
+  def _store(self, records):
+    """
+    Adds decoded frames to the history and wakes threads waiting for them.
+    """
+    if records:
+      with self.condition:
+        if len(self.frames) + len(records) > self.frames.maxlen:
+          self.dropped += len(self.frames) + len(records) - self.frames.maxlen
+        self.frames.extend(records)
+        self.newest = records[-1]
+        self.condition.notify_all()
+
+  def start(self):
+    """
+    Starts a background thread that decodes every frame as it arrives.
+    """
+    if self.reader is None:
+      self.reader = threading.Thread(target=self._run)
+      self.reader.daemon = True
+      self.running = True
+      self.reader.start()
+
+  def stop(self):
+    """
+    Stops the background reader.
+    """
+    if self.reader is not None:
+      self.running = False
+      self.reader.join()
+      self.reader = None
+
+  def _run(self):
+    while self.running:
+      self._receive()
+
+  def latest(self):
+    """
+    Returns the most recent frame without waiting, or None.
+    """
+    return self.newest
+
+  def waitNewer(self, host_time, timeout=None):
+    """
+    Returns the most recent frame received after the given host time.
+
+    Without a background reader the port is read until such a frame arrives.
+    Returns None if none arrives within timeout seconds.
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    if self.reader is None:
+      while self.newest is None or self.newest['host_time'] <= host_time:
+        if deadline is not None and time.time() >= deadline:
+          return None
+        self._receive()
+      return self.newest
+    with self.condition:
+      while self.newest is None or self.newest['host_time'] <= host_time:
+        remaining = None if deadline is None else deadline - time.time()
+        if remaining is not None and remaining <= 0:
+          return None
+        self.condition.wait(remaining)
+      return self.newest
+
+  def drain(self):
+    """
+    Returns all frames received since the last drain, oldest first.
+    """
+    if self.reader is None and self.io.inWaiting():
+      self._receive()
+    with self.condition:
+      frames = list(self.frames)
+      self.frames.clear()
+    return frames
 
   def read(self):
     """
@@ -43,16 +253,23 @@ class LaserBeamProfiler(object):
       'height_1' - Projection height at level 1
       'height_2' - Projection height at level 1
       'height_3' - Projection height at level 1
+
+    Every frame is also timestamped with the host clock ('host_time') and
+    numbered ('sequence'). With a background reader running the next frame
+    to arrive is returned; otherwise the newest frame among the bytes waiting
+    on the port is returned, blocking until one is complete.
     """
-    buffer = ''
+    if self.instruments is None:
+      return self._read()
+    start = time.time()
+    frame = self._read()
+    self.instruments.roundTrip('camera', time.time() - start)
+    return frame
+
+  def _read(self):
+    if self.reader is not None:
+      return self.waitNewer(time.time())
     while True:
-      buffer = buffer + self.io.read(self.io.inWaiting())
-      if ' \n' in buffer:
-        lines = buffer.split(' \n')
-        if len(lines) > 2:
-          last_full_line = lines[-2]
-          header, values = last_full_line.split(" ",1)
-          floats = [float(x) for x in values.split()]
-          if len(floats) == 14:
-            output = dict(zip(self.keys, floats))
-            return output
+      records = self._receive()
+      if records:
+        return records[-1]
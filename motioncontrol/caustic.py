@@ -0,0 +1,108 @@
+"""
+Beam waist location from a caustic fit.
+
+Along the beam the diameter of a beam of quality M^2 follows the hyperbola
+
+    d(z)^2 = d0^2 + theta^2 * (z - z0)^2
+
+with waist diameter d0 at z0 and full divergence angle theta. The squared
+diameters are therefore a quadratic a + b*z + c*z^2 of the position along the
+beam (ISO 11146), which is fitted by weighted least squares to all frames of a
+pass at once. The waist position and its standard error follow from the fit
+coefficients and their covariance::
+
+    fit = caustic.fitCaustic(z, diameters)
+    print fit.waist_z, fit.waist_z_error, fit.m_squared
+"""
+
+import math
+import numpy
+
+class CausticFit(object):
+  """
+  Result of a caustic fit.
+
+  Attributes (lengths in mm):
+  waist_z -- Position of the waist along the fitted coordinate.
+  waist_z_error -- Standard error of waist_z.
+  waist_diameter -- Diameter at the waist.
+  divergence -- Full divergence angle (rad).
+  rayleigh -- Rayleigh length.
+  m_squared -- Beam quality factor for the given wavelength.
+  residual -- RMS of the relative diameter residuals.
+  n_points -- Number of diameters fitted.
+  """
+
+  def __init__(self, waist_z, waist_z_error, waist_diameter, divergence,
+               wavelength, residual, n_points):
+    self.waist_z = waist_z
+    self.waist_z_error = waist_z_error
+    self.waist_diameter = waist_diameter
+    self.divergence = divergence
+    if divergence > 0:
+      self.rayleigh = waist_diameter / divergence
+    else:
+      self.rayleigh = float('inf')
+    self.m_squared = math.pi * waist_diameter * divergence / (4 * wavelength)
+    self.residual = residual
+    self.n_points = n_points
+
+  def diameter(self, z):
+    """
+    Returns the fitted beam diameter at the given positions.
+    """
+    z = numpy.asarray(z, dtype='f8')
+    return numpy.sqrt(self.waist_diameter ** 2
+                      + (self.divergence * (z - self.waist_z)) ** 2)
+
+  def __repr__(self):
+    return ('CausticFit(waist_z=%.4f +- %.4f, waist_diameter=%.4f, '
+            'm_squared=%.3f)' % (self.waist_z, self.waist_z_error,
+                                 self.waist_diameter, self.m_squared))
+
+def fitCaustic(z, diameters, wavelength=405e-6):
+  """
+  Fits the hyperbolic caustic to beam diameters measured at positions z.
+
+  Diameters that are not positive are ignored. Raises ValueError if fewer
+  than four remain or the diameters do not form a waist.
+  """
+  z = numpy.asarray(z, dtype='f8')
+  d = numpy.asarray(diameters, dtype='f8')
+  keep = d > 0
+  z, d = z[keep], d[keep]
+  if len(z) < 4:
+    raise ValueError('Too few beam diameters for a caustic fit.')
+  offset = z.mean()
+  u = z - offset
+  # Relative diameter errors are equal, so the errors of d^2 scale with d^2.
+  coefficients, covariance = numpy.polyfit(u, d ** 2, 2, w=1.0 / d ** 2,
+                                           cov=True)
+  c, b, a = coefficients
+  if c <= 0:
+    raise ValueError('The beam diameters do not form a waist.')
+  waist_u = -b / (2 * c)
+  gradient = numpy.array([b / (2 * c ** 2), -1 / (2 * c), 0.0])
+  waist_z_error = math.sqrt(max(gradient.dot(covariance).dot(gradient), 0.0))
+  waist_squared = a - b ** 2 / (4 * c)
+  waist_diameter = math.sqrt(max(waist_squared, 0.0))
+  divergence = math.sqrt(c)
+  fitted = numpy.sqrt(numpy.maximum(numpy.polyval(coefficients, u), 0.0))
+  residual = math.sqrt(numpy.mean((d / fitted - 1) ** 2)) if fitted.all() \
+             else float('inf')
+  return CausticFit(waist_u + offset, waist_z_error, waist_diameter,
+                    divergence, wavelength, residual, len(z))
+
+def frameDiameters(frames, level=1, power_fraction=0.5):
+  """
+  Returns the (width, height) diameters in mm of structured camera frames.
+
+  Frames with less than power_fraction of the peak power are set to zero so
+  that fitCaustic ignores them. level selects the projection level 1-3.
+  """
+  width = frames['width_%d' % level] / 1000.0
+  height = frames['height_%d' % level] / 1000.0
+  dim = frames['power'] < power_fraction * frames['power'].max()
+  width = numpy.where(dim, 0.0, width)
+  height = numpy.where(dim, 0.0, height)
+  return width, height
@@ -0,0 +1,111 @@
+"""
+Contour motion through the EPS300 group point buffer.
+
+Group lines sent to a moving group are queued in the controller's point buffer
+and followed without stopping at every point. streamPath() feeds a path of any
+length into the buffer with flow control: once the buffer is full, every
+further chunk of points is preceded by an HQ wait for free buffer slots and a
+position query whose reply tells the host that the chunk fits. The group moves
+continuously while the host spends one round trip per chunk.
+
+Paths are NumPy arrays with one row of group coordinates per point::
+
+    path = contour.linePath([0, -125], [5, 125], 1.0)
+    path = contour.clampPath(path, [-125, -125], [125, 125])
+    result = contour.streamPath(eps, 1, path)
+"""
+
+import math
+import motion
+import numpy
+import time
+
+def linePath(start, stop, spacing):
+  """
+  Returns points every spacing along the line from start to stop.
+
+  The start point itself is not included; the last point is stop.
+  """
+  start = numpy.asarray(start, dtype='f8')
+  stop = numpy.asarray(stop, dtype='f8')
+  length = numpy.sqrt(numpy.sum((stop - start) ** 2))
+  n = max(1, int(math.ceil(length / abs(float(spacing)))))
+  fractions = numpy.arange(1, n + 1) / float(n)
+  return start + fractions[:, numpy.newaxis] * (stop - start)
+
+def arcPath(center, start, sweep, spacing):
+  """
+  Returns points every spacing along an arc of a two axis group.
+
+  The arc is given as for StageController.groupMoveArc: it starts at start
+  and turns around center by sweep degrees. The start point is not included.
+  """
+  center = numpy.asarray(center, dtype='f8')
+  offset = numpy.asarray(start, dtype='f8') - center
+  radius = numpy.hypot(offset[0], offset[1])
+  theta = math.atan2(offset[1], offset[0])
+  sweep = math.radians(float(sweep))
+  n = max(1, int(math.ceil(radius * abs(sweep) / abs(float(spacing)))))
+  angles = theta + sweep * numpy.arange(1, n + 1) / float(n)
+  return center + radius * numpy.column_stack((numpy.cos(angles),
+                                               numpy.sin(angles)))
+
+def beamPath(constraint, start=0.0, stop=1.0, spacing=1.0):
+  """
+  Returns points every spacing along the beam trajectory of a ConstrainToBeam.
+
+  start and stop are fractions of the trajectory found by findSlope(), as for
+  ConstrainToBeam.position().
+  """
+  r_initial = numpy.asarray(constraint.r_initial, dtype='f8')
+  slope = numpy.asarray(constraint.slope, dtype='f8')
+  return linePath(r_initial + start * slope, r_initial + stop * slope,
+                  spacing)
+
+def clampPath(points, lower, upper):
+  """
+  Constrains every point of a path to between per axis limits.
+  """
+  return numpy.clip(numpy.asarray(points, dtype='f8'),
+                    numpy.asarray(lower, dtype='f8'),
+                    numpy.asarray(upper, dtype='f8'))
+
+def streamPath(controller, group_id, points, velocity=None, buffer_size=20,
+               chunk=None):
+  """
+  Moves a group through all points of a path without stopping.
+
+  Returns a motion.MotionResult once the group has stopped at the last point;
+  its polls count the flow control round trips.
+
+  Arguments:
+  controller -- StageController owning the group.
+  group_id -- Group to move.
+  points -- Path as an array with one row of group coordinates per point.
+  velocity -- Group velocity along the path. The current one if not given.
+  buffer_size -- Number of points the controller's group buffer holds.
+  chunk -- Number of points sent per round trip (default: half the buffer).
+  """
+  points = numpy.atleast_2d(numpy.asarray(points, dtype='f8'))
+  chunk = chunk or max(1, buffer_size // 2)
+  start = time.time()
+  if velocity is not None:
+    controller.groupVelocity(group_id, velocity)
+  def send(block):
+    with controller.batch():
+      for point in block:
+        controller.groupMoveLine(group_id, ['%.5f' % x for x in point])
+  send(points[:buffer_size])
+  index = min(buffer_size, len(points))
+  rounds = 0
+  while index < len(points):
+    block = points[index:index + chunk]
+    with controller.batch():
+      controller.groupWaitForBuffer(group_id, len(block))
+      reply = controller.queue('HP', '', group_id)
+    reply.value()
+    send(block)
+    index += len(block)
+    rounds += 1
+  result = motion.waitForGroup(controller, group_id)
+  return motion.MotionResult(result.position, time.time() - start, rounds)
@@ -1,12 +1,30 @@
 """
 This module provides methods for controlling and communicating with an EPS300
 motion controller.
+
+The command methods of StageController are generated from
+mnemonics.CONTROLLER_COMMANDS and mnemonics.PREFIXED_COMMANDS.
 """
 
+import batching
+import contour
+import homing
+import mnemonics
+import motion
+import queries
 import serial
+import shadow
 import stage
-import time
-from utilities import pauseForStage
+
+def _checkIndex(pending):
+  """
+  Returns where a piggybacked activity query goes in a list of held commands:
+  before the first wait command, which would delay its reply, or at the end.
+  """
+  for index, (line, reply) in enumerate(pending):
+    if queries.mnemonic(line) in queries.WAIT_MNEMONICS | set(['WT']):
+      return index
+  return len(pending)
 
 class StageController(object):
   """
@@ -20,284 +38,257 @@ class StageController(object):
     Creates an I/O handle on a Newport EPS300 motion controller and its axes.
     
     Arguments:
-    serial_device -- Path string to serial port used by the controller.
+    serial_device -- Path string to serial port used by the controller, or an
+                     already open serial port object such as a
+                     simulator.SimulatedEPS300.
     """
-    self.io = serial.Serial(serial_device, 19200, timeout = 1)
+    if isinstance(serial_device, basestring):
+      self.io = serial.Serial(serial_device, 19200, timeout = 1)
+    else:
+      self.io = serial_device
     self.io_end = '\r'
+    self.max_line_length = 80
+    self._batch_depth = 0
+    self._pending = []
+    self.shadow = shadow.ShadowState()
+    self.programs = {}
+    self.instruments = None
+    self.monitor = None
+    self.echo = False
+    self.engine = queries.QueryEngine(self.io, self.io_end, self.shadow)
     self.axis1 = stage.Stage(1, self)
     self.axis2 = stage.Stage(2, self)
     self.axis3 = stage.Stage(3, self)
+    self.homing = homing.HomingManager(self)
     self.readFirmwareVersion()
     
   def send(self, command, parameter = '', axis = ''):
     """
     Send a command to the controller.
-    """
-    self.io.write(str(axis) + str(command) + str(parameter) + self.io_end)
+
+    Inside a batch the command is held back until the batch is flushed.
+    Setters that would not change the shadowed controller state are skipped
+    and queries for shadowed parameters are answered from the shadow.
+    """
+    line = str(axis) + str(command) + str(parameter)
+    if not self._pending and self.shadow.isRedundant(line):
+      return
+    cached = self._lookup(line)
+    if cached is not None:
+      self.engine.answered(line, cached)
+      return
+    if self._batch_depth:
+      self._pending.append((line, None))
+    elif queries.mnemonic(line) in queries.WAIT_MNEMONICS:
+      self._pending.append((line, None))
+      self.flush()
+    else:
+      self._write([line])
+      self._sent(line)
     
   def read(self):
     """
-    Return a line read from the controller's serial buffer.
-    """
-    return self.io.readline()
-    
-  def reset(self):
-    """
-    Perform a full controller reset.
-    """
-    self.send('RS')
-    
-  def readStatus(self):
-    """
-    Read the first error message in the error FIFO buffer.
-    """
-    self.send('TS')
-    self.read()
-    
-  def readActivity(self):
-    """
-    Read the activity register.
-    """
-    self.send('TX')
-    self.read()
-    
-  def readError(self):
-    """
-    Read the first error message in the error FIFO buffer.
-    """
-    self.send('TB?')
-    self.read()
-    
-  def readFirmwareVersion(self):
-    """
-    Report the controller firmware version.
-    """
-    self.send('VE?')
-    self.read()
-    
-  def wait(milliseconds='0'):
-    self.send('WT', milliseconds)
-    
-  def eStop(self):
-    """
-    Emergency stop all axes.
-    
-    The e-stop configuration for each axis is invoked when this command is sent.
-    """
-    self.send('AB')
-    
-  def abortProgram(self):
-    """
-    Abort execution of current program.
-    
-    Stages in motion will finish their last command.
-    """
-    self.send('AB')
-  
-  def groupAcceleration(self, group_id, acceleration = '?'):
-    """
-    Sets the vectorial acceleration for a group.
-    
-    This command overides individually set accelerations.
-    """
-    self.send('HA', acceleration, group_id)
-    if (acceleration == '?'):
-      acceleration = self.read()
-      print acceleration
-    
-  def groups(self):
-    """
-    Returns the IDs of all defined groups.
-    """
-    self.send('HB')
-    group_ids = self.read()
-    print group_ids
-    return group_ids
-  
-  def groupMoveArc(self, group_id, coordinates = '?'):
-    """
-    Moves a group along an arc.
-    
-    The arc is defined by a list of coordinates:
-      [center_x, center_y, deltaTheta]
+    Return the reply to the most recently sent query.
+
+    Commands held in a batch are flushed first. Raises
+    queries.ControllerTimeout if the reply does not arrive in time.
     """
-    if (coordinates == '?'):
-      self.send('HC', coordinates, group_id)
-      coordinates = self.read()
-      print coordinates
+    if self._pending:
+      self.flush()
+    return self.engine.read()
+
+  def query(self, command, parameter = '?', axis = ''):
+    """
+    Send a query and return its reply line.
+    """
+    line = str(axis) + str(command) + str(parameter)
+    cached = self._lookup(line)
+    if cached is not None:
+      return cached
+    if self._pending:
+      self.flush()
+    check = self._check()
+    if check is not None:
+      self._write(['TX', line])
+      self._sent('TX', check)
     else:
-      self.send('HC', ",".join(map(str,coordinates)), group_id)
-  
-  def groupDeceleration(self, group_id, deceleration = '?'):
-    """
-    Sets the vectorial deceleration for a group.
-    
-    This command overides individually set decelerations.
-    """
-    self.send('HD', deceleration, group_id)
-    if (deceleration == '?'):
-      deceleration = self.read()
-      print deceleration
-    
-  def groupEStopDeceleration(self, group_id, deceleration = '?'):
-    """
-    Sets the vectorial deceleration for a group emergency stop.
-    
-    This command overides individually set decelerations.
-    """
-    self.send('HE', deceleration, group_id)
-    if (deceleration == '?'):
-      deceleration = self.read()
-      print deceleration
-  
-  def groupOff(self, group_id):
-    """
-    Turns off power to all axis in a group.
-    """
-    self.send('HF', '', group_id)
-  
-  def groupJerk(self, group_id, jerk = '?'):
-    """
-    Sets the vectorial jerk limit for a group.
-    
-    This command overides individually set jerks.
-    """
-    self.send('HJ', jerk, group_id)
-    if (jerk == '?'):
-      jerk = self.read()
-      print jerk
-  
-  def groupMoveLine(self, group_id, coordinates = '?'):
+      self._write([line])
+    return self.engine.collect(self._sent(line))
+
+  def batch(self, check=False):
     """
-    Moves a group along a line.
-    
-    The line is defined by a list of endpoint coordinates:
-      [axis1, axis2, ..., axisN]
+    Returns a context in which sent commands are merged into compound lines.
+
+    Usage::
+
+      with eps.batch():
+        eps.groupVelocity(1, 10)
+        eps.groupAcceleration(1, 100)
+        velocity = eps.queue('HV', '?', 1)
+      print velocity.value()
+
+    Queries queued with queue() keep their own replies. Reading a reply inside
+    the batch flushes the commands held so far. With check set, an attached
+    ErrorMonitor checks for errors ahead of the batch whatever its interval.
     """
-    if (coordinates == '?'):
-      self.send('HL', coordinates, group_id)
-      coordinates = self.read()
-      print coordinates
-    else:
-      self.send('HL', ",".join(map(str,coordinates)), group_id)
+    return batching.CommandBatch(self, check)
 
-  def groupCreate(self, group_id, axes = '?'):
+  def queue(self, command, parameter = '', axis = ''):
     """
-    Creates a group with ID group_id over the given axes.
-    
-    The axes are given as an ordered list of the physical axis numbers:
-      [axis1, axis2, ..., axisN]
+    Queue a query and return a batching.PendingReply holding its reply.
+
+    Outside of a batch the query is sent and its reply read immediately.
+    """
+    line = str(axis) + str(command) + str(parameter)
+    reply = batching.PendingReply(line)
+    cached = self._lookup(line)
+    if cached is not None:
+      reply.set(cached)
+      return reply
+    self._pending.append((line, reply))
+    if not self._batch_depth:
+      self.flush()
+    return reply
+
+  def flush(self, check=False):
     """
-    if (axes == '?'):
-      self.send('HN', axes, group_id)
-      axes = self.read()
-      print axes
-    else:
-      self.send('HN', ",".join(map(str,axes)), group_id)
+    Write all held commands as compound lines and collect their replies.
 
-  def groupOn(self, group_id):
+    The replies of queued queries are read into their PendingReply; the
+    reply to a query sent last is left for read(). With check set, an error
+    check is sent ahead of the commands whatever the monitor interval.
+    """
+    pending, self._pending = self._pending, []
+    waits = any(queries.mnemonic(line) in queries.WAIT_MNEMONICS
+                for line, reply in pending)
+    if check or waits or \
+        any(batching.expectsReply(line) for line, reply in pending):
+      activity = self._check(force=check or waits)
+      if activity is not None:
+        index = 0 if check else _checkIndex(pending)
+        pending.insert(index, ('TX', activity))
+    lines = batching.packLines([line for line, reply in pending],
+                               self.max_line_length)
+    if not lines:
+      return
+    self._write(lines)
+    queued = [self._sent(line, reply) for line, reply in pending]
+    for query in queued:
+      if query is not None and query.reply is not None:
+        self.engine.collect(query)
+
+  def _check(self, force=False):
     """
-    Turns on power to all axis in a group.
+    Returns the PendingReply of an activity query (TX) to piggyback on the
+    next query, or None if none is needed.
+
+    The attached ErrorMonitor asks for one at its interval, and always with
+    force, which is given ahead of wait commands: a rejected command would
+    otherwise only be noticed once the wait has held back replies for its
+    whole deadline. Setter values that the shadow holds unconfirmed ask for
+    one as well, since a reply without the error bit confirms them.
+    """
+    if self.monitor is not None:
+      if self.monitor.due(force=force or bool(self.shadow.unconfirmed)):
+        return self.monitor.reply()
+      return None
+    if self.shadow.unconfirmed and self.shadow.enabled:
+      return batching.PendingReply('TX')
+    return None
+
+  def _lookup(self, line):
     """
-    self.send('HO', '', group_id)
-  
-  def groupPosition(self, group_id):
+    Returns the shadowed reply to a query line, or None.
+
+    Held commands are flushed before a shadowed reply is used, since the
+    shadow only learns of commands once they are written.
+    """
+    if self._pending and self.shadow.lookup(line, count=False) is None:
+      return None
+    if self._pending:
+      self.flush()
+    return self.shadow.lookup(line)
+
+  def _sent(self, line, reply=None):
     """
-    Returns the position of all stages in a group.
-    
-    The positions are given as an ordered list of the group axis numbers:
-      [axis1, axis2, ..., axisN]
+    Registers a written command line with the shadow and the query engine.
+
+    Returns the Query awaiting its reply, if any.
     """
-    self.send('HP', '', group_id)
-    coordinates = [float(x.strip()) for x in self.read().split(',')]
-    print coordinates
-    return coordinates
+    self.shadow.sent(line)
+    return self.engine.sent(line, reply)
     
-  # Wait for group via point buffer. - NOT IMPLEMENTED.
-  
-  def groupStop(self, group_id):
+  def _write(self, lines):
     """
-    Stops all motion on all axes in a group.
+    Write command lines to the serial port in one go.
     """
-    self.send('HS', '', group_id)
-    
-  def groupIsMoving(self, group_id):
+    data = ''.join(line + self.io_end for line in lines)
+    self.io.write(data)
+    if self.instruments is not None:
+      self.instruments.written(lines, len(data))
+    if self.monitor is not None:
+      self.monitor.written(lines)
+
+  def eraseProgram(self, program = 0):
     """
-    Queries controller if group is in motion or stopped.
+    Erases a stored program, or all programs if 0 is given.
     """
-    self.send('HS', '?', group_id)
-    response = self.read()
-    if '0' in response:
-      return True
+    self.send('XX', '', program)
+    if program:
+      self.programs.pop(program, None)
     else:
-      return False
-      
-  def pauseForGroup(self, group_id):
-    """
-    Holds python execution in loop until group is stopped.
-    """
-    while self.groupIsMoving(group_id):
-      pass
-    
-  def groupVelocity(self, group_id, velocity = '?'):
-    """
-    Sets the vectorial velocity limit for a group.
-    
-    This command overides individually set velocities.
-    """
-    self.send('HV', velocity, group_id)
-    if (velocity == '?'):
-      velocity = self.read()
-      print velocity
+      self.programs.clear()
 
-  def groupWaitForStop(self, group_id, delay = '0'):
-    """
-    Pauses command execution until group has stopped for given delay [ms].
+  def groupMoveContour(self, group_id, points, **kwargs):
     """
-    self.send('HW', delay, group_id)
-    
-  def groupDelete(self, group_id):
-    """
-    Deletes group with given ID.
+    Moves a group through a sequence of points without stopping at each.
+
+    The points are streamed into the group point buffer with flow control;
+    see contour.streamPath for the keyword arguments. Returns a
+    motion.MotionResult once the group has stopped at the last point.
     """
-    self.send('HX', '', group_id)
-    
-  def groupSize(self, group_id):
+    return contour.streamPath(self, group_id, points, **kwargs)
+
+  def pauseForGroup(self, group_id, delay = 0):
     """
-    Returns the size of the group with given group_id.
+    Holds python execution until group is stopped.
+
+    The wait is done by the controller and costs a single round trip. Returns
+    a motion.MotionResult with the final group position.
     """
-    self.send('HZ', '', group_id)
-    size = self.read()
-    print size
-    
+    return motion.waitForGroup(self, group_id, delay)
+
   def initializeGroup(self, group_id, axes, **kwargs):
     """
     Creates and initilizes a group.
     
-    Default values are provided for all kinematic parameters unless alternatives
-    are given in the form of keyword arguments. The units are those that the
-    stages are currently set to. Possible option=default values are:
+    The axes are homed together, skipping those already homed with their
+    motors on since the last reset (see homing.HomingManager). Default values
+    are provided for all kinematic parameters unless alternatives are given
+    in the form of keyword arguments. The units are those that the stages are
+    currently set to. Possible option=default values are:
      velocity=10 - Set group velocity (Units/s)
      acceleration=100 - Set group acceleration (Units/s^2)
      deceleration=100 - Set group deceleration (Units/s^s)
      jerk=1000 - Set group jerk rate (Units/s^3)
      estop=200 - Set group emergency stop deceleration (Units/s^2)
+     rehome=False - Home all axes even if they are already homed.
      
     See core group functions for usage of each parameter.
     """
-    if str(group_id) in self.groups():
+    if int(group_id) in self.groups():
       self.groupDelete(group_id)
-    stages = [self.axis1, self.axis2, self.axis3]
-    for axis in axes:
-      stage = stages[axis - 1]
-      stage.on()
-      stage.goToHome()
-      pauseForStage(stage)
-      time.sleep(1)
-    self.groupCreate(group_id, axes)
-    self.groupVelocity(group_id, kwargs.pop('velocity', 10))
-    self.groupAcceleration(group_id, kwargs.pop('acceleration', 100))
-    self.groupDeceleration(group_id, kwargs.pop('deceleration', 100))
-    self.groupJerk(group_id, kwargs.pop('jerk', 1000))
-    self.groupEStopDeceleration(group_id, kwargs.pop('estop', 200))
-    self.groupOn(group_id)
\ No newline at end of file
+    self.homing.home(axes, force=kwargs.pop('rehome', False))
+    with self.batch():
+      self.groupCreate(group_id, axes)
+      self.groupVelocity(group_id, kwargs.pop('velocity', 10))
+      self.groupAcceleration(group_id, kwargs.pop('acceleration', 100))
+      self.groupDeceleration(group_id, kwargs.pop('deceleration', 100))
+      self.groupJerk(group_id, kwargs.pop('jerk', 1000))
+      self.groupEStopDeceleration(group_id, kwargs.pop('estop', 200))
+      self.groupOn(group_id)
+
+mnemonics.defineMethods(StageController, mnemonics.CONTROLLER_COMMANDS,
+                        'controller')
+mnemonics.defineMethods(StageController, mnemonics.PREFIXED_COMMANDS,
+                        'prefixed')
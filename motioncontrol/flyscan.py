@@ -0,0 +1,128 @@
+"""
+On-the-fly beam scanning.
+
+Instead of stopping at every step, a fly-scan moves the camera group across the
+beam in one constant velocity groupMoveLine while camera frames are streamed.
+The group position is sampled at a low rate during the move and every frame is
+matched to the interpolated trajectory by its host timestamp. The beam crossing
+then follows from the frames that see the beam: for each of them the beam lies
+at the stage x position minus the measured centroid offset.
+"""
+
+import kinematics
+import numpy
+import time
+
+class FlyScanResult(object):
+  """
+  Frames and positions gathered during one fly-scan.
+
+  Attributes:
+  frames -- Structured array of the frames taken during the move.
+  stage -- Interpolated group position at each frame (one row per frame).
+  start_time, stop_time -- Host times bracketing the move.
+  """
+
+  def __init__(self, frames, stage, start_time, stop_time):
+    self.frames = frames
+    self.stage = stage
+    self.start_time = start_time
+    self.stop_time = stop_time
+
+def scan(beam, start_point, stop_point, velocity, track_interval=0.05):
+  """
+  Fly-scans a ConstrainToBeam group from start_point to stop_point.
+
+  The group is first moved to start_point at its current velocity, then
+  driven to stop_point at the given velocity while all camera frames are
+  recorded in the beam's sample store. The group position is queried every
+  track_interval seconds during the move. The group velocity is restored
+  afterwards, also when the scan fails. Returns a FlyScanResult.
+  """
+  controller, group_id, camera, store = (beam.controller, beam.group_id,
+                                         beam.camera, beam.store)
+  controller.groupMoveLine(group_id, start_point)
+  store.addPosition(group_id, controller.pauseForGroup(group_id).position)
+  previous_velocity = controller.groupVelocity(group_id)
+  try:
+    controller.groupVelocity(group_id, velocity)
+    duration = kinematics.MoveEstimator(controller).groupLine(group_id,
+                                                              stop_point,
+                                                              start_point)
+    camera.drain()
+    start_time = time.time()
+    store.addPosition(group_id, start_point, start_time)
+    controller.groupMoveLine(group_id, stop_point)
+    last_frame = last_track = start_time
+    while time.time() < start_time + duration:
+      frame = camera.waitNewer(last_frame, timeout=0.5)
+      if frame is not None:
+        frames = camera.drain()
+        store.addFrames(frames)
+        last_frame = frames[-1]['host_time'] if frames else frame['host_time']
+      if time.time() - last_track >= track_interval:
+        before = time.time()
+        reply = controller.query('HP', '', group_id)
+        last_track = time.time()
+        store.addPosition(group_id, [float(x) for x in reply.split(',')],
+                          sampleTime(before, last_track, '%sHP' % group_id,
+                                     reply))
+    result = controller.pauseForGroup(group_id)
+    stop_time = time.time()
+    store.addPosition(group_id, result.position, stop_time)
+    store.addFrames(camera.drain())
+    frames = store.since(start_time)
+    frames = frames[frames['host_time'] <= stop_time]
+  finally:
+    controller.groupVelocity(group_id, previous_velocity)
+  return FlyScanResult(frames, store.positionAt(group_id, frames['host_time']),
+                       start_time, stop_time)
+
+def sampleTime(written, read, line, reply):
+  """
+  Returns the host time at which the controller sampled the reply to a query
+  line written at written and read back at read.
+
+  The controller answers once the line has arrived, and the reply then takes
+  its own length to come back, so the round trip is split in proportion to
+  the bytes each way. Splitting it in half would date positions late by the
+  difference, and scans in opposite directions would disagree by twice the
+  distance travelled meanwhile.
+  """
+  sent = len(line) + 1
+  return written + (read - written) * sent / float(sent + len(reply))
+
+def exposurePositions(result, latency=None):
+  """
+  Returns the group position at the exposure of every frame of a
+  FlyScanResult, one row per frame.
+
+  Frames are shifted back by latency seconds between exposure and arrival;
+  by default one frame period.
+  """
+  host_time = result.frames['host_time']
+  if latency is None:
+    latency = numpy.median(numpy.diff(host_time)) if len(host_time) > 1 else 0.0
+  return numpy.column_stack([numpy.interp(host_time - latency, host_time,
+                                          result.stage[:, column])
+                             for column in xrange(result.stage.shape[1])])
+
+def beamCrossing(result, power_level, latency=None):
+  """
+  Estimates the x position of the beam from a FlyScanResult.
+
+  Only frames holding at least half of the peak power are used so that the
+  beam is well inside the sensor. Frames are shifted back by latency seconds
+  between exposure and arrival; by default one frame period. Returns a tuple
+  (x, spread, n_frames) or None if the beam was not seen.
+  """
+  frames = result.frames
+  if len(frames) == 0:
+    return None
+  power = frames['power']
+  seen = power > max(power_level, 0.5 * power.max())
+  if not seen.any():
+    return None
+  stage_x = exposurePositions(result, latency)[seen, 0]
+  estimates = stage_x - frames['centroid_x'][seen] / 1000.0
+  return numpy.median(estimates), estimates.std(), len(estimates)
@@ -0,0 +1,113 @@
+"""
+Homing several axes at once.
+
+The HomingManager starts the home search (OR) on every requested axis in one
+compound line and waits for all of them with a single WS/TP round trip, so
+homing takes as long as the slowest axis instead of the sum of all of them.
+An axis only counts as homed if its motor is still on and it ended at its
+home preset afterwards; otherwise a HomingError is raised. Axes homed through
+the manager are remembered in the controller shadow until the next reset,
+abort or error, and are skipped while the controller reports their motors
+on::
+
+    eps.homing.home([1, 2, 3])
+    eps.homing.home([2, 3])             # returns at once
+    eps.homing.home([2, 3], force=True)
+"""
+
+import motion
+import time
+
+class HomingError(IOError):
+  """
+  Raised when home searches did not complete.
+
+  Attributes:
+  axes -- Numbers of the axes that were not homed.
+  """
+
+  def __init__(self, axes, message):
+    self.axes = axes
+    IOError.__init__(self, message)
+
+class HomingManager(object):
+  """
+  Homes the axes of a StageController in parallel and only when needed.
+  """
+
+  def __init__(self, controller, settle=1000, tolerance=0.001):
+    """
+    Arguments:
+    controller -- StageController owning the axes.
+    settle -- Time the controller waits after the home searches end [ms].
+    tolerance -- Largest distance from the home preset of a homed axis.
+    """
+    self.controller = controller
+    self.settle = settle
+    self.tolerance = tolerance
+
+  def _stages(self, axes):
+    stages = [self.controller.axis1, self.controller.axis2,
+              self.controller.axis3]
+    return [stages[int(axis) - 1] for axis in axes]
+
+  def homed(self, axes):
+    """
+    Returns the subset of axes homed since the last reset with motors on.
+
+    Motor power is read from the controller in one round trip.
+    """
+    shadow = self.controller.shadow
+    candidates = [axis for axis in axes if shadow.isHomed(axis)]
+    if not candidates:
+      return []
+    replies = {}
+    with self.controller.batch():
+      for axis in candidates:
+        replies[axis] = self.controller.queue('MO', '?', axis)
+    return [axis for axis in candidates
+            if replies[axis].value().strip() == '1']
+
+  def home(self, axes, force=False):
+    """
+    Turns on and homes the given axes that are not homed yet.
+
+    Returns a motion.MotionResult whose position is a dictionary of the final
+    position by axis number for the axes that were homed. Raises HomingError
+    if a motor was off or an axis did not end at its home preset afterwards;
+    the cause is left in the error FIFO.
+
+    Arguments:
+    axes -- Axis numbers.
+    force -- Home every axis even if it is known to be homed.
+    """
+    start = time.time()
+    axes = [int(axis) for axis in axes]
+    if not force:
+      done = self.homed(axes)
+      axes = [axis for axis in axes if axis not in done]
+    if not axes:
+      return motion.MotionResult({}, time.time() - start)
+    stages = self._stages(axes)
+    with self.controller.batch():
+      for stage in stages:
+        stage.on()
+        stage.goToHome()
+    result = motion.waitForAll(self.controller, stages, delay=self.settle)
+    positions = dict((stage.axis, result.position[stage]) for stage in stages)
+    presets, powered = {}, {}
+    with self.controller.batch():
+      for axis in axes:
+        presets[axis] = self.controller.queue('SH', '?', axis)
+        powered[axis] = self.controller.queue('MO', '?', axis)
+    failed = [axis for axis in axes
+              if powered[axis].value().strip() != '1' or
+              abs(positions[str(axis)] - float(presets[axis].value())) >
+              self.tolerance]
+    for axis in axes:
+      if axis not in failed:
+        self.controller.shadow.setHomed(axis)
+    if failed:
+      raise HomingError(failed, 'Home search failed on axis %s.' %
+                        ', '.join(str(axis) for axis in failed))
+    return motion.MotionResult(positions, time.time() - start)
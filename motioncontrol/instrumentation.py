@@ -0,0 +1,239 @@
+"""
+Opt-in instrumentation of serial I/O.
+
+Instruments collect, for every attached StageController and LaserBeamProfiler,
+the commands written by mnemonic, the bytes and lines in each direction, the
+round trip latency of every query as a histogram, reply timeouts and the
+camera frames parsed, malformed or dropped. Nothing is measured until an
+Instruments object is attached; detached objects only test one attribute per
+I/O call::
+
+    instruments = instrumentation.Instruments()
+    instruments.attach(eps)
+    instruments.attachCamera(lbp)
+    instruments.startDumping('io-stats.json', interval=10)
+    beam.findSlope()
+    print instruments.snapshot()['latency']['HP']
+    instruments.stopDumping()
+"""
+
+import bisect
+import collections
+import json
+import math
+import os
+import re
+import threading
+import time
+
+_mnemonic_pattern = re.compile(r'^\s*\d*\s*([A-Za-z]{2})')
+
+class LatencyHistogram(object):
+  """
+  Histogram of durations in logarithmic bins.
+  """
+
+  def __init__(self, smallest=1e-5, largest=100.0, bins_per_decade=8):
+    decades = math.log10(largest / smallest)
+    n = int(round(decades * bins_per_decade))
+    self.bounds = [smallest * 10 ** (float(i) / bins_per_decade)
+                   for i in xrange(n + 1)]
+    self.counts = [0] * (len(self.bounds) + 1)
+    self.count = 0
+    self.total = 0.0
+    self.maximum = 0.0
+
+  def add(self, seconds):
+    self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+    self.count += 1
+    self.total += seconds
+    if seconds > self.maximum:
+      self.maximum = seconds
+
+  def quantile(self, fraction):
+    """
+    Returns the upper bound of the bin holding the given quantile.
+    """
+    if not self.count:
+      return 0.0
+    target = fraction * self.count
+    seen = 0
+    for index, count in enumerate(self.counts):
+      seen += count
+      if seen >= target:
+        return self.bounds[index] if index < len(self.bounds) \
+               else self.maximum
+    return self.maximum
+
+  def snapshot(self):
+    """
+    Returns the statistics and the non-empty bins as a dictionary.
+
+    Bins are listed as [upper bound in seconds, count]; the last bound of
+    None collects everything above the largest bound.
+    """
+    bounds = self.bounds + [None]
+    return {
+      'count': self.count,
+      'mean': self.total / self.count if self.count else 0.0,
+      'max': self.maximum,
+      'p50': self.quantile(0.5),
+      'p90': self.quantile(0.9),
+      'p99': self.quantile(0.99),
+      'bins': [[bound, count] for bound, count in zip(bounds, self.counts)
+               if count],
+    }
+
+class Instruments(object):
+  """
+  Counters and latency histograms of the attached controllers and cameras.
+  """
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.controllers = []
+    self.cameras = []
+    self.dumper = None
+    self.reset()
+
+  def reset(self):
+    """
+    Clears all counters and histograms.
+    """
+    with self.lock:
+      self.started = time.time()
+      self.commands = collections.Counter()
+      self.latency = {}
+      self.bytes_written = 0
+      self.bytes_read = 0
+      self.lines_written = 0
+      self.camera_bytes = 0
+
+  def attach(self, controller):
+    """
+    Starts instrumenting a StageController.
+    """
+    controller.instruments = self
+    controller.engine.instruments = self
+    self.controllers.append(controller)
+
+  def attachCamera(self, camera):
+    """
+    Starts instrumenting a LaserBeamProfiler.
+    """
+    camera.instruments = self
+    self.cameras.append(camera)
+
+  def detach(self):
+    """
+    Stops instrumenting everything attached.
+    """
+    for controller in self.controllers:
+      controller.instruments = None
+      controller.engine.instruments = None
+    for camera in self.cameras:
+      camera.instruments = None
+    self.controllers = []
+    self.cameras = []
+
+  # Hooks called by the instrumented objects.
+
+  def written(self, lines, n_bytes):
+    with self.lock:
+      self.lines_written += len(lines)
+      self.bytes_written += n_bytes
+      for line in lines:
+        for command in line.split(';'):
+          match = _mnemonic_pattern.match(command)
+          if match:
+            self.commands[match.group(1).upper()] += 1
+
+  def read(self, n_bytes):
+    with self.lock:
+      self.bytes_read += n_bytes
+
+  def roundTrip(self, name, seconds):
+    with self.lock:
+      histogram = self.latency.get(name)
+      if histogram is None:
+        histogram = self.latency[name] = LatencyHistogram()
+      histogram.add(seconds)
+
+  def cameraRead(self, n_bytes):
+    with self.lock:
+      self.camera_bytes += n_bytes
+
+  # Reports.
+
+  def snapshot(self):
+    """
+    Returns all counters and histograms as a JSON serializable dictionary.
+
+    Round trips are keyed by query mnemonic; 'camera' holds the time spent
+    in LaserBeamProfiler.read.
+    """
+    engines = collections.Counter()
+    for controller in self.controllers:
+      engines.update(controller.engine.statistics)
+    camera = collections.Counter()
+    for device in self.cameras:
+      camera.update(device.parser.statistics)
+      camera['dropped'] += device.dropped
+    with self.lock:
+      return {
+        'time': time.time(),
+        'elapsed': time.time() - self.started,
+        'controller': {
+          'commands': dict(self.commands),
+          'lines_written': self.lines_written,
+          'bytes_written': self.bytes_written,
+          'bytes_read': self.bytes_read,
+          'replies': engines['replies'],
+          'stray': engines['stray'],
+          'timeouts': engines['timeouts'],
+          'resyncs': engines['resyncs'],
+        },
+        'camera': {
+          'bytes_read': self.camera_bytes,
+          'frames': camera['frames'],
+          'malformed': camera['malformed'],
+          'overflows': camera['overflows'],
+          'dropped': camera['dropped'],
+        },
+        'latency': dict((name, histogram.snapshot())
+                        for name, histogram in self.latency.items()),
+      }
+
+  def dump(self, path):
+    """
+    Writes a snapshot to a JSON file, replacing it atomically.
+    """
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as output:
+      json.dump(self.snapshot(), output, indent=1, sort_keys=True)
+    os.rename(temporary, path)
+
+  def startDumping(self, path, interval=10.0):
+    """
+    Dumps a snapshot to path every interval seconds from a background thread.
+    """
+    self.stopDumping()
+    stop = threading.Event()
+    def run():
+      while not stop.wait(interval):
+        self.dump(path)
+      self.dump(path)
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    self.dumper = (thread, stop)
+
+  def stopDumping(self):
+    """
+    Stops periodic dumping after writing a final snapshot.
+    """
+    if self.dumper is not None:
+      thread, stop = self.dumper
+      stop.set()
+      thread.join()
+      self.dumper = None
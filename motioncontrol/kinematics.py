@@ -0,0 +1,206 @@
+"""
+Move durations predicted from the controller motion settings.
+
+Stages and groups move along jerk limited velocity profiles set by their
+velocity, acceleration, deceleration and jerk. The same MotionProfile drives
+the simulator, so predicted durations match simulated moves. A MoveEstimator
+reads the settings of a StageController, where the controller shadow usually
+answers them without serial traffic, and predicts lines, arcs and single axis
+moves::
+
+    estimator = kinematics.MoveEstimator(eps)
+    print estimator.groupLine(1, [10, -125])
+    print estimator.groupArc(1, [0, 0], 90)
+    print estimator.axisMove(1, 25.0)
+"""
+
+import math
+
+class MotionProfile(object):
+  """
+  A point-to-point motion profile over a path of the given length.
+
+  Velocity ramps are jerk limited: each ramp lasts v/a + a/j when the
+  acceleration limit is reached and 2*sqrt(v/j) otherwise, and follows a
+  raised-cosine velocity curve of that duration. The peak velocity is lowered
+  when the path is too short to reach the velocity limit.
+  """
+
+  def __init__(self, length, velocity, acceleration, deceleration, jerk):
+    self.length = abs(float(length))
+    velocity = abs(float(velocity))
+    peak = velocity
+    if self._rampLength(peak, acceleration, jerk) \
+        + self._rampLength(peak, deceleration, jerk) > self.length:
+      low, high = 0.0, velocity
+      for _ in xrange(60):
+        peak = (low + high) / 2.0
+        if self._rampLength(peak, acceleration, jerk) \
+            + self._rampLength(peak, deceleration, jerk) > self.length:
+          high = peak
+        else:
+          low = peak
+      peak = low
+    self.peak = peak
+    self.t_accel = self._rampTime(peak, acceleration, jerk)
+    self.t_decel = self._rampTime(peak, deceleration, jerk)
+    self.d_accel = peak * self.t_accel / 2.0
+    self.d_decel = peak * self.t_decel / 2.0
+    if peak > 0:
+      self.t_cruise = max(0.0, self.length - self.d_accel - self.d_decel) / peak
+    else:
+      self.t_cruise = 0.0
+    self.duration = self.t_accel + self.t_cruise + self.t_decel
+
+  @staticmethod
+  def _rampTime(velocity, acceleration, jerk):
+    if velocity <= 0 or acceleration <= 0:
+      return 0.0
+    if jerk <= 0 or velocity >= acceleration ** 2 / jerk:
+      return velocity / acceleration + (acceleration / jerk if jerk > 0 else 0)
+    return 2.0 * math.sqrt(velocity / jerk)
+
+  @classmethod
+  def _rampLength(cls, velocity, acceleration, jerk):
+    return velocity * cls._rampTime(velocity, acceleration, jerk) / 2.0
+
+  def distance(self, elapsed):
+    """
+    Returns the distance travelled along the path after elapsed seconds.
+    """
+    if elapsed <= 0:
+      return 0.0
+    if elapsed >= self.duration:
+      return self.length
+    if elapsed < self.t_accel:
+      u = elapsed / self.t_accel
+      return (self.peak * self.t_accel
+              * (u - math.sin(math.pi * u) / math.pi) / 2)
+    elapsed -= self.t_accel
+    if elapsed < self.t_cruise:
+      return self.d_accel + self.peak * elapsed
+    u = (elapsed - self.t_cruise) / self.t_decel
+    return (self.length - self.d_decel
+            + self.peak * self.t_decel
+            * (u + math.sin(math.pi * u) / math.pi) / 2)
+
+  def speed(self, elapsed):
+    """
+    Returns the speed along the path after elapsed seconds.
+    """
+    if elapsed <= 0 or elapsed >= self.duration:
+      return 0.0
+    if elapsed < self.t_accel:
+      return self.peak * (1 - math.cos(math.pi * elapsed / self.t_accel)) / 2
+    elapsed -= self.t_accel
+    if elapsed < self.t_cruise:
+      return self.peak
+    u = (elapsed - self.t_cruise) / self.t_decel
+    return self.peak * (1 + math.cos(math.pi * u)) / 2
+
+class Dynamics(object):
+  """
+  Velocity profile settings of a stage or group.
+
+  Attributes:
+  velocity -- Velocity (units/s).
+  acceleration -- Acceleration (units/s^2).
+  deceleration -- Deceleration (units/s^2).
+  jerk -- Jerk (units/s^3); 0 for trapezoidal profiles.
+  """
+
+  def __init__(self, velocity, acceleration, deceleration=None, jerk=0.0):
+    self.velocity = float(velocity)
+    self.acceleration = float(acceleration)
+    if deceleration is None:
+      deceleration = acceleration
+    self.deceleration = float(deceleration)
+    self.jerk = float(jerk)
+
+  def profile(self, length):
+    """
+    Returns the MotionProfile of a move over the given path length.
+    """
+    return MotionProfile(length, self.velocity, self.acceleration,
+                         self.deceleration, self.jerk)
+
+  def duration(self, length):
+    """
+    Returns the time of a rest to rest move over the given path length.
+    """
+    return self.profile(length).duration
+
+  def __repr__(self):
+    return 'Dynamics(%g, %g, %g, %g)' % (self.velocity, self.acceleration,
+                                         self.deceleration, self.jerk)
+
+def lineLength(origin, target):
+  """
+  Returns the length of the straight path between two points.
+  """
+  return math.sqrt(sum((float(b) - float(a)) ** 2
+                       for a, b in zip(origin, target)))
+
+def arcLength(origin, center, sweep):
+  """
+  Returns the length of an arc from origin around center by sweep degrees.
+  """
+  radius = math.hypot(float(origin[0]) - float(center[0]),
+                      float(origin[1]) - float(center[1]))
+  return radius * abs(math.radians(float(sweep)))
+
+def _floats(response):
+  return [float(x.strip()) for x in response.split(',')]
+
+class MoveEstimator(object):
+  """
+  Predicts the duration of the moves of a StageController.
+  """
+
+  def __init__(self, controller):
+    self.controller = controller
+
+  def groupDynamics(self, group_id):
+    """
+    Returns the Dynamics of a group, read in one round trip.
+    """
+    with self.controller.batch():
+      replies = [self.controller.queue(mnemonic, '?', group_id)
+                 for mnemonic in ('HV', 'HA', 'HD', 'HJ')]
+    return Dynamics(*[float(reply.value()) for reply in replies])
+
+  def axisDynamics(self, axis):
+    """
+    Returns the Dynamics of a single axis, read in one round trip.
+    """
+    with self.controller.batch():
+      replies = [self.controller.queue(mnemonic, '?', axis)
+                 for mnemonic in ('VA', 'AC', 'AG', 'JK')]
+    return Dynamics(*[float(reply.value()) for reply in replies])
+
+  def groupLine(self, group_id, target, origin=None):
+    """
+    Returns the duration of a group line move to target.
+
+    The move starts from origin, by default the current group position.
+    """
+    if origin is None:
+      origin = _floats(self.controller.query('HP', '', group_id))
+    return self.groupDynamics(group_id).duration(lineLength(origin, target))
+
+  def groupArc(self, group_id, center, sweep, origin=None):
+    """
+    Returns the duration of a group arc around center by sweep degrees.
+    """
+    if origin is None:
+      origin = _floats(self.controller.query('HP', '', group_id))
+    return self.groupDynamics(group_id).duration(arcLength(origin, center,
+                                                           sweep))
+
+  def axisMove(self, axis, target, origin=None):
+    """
+    Returns the duration of a single axis move to target.
+    """
+    if origin is None:
+      origin = float(self.controller.query('TP', '', axis))
+    return self.axisDynamics(axis).duration(float(target) - float(origin))
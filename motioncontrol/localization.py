@@ -0,0 +1,230 @@
+"""
+Model-based localisation of the beam on the camera.
+
+While the beam lies on the sensor the camera reports where it is: the centroid
+moves linearly with the stage, centroid_x = gain * (x - x_beam), with a gain
+of 1000 micrometers per millimeter for a camera travelling with the x stage.
+BeamLocator therefore first probes at sensor-width spacing outward from a hint
+until the beam is seen, then repeatedly fits the line through all readings
+taken with the whole beam on the sensor, moves to the fitted centre and takes
+more readings there. It stops once the centre is known to within a tolerance,
+which typically takes a handful of moves instead of the dozens of the step
+ladder::
+
+    locator = localization.BeamLocator(constraint, tolerance=0.005)
+    result = locator.locate(-125)
+    print result.position, result.uncertainty, result.moves
+"""
+
+import math
+import numpy
+
+class Localization(object):
+  """
+  Outcome of a beam localisation.
+
+  Attributes:
+  position -- Group position [x, z] with the beam centred, or None if the
+              beam was not found.
+  uncertainty -- Standard error of the fitted beam x position (mm).
+  moves -- Number of group moves made.
+  frames -- Number of camera frames used.
+  """
+
+  def __init__(self, position, uncertainty, moves, frames):
+    self.position = position
+    self.uncertainty = uncertainty
+    self.moves = moves
+    self.frames = frames
+
+  def __repr__(self):
+    return 'Localization(%r, uncertainty=%.4f, moves=%d, frames=%d)' % (
+      self.position, self.uncertainty, self.moves, self.frames)
+
+def fitCenter(positions, centroids, weights, gain=1000.0, min_spread=0.1):
+  """
+  Fits centroid_x = gain * (x - x_beam) by weighted least squares.
+
+  The gain is only fitted when the probed positions span at least min_spread
+  millimeters, otherwise the nominal value is used. Returns (x_beam,
+  uncertainty, gain) with x_beam and its standard error in millimeters.
+  """
+  x = numpy.asarray(positions, dtype='f8')
+  c = numpy.asarray(centroids, dtype='f8')
+  w = numpy.asarray(weights, dtype='f8')
+  n = len(x)
+  if x.max() - x.min() >= min_spread and n > 2:
+    x_mean = numpy.average(x, weights=w)
+    c_mean = numpy.average(c, weights=w)
+    gain = (numpy.sum(w * (x - x_mean) * (c - c_mean))
+            / numpy.sum(w * (x - x_mean) ** 2))
+    x_beam = x_mean - c_mean / gain
+    dof = n - 2
+  else:
+    x_beam = numpy.average(x - c / gain, weights=w)
+    dof = n - 1
+  residuals = c - gain * (x - x_beam)
+  if dof > 0:
+    variance = numpy.sum(w * residuals ** 2) / numpy.sum(w) * n / dof
+  else:
+    variance = float('inf')
+  uncertainty = math.sqrt(variance / n) / abs(gain)
+  return x_beam, uncertainty, gain
+
+class BeamLocator(object):
+  """
+  Fit-then-refine beam search for a ConstrainToBeam group.
+  """
+
+  def __init__(self, constraint, **kwargs):
+    """
+    Option=default values are as follows:
+    tolerance=0.005 - Required uncertainty of the beam centre (mm).
+    frames_per_probe=4 - Camera frames read at every probe position.
+    sensor_half_width=3.0 - Half width of the camera sensor (mm).
+    velocity=30 - Group velocity while probing.
+    max_moves=80 - Give up after this many moves.
+    """
+    self.constraint = constraint
+    self.tolerance = kwargs.pop('tolerance', 0.005)
+    self.frames_per_probe = kwargs.pop('frames_per_probe', 4)
+    self.sensor_half_width = kwargs.pop('sensor_half_width', 3.0)
+    self.velocity = kwargs.pop('velocity', 30)
+    self.max_moves = kwargs.pop('max_moves', 80)
+    self.moves = 0
+    self.readings = []
+    self.rough = None
+
+  def probe(self, x, z):
+    """
+    Moves the group to (x, z) and reads the camera there.
+
+    Returns the readings that saw the whole beam, as collect().
+    """
+    constraint = self.constraint
+    controller = constraint.controller
+    controller.groupMoveLine(constraint.group_id, [x, z])
+    position = controller.pauseForGroup(constraint.group_id).position
+    self.moves += 1
+    constraint.store.addPosition(constraint.group_id, position)
+    constraint.camera.drain()
+    constraint.sample()
+    return self.collect(position[0])
+
+  def collect(self, x):
+    """
+    Reads frames_per_probe frames with the group standing at x.
+
+    Returns the readings that saw the whole beam on the sensor as (x,
+    centroid_x, power) tuples; all are also kept in self.readings. A beam
+    clipped by the sensor edge only gives a rough position, kept in
+    self.rough.
+    """
+    constraint = self.constraint
+    half = 1000.0 * self.sensor_half_width
+    seen = []
+    for i in xrange(self.frames_per_probe):
+      reading = constraint.sample()
+      if reading['power'] < constraint.power_level:
+        continue
+      self.rough = x - reading['centroid_x'] / 1000.0
+      if abs(reading['centroid_x']) + reading['width_1'] / 2 >= half:
+        continue
+      seen.append((x, reading['centroid_x'], reading['power']))
+    self.readings.extend(seen)
+    return seen
+
+  def acquire(self, z, hint):
+    """
+    Probes outward from hint at sensor-width spacing until the beam is seen.
+
+    Returns the x of the first probe that saw the beam, even if clipped, or
+    None.
+    """
+    constraint = self.constraint
+    lower, upper = constraint.lower_limit_x, constraint.upper_limit_x
+    step = 1.8 * self.sensor_half_width
+    k = 0
+    while self.moves < self.max_moves:
+      offsets = [0] if k == 0 else [k * step, -k * step]
+      inside = False
+      for offset in offsets:
+        x = hint + offset
+        if not lower <= x <= upper:
+          continue
+        inside = True
+        if self.probe(x, z) or self.rough is not None:
+          return x
+      if not inside:
+        return None
+      k += 1
+    return None
+
+  def fit(self):
+    """
+    Fits the beam centre to the readings taken so far.
+
+    Readings are weighted by their power relative to the brightest one so that
+    partially clipped frames count less. Returns (x_beam, uncertainty).
+    """
+    readings = numpy.array(self.readings)
+    power = readings[:, 2]
+    keep = power >= 0.5 * power.max()
+    x_beam, uncertainty, gain = fitCenter(readings[keep, 0], readings[keep, 1],
+                                          power[keep] / power.max())
+    return x_beam, uncertainty
+
+  def check(self, x, z):
+    """
+    Probes once at (x, z) to confirm a previously known beam position.
+
+    Returns (x_beam, uncertainty) fitted to the readings taken there, or None
+    if the whole beam was not seen.
+    """
+    constraint = self.constraint
+    self.moves = 0
+    self.readings = []
+    self.rough = None
+    constraint.controller.groupVelocity(constraint.group_id, self.velocity)
+    if not self.probe(x, z):
+      return None
+    return self.fit()
+
+  def locate(self, z, hint=None):
+    """
+    Centres the beam on the camera at the given z and returns a Localization.
+
+    The search starts at hint, by default the current x of the group.
+    """
+    constraint = self.constraint
+    controller = constraint.controller
+    lower, upper = constraint.lower_limit_x, constraint.upper_limit_x
+    self.moves = 0
+    self.readings = []
+    self.rough = None
+    if hint is None:
+      hint = controller.groupPosition(constraint.group_id)[0]
+    controller.groupVelocity(constraint.group_id, self.velocity)
+    x = self.acquire(z, min(max(hint, lower), upper))
+    while x is not None and not self.readings:
+      if self.rough is None or self.moves >= self.max_moves:
+        x = None
+      else:
+        x, self.rough = min(max(self.rough, lower), upper), None
+        self.probe(x, z)
+    if x is None:
+      return Localization(None, float('inf'), self.moves, len(self.readings))
+    while True:
+      x_beam, uncertainty = self.fit()
+      x_beam = min(max(x_beam, lower), upper)
+      if abs(x_beam - x) < self.tolerance and uncertainty < self.tolerance:
+        break
+      if self.moves >= self.max_moves:
+        break
+      if abs(x_beam - x) >= self.tolerance:
+        x = x_beam
+        self.probe(x, z)
+      elif not self.collect(x):
+        break
+    position = controller.groupPosition(constraint.group_id)
+    return Localization(position, uncertainty, self.moves, len(self.readings))
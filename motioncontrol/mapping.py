@@ -0,0 +1,300 @@
+"""
+Raster maps of the beam over the travel range of a camera group.
+
+The camera is moved over an x-z grid and power and centroid are recorded at
+every grid point into dense NumPy arrays, one row per z and one column per x.
+The grid points are visited in an order that keeps the group travel short:
+
+'serpentine' -- Row by row, reversing the x direction on every row, from
+                the grid corner nearest to the group.
+'nearest' -- Nearest neighbour tour from the current group position,
+             improved by 2-opt. Pays off for masked, irregular point sets.
+'raster' -- Row by row, always in increasing x.
+
+With fly set, every row is instead fly-scanned at constant velocity in
+serpentine order and the frames are binned into the x columns by the group
+position at their exposure. Rows without any point in the mask are not
+scanned and frames binned into masked out cells are dropped::
+
+    beam_map = beam.mapBeam(1.0, 10.0, order='serpentine')
+    beam_map = beam.mapBeam(0.5, 10.0, fly=True, velocity=5)
+    print beam_map.power.shape, beam_map.travel
+"""
+
+import flyscan
+import math
+import numpy
+import time
+
+ORDERS = ('serpentine', 'nearest', 'raster')
+
+class BeamMap(object):
+  """
+  Camera readings on an x-z grid.
+
+  Grids have one row per z and one column per x; cells that were not
+  visited or saw no frame are NaN.
+
+  Attributes:
+  x, z -- Grid coordinates.
+  power, centroid_x, centroid_y, width, height -- Mean camera readings.
+  frames -- Number of frames averaged in every cell.
+  travel -- Length of the group path [mm].
+  moves -- Number of group moves.
+  elapsed -- Seconds taken by the map.
+  """
+
+  def __init__(self, x, z):
+    self.x = x
+    self.z = z
+    shape = (len(z), len(x))
+    self.power = numpy.zeros(shape)
+    self.centroid_x = numpy.zeros(shape)
+    self.centroid_y = numpy.zeros(shape)
+    self.width = numpy.zeros(shape)
+    self.height = numpy.zeros(shape)
+    self.frames = numpy.zeros(shape, dtype='i8')
+    self.travel = 0.0
+    self.moves = 0
+    self.elapsed = 0.0
+
+  def add(self, rows, columns, frames):
+    """
+    Accumulates frames, a structured array or list of frame dictionaries,
+    into the cells given by the rows and columns arrays.
+    """
+    cells = (numpy.asarray(rows), numpy.asarray(columns))
+    def values(key):
+      return numpy.array([frame[key] for frame in frames])
+    numpy.add.at(self.power, cells, values('power'))
+    numpy.add.at(self.centroid_x, cells, values('centroid_x'))
+    numpy.add.at(self.centroid_y, cells, values('centroid_y'))
+    numpy.add.at(self.width, cells, values('width_1'))
+    numpy.add.at(self.height, cells, values('height_1'))
+    numpy.add.at(self.frames, cells, 1)
+
+  def finish(self):
+    """
+    Turns the accumulated sums into means.
+    """
+    empty = self.frames == 0
+    count = numpy.where(empty, 1, self.frames)
+    for name in ('power', 'centroid_x', 'centroid_y', 'width', 'height'):
+      grid = getattr(self, name) / count
+      grid[empty] = numpy.nan
+      setattr(self, name, grid)
+
+  def peak(self):
+    """
+    Returns the (x, z) grid point of highest power, or None.
+    """
+    if numpy.isnan(self.power).all():
+      return None
+    row, column = numpy.unravel_index(numpy.nanargmax(self.power),
+                                      self.power.shape)
+    return [self.x[column], self.z[row]]
+
+  def __repr__(self):
+    return 'BeamMap(%dx%d, travel=%.1f, moves=%d, elapsed=%.1f)' % (
+      len(self.z), len(self.x), self.travel, self.moves, self.elapsed)
+
+def gridAxis(lower, upper, step):
+  """
+  Returns coordinates from lower to upper every step, upper included.
+  """
+  count = int(math.floor((upper - lower) / float(step) + 1e-9))
+  axis = lower + step * numpy.arange(count + 1)
+  if upper - axis[-1] > 1e-9:
+    axis = numpy.append(axis, upper)
+  return axis
+
+def pathLength(points, order, start=None):
+  """
+  Returns the length of the path visiting points in order from start.
+  """
+  path = numpy.asarray(points, dtype='f8')[order]
+  if start is not None:
+    path = numpy.vstack((numpy.asarray(start, dtype='f8'), path))
+  return numpy.sum(numpy.hypot(*numpy.diff(path, axis=0).T))
+
+def serpentineOrder(n_x, n_z, mask=None, reverse_x=False, reverse_z=False):
+  """
+  Returns the flat indices of an n_z by n_x grid row by row, alternating the
+  direction of the rows. Cells false in mask are left out.
+
+  The first row is the last one if reverse_z is set and is run towards
+  decreasing x if reverse_x is set.
+  """
+  columns = numpy.arange(n_x)[::-1 if reverse_x else 1]
+  rows = numpy.arange(n_z)[::-1 if reverse_z else 1]
+  indices = numpy.concatenate([row * n_x + (columns if k % 2 == 0
+                                            else columns[::-1])
+                               for k, row in enumerate(rows)])
+  if mask is not None:
+    indices = indices[numpy.asarray(mask).ravel()[indices]]
+  return indices
+
+def nearestOrder(points, start=None):
+  """
+  Returns the order of a nearest neighbour tour of points from start, by
+  default the first point.
+  """
+  points = numpy.asarray(points, dtype='f8')
+  left = numpy.ones(len(points), dtype=bool)
+  order = []
+  current = points[0] if start is None else numpy.asarray(start, dtype='f8')
+  for i in xrange(len(points)):
+    distance = numpy.hypot(points[:, 0] - current[0],
+                           points[:, 1] - current[1])
+    distance[~left] = numpy.inf
+    index = int(numpy.argmin(distance))
+    order.append(index)
+    left[index] = False
+    current = points[index]
+  return numpy.array(order, dtype='i8')
+
+def twoOpt(points, order, start=None, max_passes=20):
+  """
+  Shortens an open path through points by 2-opt segment reversals.
+
+  The path starts at start, which stays fixed, and may end anywhere. Passes
+  are repeated until one finds no improvement or max_passes is reached.
+  Returns the improved order.
+  """
+  order = numpy.array(order, dtype='i8')
+  points = numpy.asarray(points, dtype='f8')
+  if start is None:
+    head, order = order[:1], order[1:]
+    start = points[head[0]]
+  else:
+    head = order[:0]
+  n = len(order)
+  for repeat in xrange(max_passes):
+    improved = False
+    for i in xrange(n - 1):
+      path = numpy.vstack((start, points[order]))
+      a, b = path[i], path[i + 1]
+      c = path[i + 2:]
+      d = numpy.vstack((path[i + 3:], [numpy.nan, numpy.nan]))
+      ab = math.hypot(b[0] - a[0], b[1] - a[1])
+      ac = numpy.hypot(c[:, 0] - a[0], c[:, 1] - a[1])
+      bd = numpy.hypot(d[:, 0] - b[0], d[:, 1] - b[1])
+      cd = numpy.hypot(d[:, 0] - c[:, 0], d[:, 1] - c[:, 1])
+      # Reversing up to the last point removes no edge after it.
+      bd[-1] = cd[-1] = 0.0
+      gain = ac + bd - ab - cd
+      j = int(numpy.argmin(gain))
+      if gain[j] < -1e-9:
+        order[i:i + j + 2] = order[i:i + j + 2][::-1].copy()
+        improved = True
+    if not improved:
+      break
+  return numpy.concatenate((head, order))
+
+def visitOrder(points, n_x, n_z, order, start=None, mask=None):
+  """
+  Returns the flat grid indices of points in the named order.
+  """
+  if order == 'serpentine':
+    tours = [serpentineOrder(n_x, n_z, mask, reverse_x, reverse_z)
+             for reverse_x in (False, True) for reverse_z in (False, True)]
+    return min(tours, key=lambda tour: pathLength(points, tour, start))
+  indices = numpy.arange(n_x * n_z)
+  if mask is not None:
+    indices = indices[numpy.asarray(mask).ravel()]
+  if order == 'raster':
+    return indices
+  if order == 'nearest':
+    tour = nearestOrder(points[indices], start)
+    return indices[twoOpt(points[indices], tour, start)]
+  raise ValueError('Unknown point order %r; use one of %s.'
+                   % (order, ', '.join(ORDERS)))
+
+def rasterMap(beam, x_step, z_step, order='serpentine', fly=False,
+              velocity=None, frames_per_point=1, mask=None):
+  """
+  Maps the beam over the travel limits of a ConstrainToBeam.
+
+  Returns a BeamMap. Every camera frame and group position seen is also
+  kept in the beam's sample store.
+
+  Arguments:
+  beam -- ConstrainToBeam whose group, camera and limits are used.
+  x_step, z_step -- Grid spacing [mm].
+  order -- Point order, one of ORDERS. Rows are always fly-scanned in
+           serpentine order, so fly only accepts 'serpentine'.
+  fly -- Fly-scan the rows instead of stopping at every point.
+  velocity -- Group velocity of the point moves or fly-scans. The current
+              group velocity, or fly_velocity for fly-scans, if None.
+  frames_per_point -- Frames averaged at every point of a stepped map.
+  mask -- Boolean grid, shaped as the map, of the points to visit.
+  """
+  if order not in ORDERS:
+    raise ValueError('Unknown point order %r; use one of %s.'
+                     % (order, ', '.join(ORDERS)))
+  if fly and order != 'serpentine':
+    raise ValueError('Fly-scanned maps run in serpentine order.')
+  start_time = time.time()
+  controller, group_id = beam.controller, beam.group_id
+  x = gridAxis(beam.lower_limit_x, beam.upper_limit_x, x_step)
+  z = gridAxis(beam.lower_limit_z, beam.upper_limit_z, z_step)
+  if mask is not None and numpy.shape(mask) != (len(z), len(x)):
+    raise ValueError('The mask must be shaped as the %dx%d map.'
+                     % (len(z), len(x)))
+  result = BeamMap(x, z)
+  points = numpy.column_stack((numpy.tile(x, len(z)), numpy.repeat(z, len(x))))
+  start = controller.groupPosition(group_id)
+  if fly:
+    _flyRows(beam, result, velocity, start, mask)
+  else:
+    indices = visitOrder(points, len(x), len(z), order, start, mask)
+    result.travel = pathLength(points, indices, start)
+    if velocity is not None:
+      controller.groupVelocity(group_id, velocity)
+    for index in indices:
+      controller.groupMoveLine(group_id, points[index].tolist())
+      position = controller.pauseForGroup(group_id).position
+      beam.store.addPosition(group_id, position)
+      beam.camera.drain()
+      readings = [beam.sample() for i in xrange(frames_per_point)]
+      row, column = divmod(index, len(x))
+      result.add([row] * len(readings), [column] * len(readings), readings)
+    result.moves = len(indices)
+  result.finish()
+  result.elapsed = time.time() - start_time
+  return result
+
+def _flyRows(beam, result, velocity, position, mask=None):
+  """
+  Fly-scans the rows of result in serpentine order and bins the frames.
+
+  Only rows with points in mask are scanned and only frames of its cells
+  are kept.
+  """
+  if velocity is None:
+    velocity = beam.fly_velocity
+  x, z = result.x, result.z
+  if mask is None:
+    mask = numpy.ones((len(z), len(x)), dtype=bool)
+  mask = numpy.asarray(mask, dtype=bool)
+  rows = [row for row in xrange(len(z)) if mask[row].any()]
+  if abs(z[-1] - position[1]) < abs(z[0] - position[1]):
+    rows.reverse()
+  ends = (x[0], x[-1])
+  if abs(x[-1] - position[0]) < abs(x[0] - position[0]):
+    ends = (x[-1], x[0])
+  for row in rows:
+    z_row = z[row]
+    scan = flyscan.scan(beam, [ends[0], z_row], [ends[1], z_row], velocity)
+    result.travel += (math.hypot(ends[0] - position[0], z_row - position[1])
+                      + abs(ends[1] - ends[0]))
+    position = [ends[1], z_row]
+    ends = ends[::-1]
+    result.moves += 2
+    if len(scan.frames) == 0:
+      continue
+    exposed = flyscan.exposurePositions(scan)[:, 0]
+    columns = numpy.searchsorted((x[1:] + x[:-1]) / 2, exposed)
+    keep = mask[row, columns]
+    result.add(numpy.repeat(row, keep.sum()), columns[keep],
+               scan.frames[keep])
@@ -0,0 +1,437 @@
+"""
+Declarative table of EPS300 commands.
+
+The methods of Stage and StageController that send a single command are
+generated from the tables below. Every Command names its mnemonic, whether it
+is addressed to an axis, to a numbered group, program or label, or to the
+controller as a whole, how its argument is encoded, how its reply is parsed and
+the units of the value. Encoders and parsers are looked up once when the
+methods are generated, so a call formats one line and, for queries, parses one
+reply. Commands that take a value query it when called with '?', the default.
+
+Queries print their value only when the controller's echo attribute is set::
+
+    eps.echo = True
+    eps.axis1.velocity()          # prints "5.0 mm/s"
+
+Transports that format lines themselves can use Command.encode and
+Command.parse directly. The non-blocking asynchronous.AsyncStageController
+generates its methods from the same tables with Command.submit, which returns
+a Future of the parsed reply.
+"""
+
+# Names of the SN unit codes.
+UNIT_NAMES = ['encoder-counts', 'motor-steps', 'mm', u'\u03BCm', 'in', 'mil',
+              u'\u03BCin', u'\u00B0', 'grade', 'rad', 'mrad', u'\u03BCrad']
+
+def _joined(values):
+  return ','.join(map(str, values))
+
+ENCODERS = {
+  'value': str,
+  'list': _joined,
+}
+
+PARSERS = {
+  'float': float,
+  'int': int,
+  'floats': lambda line: [float(x) for x in line.split(',')],
+  'ints': lambda line: [int(x) for x in line.split(',') if x.strip()],
+  # MD? and HS? report 0 while in motion.
+  'moving': lambda line: '0' in line,
+  'text': lambda line: line.strip(),
+  'units': lambda line: UNIT_NAMES[int(line)],
+}
+
+UNIT_SUFFIXES = {'position': '', 'velocity': '/s', 'acceleration': '/s^2'}
+
+class Command(object):
+  """
+  One entry of a command table.
+
+  Attributes:
+  name -- Name of the generated method.
+  mnemonic -- Two letter EPS300 mnemonic.
+  argument -- Name of the method argument, or None for commands without one.
+  encoding -- Key of ENCODERS formatting the argument.
+  default -- Default of the argument; '?' makes the call a query.
+  parameter -- Fixed parameter of commands without an argument.
+  reply -- Key of PARSERS for the reply, or None if there is no reply.
+  units -- Kind of quantity echoed: 'position', 'velocity', 'acceleration'
+           or None.
+  doc -- Docstring of the generated method.
+  """
+
+  def __init__(self, name, mnemonic, argument=None, reply=None, **kwargs):
+    self.name = name
+    self.mnemonic = mnemonic
+    self.argument = argument
+    self.reply = reply
+    self.encoding = kwargs.pop('encoding', 'value')
+    self.default = kwargs.pop('default', '?')
+    self.parameter = kwargs.pop('parameter', '')
+    self.units = kwargs.pop('units', None)
+    self.doc = kwargs.pop('doc', '')
+    self.encode = ENCODERS[self.encoding]
+    self.parse = PARSERS[reply] if reply is not None else None
+
+  def parameterFor(self, args, kwargs):
+    """
+    Returns the encoded parameter of a generated method call.
+    """
+    if self.argument is None:
+      return self.parameter
+    if len(args) > 1 or [key for key in kwargs if key != self.argument]:
+      raise TypeError('%s() takes one %s argument.' % (self.name,
+                                                       self.argument))
+    value = args[0] if args else kwargs.get(self.argument, self.default)
+    if value is None:
+      raise TypeError('%s() requires a %s argument.' % (self.name,
+                                                        self.argument))
+    return '?' if value == '?' else self.encode(value)
+
+  def expectsReply(self, parameter):
+    """
+    Returns True if the command sent with the given parameter is a query.
+    """
+    return self.parse is not None and (self.argument is None or
+                                       parameter == '?')
+
+  def execute(self, controller, prefix, args, kwargs, stage=None):
+    """
+    Sends the command with the arguments of a generated method call.
+
+    Returns the parsed reply of a query. Setting a numeric axis value returns
+    the value as a float.
+    """
+    parameter = self.parameterFor(args, kwargs)
+    if not self.expectsReply(parameter):
+      controller.send(self.mnemonic, parameter, prefix)
+      if stage is not None and self.reply == 'float':
+        return self.parse(parameter)
+      return None
+    value = self.parse(controller.query(self.mnemonic, parameter, prefix))
+    if controller.echo:
+      self.echo(value, controller, stage)
+    return value
+
+  def submit(self, controller, prefix, args, kwargs, stage=None):
+    """
+    Queues the command on an asynchronous.AsyncStageController with the
+    arguments of a generated method call.
+
+    Returns a Future of the parsed reply, or of None for commands without one.
+    """
+    parameter = self.parameterFor(args, kwargs)
+    if not self.expectsReply(parameter):
+      return controller.send(self.mnemonic, parameter, prefix)
+    return controller.query(self.mnemonic, parameter, prefix, self.parse)
+
+  def echo(self, value, controller, stage):
+    if self.units is None or stage is None:
+      print value
+      return
+    units = PARSERS['units'](controller.query('SN', '?', stage.axis))
+    print u'%s %s%s' % (value, units, UNIT_SUFFIXES[self.units])
+
+def _axisMethod(command, call):
+  def method(self, *args, **kwargs):
+    return call(command, self.controller, self.axis, args, kwargs, self)
+  return method
+
+def _prefixedMethod(command, call):
+  def method(self, prefix, *args, **kwargs):
+    return call(command, self, prefix, args, kwargs)
+  return method
+
+def _controllerMethod(command, call):
+  def method(self, *args, **kwargs):
+    return call(command, self, '', args, kwargs)
+  return method
+
+def defineMethods(cls, table, scope, call=Command.execute):
+  """
+  Adds the methods of a command table to a class.
+
+  scope is 'axis' for Stage, 'prefixed' for StageController methods taking a
+  group, program or label number first, or 'controller'. call is the Command
+  method running a call: execute for blocking classes, submit for
+  asynchronous ones.
+  """
+  make = {'axis': _axisMethod, 'prefixed': _prefixedMethod,
+          'controller': _controllerMethod}[scope]
+  for command in table:
+    method = make(command, call)
+    method.__name__ = command.name
+    method.__doc__ = command.doc
+    method.command = command
+    setattr(cls, command.name, method)
+
+AXIS_COMMANDS = [
+  Command('targetedPosition', 'DP', reply='float', parameter='?',
+          units='position', doc="""
+    Returns the position the stage is currently targeting.
+    """),
+  Command('targetedVelocity', 'DV', reply='float', units='velocity', doc="""
+    Returns the stage's targeted velocity.
+    """),
+  Command('actualPosition', 'TP', reply='float', units='position', doc="""
+    Returns the position reported by the stage encoder.
+    """),
+  Command('stageID', 'ID', reply='text', doc="""
+    Returns stage model and serial number.
+    """),
+  Command('getMotionStatus', 'MD', reply='moving', parameter='?', doc="""
+    Return false for stopped, true for in motion.
+    """),
+  Command('isOn', 'MO', reply='int', parameter='?', doc="""
+    Returns 1 if the axis motor is on, 0 otherwise.
+    """),
+  Command('on', 'MO', doc="""
+    Turns the axis motor on.
+    """),
+  Command('off', 'MF', doc="""
+    Turns the axis motor off.
+    """),
+  Command('defineHome', 'DH', 'position', 'float', units='position', doc="""
+    Sets the stage home position to given position in current units.
+    """),
+  Command('moveToLimit', 'MT', 'direction', 'int', doc="""
+    Given the argument '+' or '-', moves stage that hardware limit.
+
+    Without an argument returns 1 once the motion is done.
+    """),
+  Command('moveIndefinately', 'MV', 'direction', 'int', doc="""
+    Initiates continuous motion in the given '+' or '-' direction.
+
+    Without an argument returns 1 once the motion is done.
+    """),
+  Command('moveToNextIndex', 'MZ', 'direction', 'int', doc="""
+    Moves to the nearest index in the given '+' or '-' direction.
+
+    Without an argument returns 1 once the motion is done.
+    """),
+  Command('goToHome', 'OR', doc="""
+    Moves the stage to the home position.
+    """),
+  Command('position', 'PA', 'absolute_position', 'float', units='position',
+          doc="""
+    Moves the stage to an absolute position.
+
+    Without an argument returns the targeted absolute position.
+    """),
+  Command('move', 'PR', 'relative_position', 'float', default=None,
+          units='position', doc="""
+    Moves the stage the given relative position.
+    """),
+  Command('stop', 'ST', doc="""
+    Stops motion on this axis with predefined acceleration.
+    """),
+  Command('followingError', 'FE', 'error', 'float', units='position', doc="""
+    Sets or returns the maximum following error threshold.
+    """),
+  Command('stepResoltion', 'FR', 'resolution', 'float', units='position',
+          doc="""
+    Sets or returns the encoder full-step resolution for a Newport Unidrive
+    compatible programmable driver with step motor axis.
+    """),
+  Command('gearRatio', 'GR', 'gear_ratio', 'float', doc="""
+    Sets or returns the master-slave reduction ratio for a slave axis.
+
+    Use this command very carefully. The slave axis will have its speed and
+    acceleration in the same ratio as the position.
+    Also, ensure that the ratio used for the slave axis does not cause
+    overflow of this axis parameters (speed, acceleration), especially with
+    ratios greater than 1.
+    """),
+  Command('units', 'SN', 'units', 'units', doc="""
+    Sets the stage displacement units from given integer.
+    If no argument is given, current unit setting is reported.
+
+    Possible units:
+    0 -- Encoder counts         6 -- micro-inches
+    1 -- Motor steps            7 -- degrees
+    2 -- millimeters            8 -- gradient
+    3 -- micrometers            9 -- radians
+    4 -- inches                10 -- milliradian
+    5 -- mils (milli-inches)   11 -- microradian
+    """),
+  Command('acceleration', 'AC', 'acceleration', 'float',
+          units='acceleration', doc="""
+    Sets the stage acceleration.
+    """),
+  Command('eStopAcceleration', 'AE', 'acceleration', 'float',
+          units='acceleration', doc="""
+    Sets the stage emergency stop acceleration.
+    """),
+  Command('deceleration', 'AG', 'deceleration', 'float',
+          units='acceleration', doc="""
+    Sets te stage deceleration.
+    """),
+  Command('accelerationLimit', 'AU', 'acceleration', 'float',
+          units='acceleration', doc="""
+    Sets the maximum allowed stage acceleration/deceleration.
+
+    Stage will error out if this limit is exceeded.
+    """),
+  Command('backlashCompensation', 'BA', 'compensation', 'float',
+          units='position', doc="""
+    Set or report the backlash compensation in current units.
+
+    Maximum compensation is equivelent of 10000 encoder counts.
+    """),
+  Command('homePreset', 'SH', 'home_position', 'float', units='position',
+          doc="""
+    Sets the absolute position ascribed to the home position.
+    """),
+  Command('velocity', 'VA', 'velocity', 'float', units='velocity', doc="""
+    Sets the stage velocity.
+    """),
+  Command('velocityLimit', 'VU', 'velocity', 'float', units='velocity',
+          doc="""
+    Sets the maximum allowed stage velocity.
+
+    Stage will error out if this limit is exceeded.
+    """),
+  Command('waitUntilPosition', 'WP', 'position', default=None, doc="""
+    Pause EPS command execution until stage is at position.
+
+    This does not pause execution of python code!
+    """),
+  Command('waitUntilStopped', 'WS', 'time', default='', doc="""
+    Pause EPS command execution time [ms] after stage is stopped.
+
+    This does not pause execution of python code!
+    """),
+]
+
+CONTROLLER_COMMANDS = [
+  Command('reset', 'RS', doc="""
+    Perform a full controller reset.
+    """),
+  Command('readStatus', 'TS', reply='text', doc="""
+    Read the controller status register.
+    """),
+  Command('readActivity', 'TX', reply='text', doc="""
+    Read the activity register.
+    """),
+  Command('readError', 'TB', reply='text', parameter='?', doc="""
+    Read the first error message in the error FIFO buffer.
+    """),
+  Command('readFirmwareVersion', 'VE', reply='text', parameter='?', doc="""
+    Report the controller firmware version.
+    """),
+  Command('wait', 'WT', 'milliseconds', default='0', doc="""
+    Pauses command execution on the controller for the given time [ms].
+    """),
+  Command('eStop', 'AB', doc="""
+    Emergency stop all axes.
+
+    The e-stop configuration for each axis is invoked when this command is sent.
+    """),
+  Command('abortProgram', 'AB', doc="""
+    Abort execution of current program.
+
+    Stages in motion will finish their last command.
+    """),
+  Command('quitProgram', 'QP', doc="""
+    Leaves program mode.
+    """),
+  Command('groups', 'HB', reply='ints', doc="""
+    Returns the IDs of all defined groups.
+    """),
+]
+
+PREFIXED_COMMANDS = [
+  Command('enterProgram', 'EP', doc="""
+    Starts storing the following commands as the given program [1-100].
+
+    Commands sent in program mode are stored instead of executed until
+    quitProgram() is called. See programs.ScanProgram for a builder.
+    """),
+  Command('executeProgram', 'EX', 'times', default=1, doc="""
+    Runs a stored program the given number of times.
+    """),
+  Command('defineLabel', 'DL', doc="""
+    Defines a label [1-100] at the current place of the program being stored.
+    """),
+  Command('jumpToLabel', 'JL', 'times', default='', doc="""
+    Jumps back to a label the given number of times, or forever if not given.
+    """),
+  Command('groupAcceleration', 'HA', 'acceleration', 'float', doc="""
+    Sets the vectorial acceleration for a group.
+
+    This command overides individually set accelerations.
+    """),
+  Command('groupMoveArc', 'HC', 'coordinates', 'floats', encoding='list',
+          doc="""
+    Moves a group along an arc.
+
+    The arc is defined by a list of coordinates:
+      [center_x, center_y, deltaTheta]
+    """),
+  Command('groupDeceleration', 'HD', 'deceleration', 'float', doc="""
+    Sets the vectorial deceleration for a group.
+
+    This command overides individually set decelerations.
+    """),
+  Command('groupEStopDeceleration', 'HE', 'deceleration', 'float', doc="""
+    Sets the vectorial deceleration for a group emergency stop.
+
+    This command overides individually set decelerations.
+    """),
+  Command('groupOff', 'HF', doc="""
+    Turns off power to all axis in a group.
+    """),
+  Command('groupJerk', 'HJ', 'jerk', 'float', doc="""
+    Sets the vectorial jerk limit for a group.
+
+    This command overides individually set jerks.
+    """),
+  Command('groupMoveLine', 'HL', 'coordinates', 'floats', encoding='list',
+          doc="""
+    Moves a group along a line.
+
+    The line is defined by a list of endpoint coordinates:
+      [axis1, axis2, ..., axisN]
+    """),
+  Command('groupCreate', 'HN', 'axes', 'ints', encoding='list', doc="""
+    Creates a group with ID group_id over the given axes.
+
+    The axes are given as an ordered list of the physical axis numbers:
+      [axis1, axis2, ..., axisN]
+    """),
+  Command('groupOn', 'HO', doc="""
+    Turns on power to all axis in a group.
+    """),
+  Command('groupPosition', 'HP', reply='floats', doc="""
+    Returns the position of all stages in a group.
+
+    The positions are given as an ordered list of the group axis numbers:
+      [axis1, axis2, ..., axisN]
+    """),
+  Command('groupWaitForBuffer', 'HQ', 'free_points', default=1, doc="""
+    Pauses command execution until the group point buffer has free_points
+    free slots.
+    """),
+  Command('groupStop', 'HS', doc="""
+    Stops all motion on all axes in a group.
+    """),
+  Command('groupIsMoving', 'HS', reply='moving', parameter='?', doc="""
+    Queries controller if group is in motion or stopped.
+    """),
+  Command('groupVelocity', 'HV', 'velocity', 'float', doc="""
+    Sets the vectorial velocity limit for a group.
+
+    This command overides individually set velocities.
+    """),
+  Command('groupWaitForStop', 'HW', 'delay', default='0', doc="""
+    Pauses command execution until group has stopped for given delay [ms].
+    """),
+  Command('groupDelete', 'HX', doc="""
+    Deletes group with given ID.
+    """),
+  Command('groupSize', 'HZ', reply='int', doc="""
+    Returns the size of the group with given group_id.
+    """),
+]
@@ -0,0 +1,330 @@
+"""
+Monitoring of the EPS300 error FIFO.
+
+An attached ErrorMonitor adds a one character activity query (TX) to command
+lines that already wait for a reply, at most once per interval, and always
+ahead of a wait command, so it never costs a round trip of its own. Only when
+the activity register reports queued errors is the FIFO drained with TB?. Every
+error is decoded into an ErrorEvent, attributed to the command most likely to
+have caused it and kept in events. Commands that were answered, or that were
+written before a check found no errors, are known to have succeeded and are
+never blamed. A ControllerError is raised from the call that saw the errors
+instead of the program hanging in a motion wait::
+
+    monitor = monitoring.ErrorMonitor(eps)
+    try:
+      eps.groupMoveLine(5, [10, -125])
+      eps.pauseForGroup(5)
+    except monitoring.ControllerError, error:
+      print error.events[0].message, error.events[0].command
+
+poll() reads the activity and status registers explicitly, for loops that
+have nothing else to send.
+"""
+
+import batching
+import collections
+import programs
+import re
+import time
+
+ACTIVITY_BUSY = 0x01
+ACTIVITY_ERRORS = 0x02
+
+_error_pattern = re.compile(r'^\s*(-?\d+)\s*,\s*(\d+)\s*,\s*(.*?)\s*$')
+_line_pattern = re.compile(r'^\s*(\d*)\s*([A-Za-z]{2})')
+
+class ControllerError(IOError):
+  """
+  Raised when the controller reports errors.
+
+  Attributes:
+  events -- ErrorEvent instances drained from the error FIFO.
+  """
+
+  def __init__(self, events):
+    self.events = events
+    message = '; '.join(str(event) for event in events) or \
+              'The reported errors were read by another caller.'
+    IOError.__init__(self, message)
+
+class ErrorEvent(object):
+  """
+  An error read from the error FIFO.
+
+  Attributes:
+  code -- Error code without the axis digit.
+  axis -- Axis number of an axis error, or None.
+  timestamp -- Controller time of the error (ms).
+  host_time -- Estimated host time of the error, or None.
+  message -- Error message.
+  command -- Command line the error is attributed to, or None.
+  """
+
+  def __init__(self, code, timestamp, message, host_time=None, command=None):
+    self.axis = code // 100 if code >= 100 else None
+    self.code = code % 100 if code >= 100 else code
+    self.timestamp = timestamp
+    self.message = message
+    self.host_time = host_time
+    self.command = command
+
+  def __str__(self):
+    where = 'axis %d: ' % self.axis if self.axis is not None else ''
+    cause = ' after %r' % self.command if self.command is not None else ''
+    return '%s%s (%d)%s' % (where, self.message, self.code, cause)
+
+  def __repr__(self):
+    return 'ErrorEvent(%s)' % self
+
+class ActivityEvent(object):
+  """
+  Decoded activity (TX) and, if read, status (TS) registers.
+
+  Attributes:
+  host_time -- Host time the registers were read.
+  busy -- True while the controller executes a wait command.
+  errors -- True if errors are queued in the FIFO.
+  program -- True while a stored program runs.
+  moving -- Moving flags of axes 1-3, or None if TS was not read.
+  motor_on -- Motor power flags of axes 1-3, or None if TS was not read.
+  """
+
+  def __init__(self, host_time, activity, status=None):
+    bits = ord(activity[0]) if activity else 0
+    self.host_time = host_time
+    self.busy = bool(bits & ACTIVITY_BUSY)
+    self.errors = bool(bits & ACTIVITY_ERRORS)
+    self.program = bool(bits & programs.PROGRAM_EXECUTING)
+    self.moving = None
+    self.motor_on = None
+    if status:
+      bits = ord(status[0])
+      self.moving = [bool(bits & (1 << axis)) for axis in xrange(3)]
+      self.motor_on = [bool(bits & (1 << (axis + 3))) for axis in xrange(3)]
+
+class _ActivityReply(batching.PendingReply):
+  """
+  Reply to a piggybacked TX that hands the register to the monitor.
+  """
+
+  def __init__(self, monitor):
+    batching.PendingReply.__init__(self, 'TX')
+    self.monitor = monitor
+
+  def set(self, response):
+    batching.PendingReply.set(self, response)
+    self.monitor.activity(response.strip())
+
+class ErrorMonitor(object):
+  """
+  Watches the error FIFO of a StageController without extra round trips.
+  """
+
+  def __init__(self, controller, interval=0.5, history=256,
+               raise_errors=True):
+    """
+    Arguments:
+    controller -- StageController to watch; the monitor attaches itself.
+    interval -- Shortest time between piggybacked activity queries [s].
+    history -- Number of written commands kept to attribute errors to.
+    raise_errors -- Raise ControllerError when errors are found. Otherwise
+                    they are only kept in events, unless replies still
+                    awaited had to be given up for them.
+    """
+    self.controller = controller
+    self.interval = interval
+    self.raise_errors = raise_errors
+    self.commands = collections.deque(maxlen=history)
+    self.written_count = 0
+    self.checks = collections.deque()
+    self.group_axes = {}
+    self.events = collections.deque(maxlen=history)
+    self.last_check = 0.0
+    self.clock_offset = None
+    self.draining = False
+    self.statistics = collections.Counter()
+    controller.monitor = self
+    controller.engine.monitor = self
+
+  def detach(self):
+    """
+    Stops monitoring the controller.
+    """
+    self.controller.monitor = None
+    self.controller.engine.monitor = None
+
+  # Hooks called by the StageController and its QueryEngine.
+
+  def written(self, lines):
+    """
+    Keeps written commands, numbered in order, to attribute errors to.
+    """
+    now = time.time()
+    for line in lines:
+      for command in line.split(';'):
+        self.written_count += 1
+        self.commands.append((self.written_count, now, command))
+        match = _line_pattern.match(command)
+        if match is None:
+          continue
+        prefix, mnemonic = match.group(1), match.group(2).upper()
+        if mnemonic == 'TX':
+          self.checks.append(self.written_count)
+        elif mnemonic == 'HN' and command.rstrip()[-1:] != '?':
+          axes = command[match.end():].split(',')
+          self.group_axes[prefix] = [axis.strip() for axis in axes]
+        elif mnemonic == 'HX':
+          self.group_axes.pop(prefix, None)
+
+  def answered(self, line):
+    """
+    Forgets the command of a query answered with a valid reply.
+    """
+    for entry in self.commands:
+      if entry[2] == line:
+        self.commands.remove(entry)
+        break
+
+  def due(self, force=False):
+    """
+    Returns True if a piggybacked activity query should be sent now.
+
+    force -- Ask for one before the interval has passed.
+    """
+    return not self.draining and (force or
+                                  time.time() - self.last_check >=
+                                  self.interval)
+
+  def reply(self):
+    """
+    Returns the PendingReply of a piggybacked activity query.
+    """
+    self.last_check = time.time()
+    self.statistics['checks'] += 1
+    return _ActivityReply(self)
+
+  # Decoding.
+
+  def activity(self, activity, status=None):
+    """
+    Handles an activity register, draining the error FIFO if it reports
+    errors. Returns the ActivityEvent.
+
+    Queries still awaiting replies are given up before the FIFO is drained:
+    the replies to commands that failed never come, and the TB? replies would
+    queue up behind them. ControllerError is then raised even without
+    raise_errors, since the calls waiting for those replies cannot return.
+    Without errors, the commands written before the check are forgotten.
+    """
+    event = ActivityEvent(time.time(), activity, status)
+    check = self.checks.popleft() if self.checks else 0
+    if not event.errors:
+      while self.commands and self.commands[0][0] < check:
+        self.commands.popleft()
+    else:
+      lost = self.controller.engine.discard()
+      found = self.drain()
+      if self.raise_errors or lost:
+        raise ControllerError(found)
+    return event
+
+  def poll(self):
+    """
+    Reads the activity and status registers in one round trip.
+
+    Returns an ActivityEvent; errors are handled as for piggybacked checks.
+    """
+    self.last_check = time.time()
+    self.statistics['polls'] += 1
+    with self.controller.batch():
+      activity = self.controller.queue('TX')
+      status = self.controller.queue('TS')
+    return self.activity(activity.value().strip(), status.value().strip())
+
+  def drain(self, abandon=False, batch=4):
+    """
+    Reads the error FIFO until it is empty and returns the ErrorEvents.
+
+    With abandon set, queries still waiting for replies are given up first,
+    since the replies to commands that failed may never come.
+    """
+    if abandon:
+      self.controller.engine.discard()
+    self.draining = True
+    found = []
+    try:
+      while True:
+        with self.controller.batch():
+          replies = [self.controller.queue('TB', '?') for i in xrange(batch)]
+        now = time.time()
+        empty = False
+        for reply in replies:
+          match = _error_pattern.match(reply.value() or '')
+          if match is None:
+            continue
+          code, timestamp, message = match.groups()
+          code, timestamp = int(code), int(timestamp)
+          if code == 0:
+            self.clock_offset = now - timestamp / 1000.0
+            empty = True
+            continue
+          found.append(ErrorEvent(code, timestamp, message))
+        if empty:
+          break
+    finally:
+      self.draining = False
+    commands = [(host_time, command)
+                for count, host_time, command in self.commands
+                if _line_pattern.match(command) is not None and
+                _line_pattern.match(command).group(2).upper() not in
+                ('TX', 'TB')]
+    for event in found:
+      if self.clock_offset is not None:
+        event.host_time = event.timestamp / 1000.0 + self.clock_offset
+      index = self.attribute(event, commands)
+      if index is not None:
+        event.command = commands[index][1]
+        commands = commands[index + 1:]
+      self.events.append(event)
+    self.statistics['errors'] += len(found)
+    self.commands.clear()
+    if not self.controller.engine.outstanding:
+      self.checks.clear()
+    return found
+
+  def attribute(self, event, commands):
+    """
+    Returns the index of the command that most likely caused an error, or
+    None.
+
+    Errors are queued in the order of the commands that caused them, so the
+    earliest fitting command written up to the estimated time of the error is
+    chosen. Axis errors fit commands to that axis and group commands to a
+    group holding it, group errors group commands; any command fits if none
+    of them does.
+
+    Arguments:
+    event -- ErrorEvent with host_time estimated if possible.
+    commands -- (host time, command) entries not yet attributed.
+    """
+    candidates = range(len(commands))
+    if event.host_time is not None:
+      before = [index for index in candidates
+                if commands[index][0] <= event.host_time + 0.001]
+      candidates = before or candidates
+    def fits(command):
+      prefix, mnemonic = _line_pattern.match(command).groups()
+      if event.axis is not None:
+        if mnemonic.upper().startswith('H'):
+          axes = self.group_axes.get(prefix)
+          return axes is None or str(event.axis) in axes
+        return prefix == str(event.axis)
+      if 'GROUP' in event.message:
+        return mnemonic.upper().startswith('H')
+      return True
+    preferred = [index for index in candidates if fits(commands[index][1])]
+    candidates = preferred or candidates
+    if not candidates:
+      return None
+    return candidates[0]
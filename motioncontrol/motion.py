@@ -0,0 +1,271 @@
+"""
+Waiting for the completion of stage and group motion.
+
+By default a wait is handed to the controller: a WS or HW command holds back
+the reply to a following position query until the motion has finished, so the
+wait itself costs a single serial round trip and no host CPU. The remaining
+move time is predicted first with a kinematics.MoveEstimator, and the reply
+is awaited for that time plus a margin, so moves of any length can be waited
+for; moves that cannot be predicted are polled instead. Alternatively the
+motion status can always be polled, sleeping in between for a fraction of the
+predicted remaining move time. Every wait returns a MotionResult with the final
+position and the time it took.
+
+Blocking, callback and future based waits are available::
+
+    result = motion.waitForGroup(eps, 1)
+    print result.position, result.elapsed
+
+    future = motion.whenStopped(motion.waitForStage, eps.axis1)
+    future.addDoneCallback(lambda f: report(f.result()))
+"""
+
+import asynchronous
+import kinematics
+import threading
+import time
+
+# Fraction of the predicted move and settling time added to the time a
+# controller wait may hold back replies.
+WAIT_MARGIN = 0.25
+
+class MotionResult(object):
+  """
+  Outcome of a motion wait.
+
+  Attributes:
+  position -- Final position: a float for a stage, a list for a group, or a
+              dictionary keyed by stage and group for combined waits.
+  elapsed -- Seconds spent waiting.
+  polls -- Number of motion status queries sent (0 for controller waits).
+  """
+
+  def __init__(self, position, elapsed, polls=0):
+    self.position = position
+    self.elapsed = elapsed
+    self.polls = polls
+
+  def __repr__(self):
+    return 'MotionResult(%r, elapsed=%.3f, polls=%d)' % (self.position,
+                                                         self.elapsed,
+                                                         self.polls)
+
+def remainingTime(distance, velocity, acceleration, deceleration=None,
+                  jerk=0):
+  """
+  Predicts the time to travel distance from rest to rest.
+
+  The velocity profile is a kinematics.MotionProfile: trapezoidal without
+  jerk, and with deceleration equal to acceleration unless given.
+  """
+  if velocity <= 0 or acceleration <= 0:
+    return 0.0
+  return kinematics.Dynamics(velocity, acceleration, deceleration,
+                             jerk).duration(distance)
+
+def _floats(response):
+  return [float(x.strip()) for x in response.split(',')]
+
+def _poll(is_moving, remaining, min_interval, max_interval, lead=0.05):
+  """
+  Sleeps until is_moving() turns false and returns the number of polls.
+
+  The first sleep ends lead seconds before the predicted end of the motion;
+  later ones double from min_interval up to max_interval.
+  """
+  polls = 0
+  interval = min_interval
+  if remaining > 0:
+    time.sleep(max(0.0, remaining - lead))
+  while True:
+    polls += 1
+    if not is_moving():
+      return polls
+    time.sleep(interval)
+    interval = min(2 * interval, max_interval)
+
+def _waitDeadline(controller, remaining, delay):
+  """
+  Returns how long a controller wait may hold back replies: the predicted
+  remaining move time and settling delay plus WAIT_MARGIN, but no less than
+  the wait_deadline of the query engine.
+  """
+  predicted = (remaining + float(delay) / 1000.0) * (1 + WAIT_MARGIN)
+  return max(controller.engine.wait_deadline, predicted)
+
+def _handOver(controller, seconds, send):
+  """
+  Sends a batch holding controller waits that may hold back replies for up
+  to seconds and returns the result of send().
+  """
+  previous = controller.engine.expectWaits(seconds)
+  try:
+    with controller.batch():
+      return send()
+  finally:
+    controller.engine.expectWaits(previous)
+
+def _groupRemaining(controller, group_id, target):
+  """
+  Returns the predicted remaining time of a group line move to target, or
+  None if it cannot be predicted from the replies and group settings. The
+  target is read with HL? if not given. Errors are checked first, since a
+  rejected move would leave the queries and the wait without replies.
+  """
+  with controller.batch(check=True):
+    limit = controller.queue('HL', '?', group_id) if target is None else None
+    current = controller.queue('HP', '', group_id)
+  try:
+    if limit is not None:
+      target = _floats(limit.value())
+    position = _floats(current.value())
+    dynamics = kinematics.MoveEstimator(controller).groupDynamics(group_id)
+  except ValueError:
+    return None
+  if dynamics.velocity <= 0 or dynamics.acceleration <= 0:
+    return None
+  return dynamics.duration(kinematics.lineLength(position, target))
+
+def _stageRemaining(controller, axis, target):
+  """
+  Returns the predicted remaining time of a stage move to target, or None if
+  it cannot be predicted from the replies and axis settings. The target is
+  read with DP? if not given. Errors are checked first, as for groups.
+  """
+  with controller.batch(check=True):
+    desired = controller.queue('DP', '?', axis) if target is None else None
+    current = controller.queue('TP', '', axis)
+  try:
+    if desired is not None:
+      target = float(desired.value())
+    position = float(current.value())
+    dynamics = kinematics.MoveEstimator(controller).axisDynamics(axis)
+  except ValueError:
+    return None
+  if dynamics.velocity <= 0 or dynamics.acceleration <= 0:
+    return None
+  return dynamics.duration(float(target) - float(position))
+
+def waitForGroup(controller, group_id, delay=0, poll=False, target=None,
+                 min_interval=0.005, max_interval=0.25):
+  """
+  Waits until a group has stopped and returns a MotionResult.
+
+  Arguments:
+  controller -- StageController owning the group.
+  group_id -- Group to wait for.
+  delay -- Additional settling time after the stop [ms].
+  poll -- Poll HS? instead of handing the wait to the controller.
+  target -- Target coordinates of the move, used to predict its duration.
+            Queried from the controller if not given.
+  """
+  start = time.time()
+  remaining = _groupRemaining(controller, group_id, target)
+  if not poll and remaining is not None:
+    def send():
+      controller.groupWaitForStop(group_id, delay)
+      return controller.queue('HP', '', group_id)
+    reply = _handOver(controller, _waitDeadline(controller, remaining, delay),
+                      send)
+    return MotionResult(_floats(reply.value()), time.time() - start)
+  polls = _poll(lambda: '0' in controller.query('HS', '?', group_id),
+                remaining or 0.0, min_interval, max_interval)
+  time.sleep(float(delay) / 1000.0)
+  position = _floats(controller.query('HP', '', group_id))
+  return MotionResult(position, time.time() - start, polls)
+
+def waitForStage(stage, delay=0, poll=False, target=None,
+                 min_interval=0.005, max_interval=0.25):
+  """
+  Waits until a stage has stopped and returns a MotionResult.
+
+  Arguments:
+  stage -- Stage to wait for.
+  delay -- Additional settling time after the stop [ms].
+  poll -- Poll MD? instead of handing the wait to the controller.
+  target -- Target position of the move, used to predict its duration.
+            Queried from the controller if not given.
+  """
+  controller = stage.controller
+  axis = stage.axis
+  start = time.time()
+  remaining = _stageRemaining(controller, axis, target)
+  if not poll and remaining is not None:
+    def send():
+      controller.send('WS', delay, axis)
+      return controller.queue('TP', '', axis)
+    reply = _handOver(controller, _waitDeadline(controller, remaining, delay),
+                      send)
+    return MotionResult(float(reply.value()), time.time() - start)
+  polls = _poll(lambda: '0' in controller.query('MD', '?', axis),
+                remaining or 0.0, min_interval, max_interval)
+  time.sleep(float(delay) / 1000.0)
+  position = float(controller.query('TP', '', axis))
+  return MotionResult(position, time.time() - start, polls)
+
+def waitForAll(controller, stages=(), groups=(), delay=0, poll=False):
+  """
+  Waits until all given stages and groups have settled.
+
+  Returns a MotionResult whose position is a dictionary keyed by the Stage
+  instances and group IDs. The waits run one after the other, so the settling
+  delay is only added to the last of them. They are handed to the controller
+  only if the remaining time of every move can be predicted.
+  """
+  start = time.time()
+  positions = {}
+  polls = 0
+  count = len(stages) + len(groups)
+  delays = [0] * (count - 1) + [delay]
+  remaining = []
+  if not poll:
+    remaining = ([_stageRemaining(controller, stage.axis, None)
+                  for stage in stages] +
+                 [_groupRemaining(controller, group_id, None)
+                  for group_id in groups])
+  if not poll and None not in remaining:
+    replies = {}
+    def send():
+      for stage, wait_delay in zip(stages, delays):
+        controller.send('WS', wait_delay, stage.axis)
+      for group_id, wait_delay in zip(groups, delays[len(stages):]):
+        controller.groupWaitForStop(group_id, wait_delay)
+      for stage in stages:
+        replies[stage] = controller.queue('TP', '', stage.axis)
+      for group_id in groups:
+        replies[group_id] = controller.queue('HP', '', group_id)
+    _handOver(controller, _waitDeadline(controller, max(remaining + [0.0]),
+                                        delay), send)
+    for stage in stages:
+      positions[stage] = float(replies[stage].value())
+    for group_id in groups:
+      positions[group_id] = _floats(replies[group_id].value())
+  else:
+    for stage, wait_delay in zip(stages, delays):
+      result = waitForStage(stage, wait_delay, True)
+      positions[stage] = result.position
+      polls += result.polls
+    for group_id, wait_delay in zip(groups, delays[len(stages):]):
+      result = waitForGroup(controller, group_id, wait_delay, True)
+      positions[group_id] = result.position
+      polls += result.polls
+  return MotionResult(positions, time.time() - start, polls)
+
+def whenStopped(wait, *args, **kwargs):
+  """
+  Runs a wait function in a background thread.
+
+  Returns an asynchronous.Future of its MotionResult; use addDoneCallback()
+  for callbacks. The controller must not be used by other threads until the
+  future is done.
+  """
+  future = asynchronous.Future()
+  def run():
+    try:
+      future.setResult(wait(*args, **kwargs))
+    except Exception, error:
+      future.setException(error)
+  thread = threading.Thread(target=run)
+  thread.daemon = True
+  thread.start()
+  return future
@@ -0,0 +1,189 @@
+"""
+Concurrent measurements on several optics benches.
+
+Every Bench couples one EPS300 controller with one HD-LBP profiler and owns a
+worker thread that opens both serial ports and runs the jobs given to it in
+order. Benches do not share any I/O, so an Orchestrator can run the same
+measurement on all of them at once and collect a result or a failure for each
+bench::
+
+    from motioncontrol import orchestration
+
+    lab = orchestration.Orchestrator()
+    lab.addBench('north', 'COM3', 'COM4')
+    lab.addBench('south', 'COM5', 'COM6')
+    results = lab.run(orchestration.beamTrajectory, 1, [2, 3])
+    for name, result in results.items():
+      print name, result.value if result.ok else result.error
+    lab.close()
+
+A job is any callable taking the Bench as its first argument.
+"""
+
+import asynchronous
+import camera
+import collections
+import controller
+import Queue
+import threading
+import time
+import traceback
+import utilities
+
+class BenchResult(object):
+  """
+  Outcome of a job on one bench.
+
+  Attributes:
+  name -- Name of the bench.
+  value -- Return value of the job, or None if it failed.
+  error -- Exception raised by the job, or None.
+  trace -- Formatted traceback of the error.
+  elapsed -- Seconds the job ran.
+  """
+
+  def __init__(self, name, value=None, error=None, trace='', elapsed=0.0):
+    self.name = name
+    self.value = value
+    self.error = error
+    self.trace = trace
+    self.elapsed = elapsed
+
+  @property
+  def ok(self):
+    return self.error is None
+
+  def __repr__(self):
+    if self.ok:
+      return 'BenchResult(%r, %r, elapsed=%.3f)' % (self.name, self.value,
+                                                   self.elapsed)
+    return 'BenchResult(%r, error=%r, elapsed=%.3f)' % (self.name, self.error,
+                                                       self.elapsed)
+
+class Bench(object):
+  """
+  A controller and a camera driven by a dedicated worker thread.
+  """
+
+  def __init__(self, name, controller_device, camera_device=None):
+    """
+    Arguments:
+    name -- Name of the bench used to report results.
+    controller_device -- Serial port path or open port of the EPS300.
+    camera_device -- Serial port path or open port of the HD-LBP, if any.
+
+    The devices are opened by the worker thread, so several benches connect
+    in parallel.
+    """
+    self.name = name
+    self.controller = None
+    self.camera = None
+    self.jobs = Queue.Queue()
+    self.worker = threading.Thread(target=self._run, name='bench-%s' % name)
+    self.worker.daemon = True
+    self.worker.start()
+    self.opened = self.submit(self._open, controller_device, camera_device)
+
+  def _open(self, bench, controller_device, camera_device):
+    self.controller = controller.StageController(controller_device)
+    if camera_device is not None:
+      self.camera = camera.LaserBeamProfiler(camera_device)
+
+  def submit(self, job, *args, **kwargs):
+    """
+    Queues job(bench, *args, **kwargs) and returns an asynchronous.Future.
+
+    The future resolves to a BenchResult; failures of the job are reported
+    in the result rather than raised.
+    """
+    future = asynchronous.Future()
+    self.jobs.put((job, args, kwargs, future))
+    return future
+
+  def close(self):
+    """
+    Stops the worker thread after the queued jobs have run.
+    """
+    self.jobs.put(None)
+    self.worker.join()
+
+  def _run(self):
+    while True:
+      request = self.jobs.get()
+      if request is None:
+        return
+      job, args, kwargs, future = request
+      start = time.time()
+      try:
+        value = job(self, *args, **kwargs)
+      except Exception, error:
+        future.setResult(BenchResult(self.name, error=error,
+                                     trace=traceback.format_exc(),
+                                     elapsed=time.time() - start))
+      else:
+        future.setResult(BenchResult(self.name, value,
+                                     elapsed=time.time() - start))
+
+class Orchestrator(object):
+  """
+  Runs measurement jobs on several benches concurrently.
+  """
+
+  def __init__(self):
+    self.benches = collections.OrderedDict()
+
+  def addBench(self, name, controller_device, camera_device=None):
+    """
+    Connects a bench and returns its Bench.
+    """
+    if name in self.benches:
+      raise ValueError('Bench %r already exists.' % name)
+    bench = Bench(name, controller_device, camera_device)
+    self.benches[name] = bench
+    return bench
+
+  def submit(self, job, *args, **kwargs):
+    """
+    Queues a job on every bench.
+
+    Returns an ordered dictionary of asynchronous.Future of BenchResult by
+    bench name.
+    """
+    return collections.OrderedDict(
+      (name, bench.submit(job, *args, **kwargs))
+      for name, bench in self.benches.items())
+
+  def run(self, job, *args, **kwargs):
+    """
+    Runs a job on every bench at once and waits for all of them.
+
+    Returns an ordered dictionary of BenchResult by bench name. A bench that
+    failed to connect reports its connection error instead.
+    """
+    futures = self.submit(job, *args, **kwargs)
+    results = collections.OrderedDict()
+    for name, future in futures.items():
+      opened = self.benches[name].opened.result()
+      results[name] = opened if not opened.ok else future.result()
+    return results
+
+  def close(self):
+    """
+    Stops all bench workers after their queued jobs.
+    """
+    for bench in self.benches.values():
+      bench.close()
+    self.benches.clear()
+
+def beamTrajectory(bench, group_id, axes, **kwargs):
+  """
+  Job that homes a camera group and finds the beam trajectory across it.
+
+  Keyword arguments are passed to utilities.ConstrainToBeam. Returns the
+  (r_initial, slope) pair of the trajectory.
+  """
+  bench.controller.initializeGroup(group_id, axes)
+  trajectory = utilities.ConstrainToBeam(bench.controller, group_id,
+                                         bench.camera, **kwargs)
+  trajectory.findSlope()
+  return trajectory.r_initial.tolist(), trajectory.slope.tolist()
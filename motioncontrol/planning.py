@@ -0,0 +1,121 @@
+"""
+Dry runs of beam measurements on the simulator.
+
+dryRun() replays findBeam, findSlope, findFocalPoint or any other method of a
+ConstrainToBeam or FocalPoint against a simulator.SimulatedBench in virtual
+time. Moves follow the kinematics.MotionProfile of the controller settings
+and serial traffic is timed byte by byte, so the duration, move count and
+serial traffic of a configuration are predicted without the bench, usually in
+well under a second::
+
+    plan = planning.dryRun('findBeam', -125, scan_steps=[50, 5, 0.5, 0.05])
+    print plan.elapsed, plan.moves, plan.bytes_written
+
+    variants = [{'scan_mode': 'step'}, {'scan_mode': 'fly'},
+                {'scan_mode': 'fit'}]
+    for plan in planning.compare('findSlope', [], variants):
+      print plan
+"""
+
+import camera
+import controller
+import simulator
+import utilities
+
+# Methods run on a FocalPoint instead of a ConstrainToBeam.
+FOCAL_METHODS = set(['findFocalPoint', 'findFocus'])
+
+class Plan(object):
+  """
+  Predicted cost of a measurement.
+
+  Attributes:
+  method -- Name of the method run.
+  options -- Options the ConstrainToBeam or FocalPoint was made with.
+  elapsed -- Duration [s].
+  moves -- Stage and group moves started.
+  commands -- Controller commands executed.
+  lines_written, bytes_written -- Lines and bytes sent to the controller.
+  lines_read, bytes_read -- Reply lines and bytes read from the controller.
+  camera_bytes -- Bytes read from the camera.
+  result -- Return value of the method.
+  """
+
+  def __init__(self, method, options, elapsed, counts, result):
+    self.method = method
+    self.options = options
+    self.elapsed = elapsed
+    self.moves = counts['moves']
+    self.commands = counts['commands']
+    self.lines_written = counts['lines_written']
+    self.bytes_written = counts['bytes_written']
+    self.lines_read = counts['lines_read']
+    self.bytes_read = counts['bytes_read']
+    self.camera_bytes = counts['camera_bytes']
+    self.result = result
+
+  def __repr__(self):
+    return ('Plan(%s %r: %.1f s, %d moves, %d commands, %d lines, '
+            '%d bytes)' % (self.method, self.options, self.elapsed,
+                           self.moves, self.commands, self.lines_written,
+                           self.bytes_written + self.bytes_read))
+
+def _counts(bench):
+  statistics = bench.eps300.statistics
+  counts = dict((key, statistics.get(key, 0))
+                for key in ('moves', 'lines_written', 'bytes_written',
+                            'lines_read', 'bytes_read'))
+  counts['commands'] = sum(statistics['commands'].values())
+  counts['camera_bytes'] = bench.profiler.statistics['bytes_read']
+  return counts
+
+def dryRun(method, *arguments, **options):
+  """
+  Runs a measurement method on a simulated bench and returns its Plan.
+
+  Option=default values are as follows:
+  simulation=None - simulator.SimulatedBench to run on. A new one with the
+                    default beam if None.
+  group_id=1 - Group carrying the camera.
+  axes=[2, 3] - Axes of the group. The group is initialized before the run
+                and its setup is not counted.
+  settings={} - initializeGroup keyword arguments such as velocity and
+                acceleration.
+  Remaining options are passed to the ConstrainToBeam, or the FocalPoint for
+  FOCAL_METHODS.
+  """
+  bench = options.pop('simulation', None) or simulator.SimulatedBench()
+  group_id = options.pop('group_id', 1)
+  axes = options.pop('axes', [2, 3])
+  settings = options.pop('settings', {})
+  with bench.clock.patch():
+    eps = controller.StageController(bench.eps300)
+    lbp = camera.LaserBeamProfiler(bench.profiler)
+    eps.initializeGroup(group_id, axes, **settings)
+    if method in FOCAL_METHODS:
+      measurement = utilities.FocalPoint(eps, group_id, lbp, **dict(options))
+    else:
+      measurement = utilities.ConstrainToBeam(eps, group_id, lbp,
+                                              **dict(options))
+    before = _counts(bench)
+    start = bench.clock.time()
+    result = getattr(measurement, method)(*arguments)
+    elapsed = bench.clock.time() - start
+    after = _counts(bench)
+  counts = dict((key, after[key] - before[key]) for key in after)
+  return Plan(method, options, elapsed, counts, result)
+
+def compare(method, arguments, variants, **options):
+  """
+  Dry runs a method once for every variant and returns the Plans.
+
+  Every variant is a dictionary of options overriding the common options, as
+  for dryRun(). Each run uses a fresh simulated bench unless simulation is
+  given.
+  """
+  plans = []
+  for variant in variants:
+    merged = dict(options)
+    merged.update(variant)
+    plans.append(dryRun(method, *arguments, **merged))
+  return plans
@@ -0,0 +1,182 @@
+"""
+Scan programs stored on the EPS300.
+
+A ScanProgram collects group moves, waits and loops into an EPS300 stored
+program. The program is downloaded once and then runs on the controller, so
+consecutive moves follow each other without host or serial latency; the host
+only waits for the program to finish::
+
+    program = programs.ScanProgram(eps, 1)
+    program.groupVelocity(1, 5)
+    program.label(1)
+    for x in [9.0 + 0.05 * i for i in xrange(20)]:
+      program.groupMoveLine(1, [x, -125])
+      program.groupWaitForStop(1, 10)
+      program.wait(50)
+    program.jump(1, 2)
+    result = program.run()
+    print result.position[1], result.elapsed
+
+Group moves in stored programs are absolute, so a loop repeats the same
+points; jump() is meant for repeated passes rather than for stepping.
+
+The program duration is predicted from the group kinematics so that the host
+sleeps for most of it and only polls the activity register at the end.
+"""
+
+import kinematics
+import math
+import motion
+import time
+
+# Bit of the TX activity register set while a stored program executes.
+PROGRAM_EXECUTING = 0x04
+
+class ScanProgram(object):
+  """
+  Builder of a stored EPS300 program of group moves and waits.
+  """
+
+  def __init__(self, controller, number=1):
+    """
+    Arguments:
+    controller -- StageController to store the program on.
+    number -- Program number [1-100].
+    """
+    self.controller = controller
+    self.number = number
+    self.commands = []
+    self.duration = 0.0
+    self.positions = {}
+    self.velocities = {}
+    self.moving = {}
+    self.labels = {}
+    self.started = None
+
+  def add(self, command, parameter='', axis=''):
+    """
+    Appends a raw command to the program.
+    """
+    self.commands.append(str(axis) + str(command) + str(parameter))
+
+  def _kinematics(self, group_id):
+    dynamics = kinematics.MoveEstimator(self.controller).groupDynamics(group_id)
+    velocity = self.velocities.setdefault(group_id, dynamics.velocity)
+    return velocity, dynamics.acceleration, dynamics.deceleration, dynamics.jerk
+
+  def groupVelocity(self, group_id, velocity):
+    """
+    Sets the vectorial velocity of a group when the program reaches this point.
+    """
+    self.add('HV', velocity, group_id)
+    self.velocities[group_id] = float(velocity)
+
+  def groupMoveLine(self, group_id, coordinates):
+    """
+    Moves a group along a line to the given endpoint coordinates.
+    """
+    self.add('HL', ",".join(map(str, coordinates)), group_id)
+    if group_id not in self.positions:
+      self.positions[group_id] = motion._floats(
+        self.controller.query('HP', '', group_id))
+    origin = self.positions[group_id]
+    distance = math.sqrt(sum((a - b) ** 2 for a, b in zip(origin, coordinates)))
+    duration = motion.remainingTime(distance, *self._kinematics(group_id))
+    self.moving[group_id] = self.moving.get(group_id, 0.0) + duration
+    self.positions[group_id] = list(coordinates)
+
+  def groupMoveRelative(self, group_id, displacement):
+    """
+    Moves a group along a line by the given displacement.
+
+    Stored programs only know absolute group moves, so the move is stored as
+    its absolute endpoint.
+    """
+    if group_id not in self.positions:
+      self.positions[group_id] = motion._floats(
+        self.controller.query('HP', '', group_id))
+    self.groupMoveLine(group_id, [a + b for a, b in
+                                  zip(self.positions[group_id], displacement)])
+
+  def groupWaitForStop(self, group_id, delay=0):
+    """
+    Holds the program until the group has stopped for delay [ms].
+    """
+    self.add('HW', delay, group_id)
+    self.duration += self.moving.pop(group_id, 0.0) + float(delay) / 1000.0
+
+  def wait(self, milliseconds):
+    """
+    Holds the program for the given time [ms].
+    """
+    self.add('WT', milliseconds)
+    self.duration += float(milliseconds) / 1000.0
+
+  def label(self, label):
+    """
+    Defines a label [1-100] at the current end of the program.
+    """
+    self.add('DL', '', label)
+    self.labels[label] = self.duration
+
+  def jump(self, label, times):
+    """
+    Jumps back to a label the given number of times.
+    """
+    if label not in self.labels:
+      raise ValueError('Label %s is not defined.' % label)
+    self.add('JL', times, label)
+    self.duration += (self.duration - self.labels[label]) * times
+
+  def download(self):
+    """
+    Stores the program on the controller unless it is already stored.
+
+    Returns True if the program was written.
+    """
+    controller = self.controller
+    if controller.programs.get(self.number) == self.commands:
+      return False
+    if controller._pending:
+      controller.flush()
+    lines = ['%dXX' % self.number, '%dEP' % self.number] + self.commands
+    lines.append('QP')
+    controller._write(lines)
+    controller.programs[self.number] = list(self.commands)
+    return True
+
+  def isRunning(self):
+    """
+    Returns True while a stored program executes.
+    """
+    return bool(ord(self.controller.readActivity()[0]) & PROGRAM_EXECUTING)
+
+  def start(self, times=1):
+    """
+    Downloads the program if needed and starts it without waiting.
+    """
+    self.download()
+    self.controller.executeProgram(self.number, times)
+    self.started = time.time()
+
+  def waitUntilDone(self, times=1, min_interval=0.005, max_interval=0.25):
+    """
+    Waits for the program started by start() and returns a MotionResult.
+
+    The position of the result is a dictionary of the final group positions.
+    """
+    remaining = self.started + self.duration * times - time.time()
+    polls = motion._poll(self.isRunning, remaining, min_interval,
+                         max_interval)
+    positions = {}
+    for group_id in self.positions:
+      positions[group_id] = motion._floats(
+        self.controller.query('HP', '', group_id))
+    return motion.MotionResult(positions, time.time() - self.started, polls)
+
+  def run(self, times=1):
+    """
+    Runs the program the given number of times and waits for it to finish.
+    """
+    self.start(times)
+    return self.waitUntilDone(times)
@@ -0,0 +1,293 @@
+"""
+Pairing of EPS300 queries with their replies.
+
+Every command that produces a reply is registered with the QueryEngine when it
+is written. Replies arrive in the order the queries were sent, so the engine
+hands each reply line to the query that caused it. Reads are bounded by a
+deadline for each query instead of one global serial timeout and return as
+soon as the line terminator arrives. Lines that do not have the format of the
+expected reply are dropped as strays, and after a timeout the engine discards
+everything in flight and resynchronizes on a firmware version query before
+retrying.
+"""
+
+import batching
+import collections
+import re
+import time
+
+class ControllerTimeout(IOError):
+  """
+  Raised when the controller does not answer a query within its deadline.
+  """
+  pass
+
+def _isNumber(line):
+  try:
+    float(line)
+  except ValueError:
+    return False
+  return True
+
+def _isNumberList(line):
+  return all(_isNumber(x) for x in line.split(','))
+
+_error_pattern = re.compile(r'^-?\d+\s*,\s*\d+\s*,\s*\S')
+
+# Checks of the reply format by mnemonic. Unlisted mnemonics accept any
+# non-empty reply.
+VALIDATORS = {
+  'DP': _isNumber, 'DV': _isNumber, 'TP': _isNumber, 'PA': _isNumber,
+  'PR': _isNumber, 'VA': _isNumber, 'VU': _isNumber, 'AC': _isNumber,
+  'AE': _isNumber, 'AG': _isNumber, 'AU': _isNumber, 'BA': _isNumber,
+  'DH': _isNumber, 'FE': _isNumber, 'FR': _isNumber, 'GR': _isNumber,
+  'SH': _isNumber, 'JK': _isNumber, 'HA': _isNumber, 'HD': _isNumber,
+  'HE': _isNumber, 'HJ': _isNumber, 'HV': _isNumber, 'HZ': _isNumber,
+  'HQ': _isNumber,
+  'SN': lambda line: line.isdigit(),
+  'MD': lambda line: line in ('0', '1'),
+  'MO': lambda line: line in ('0', '1'),
+  'HS': lambda line: line in ('0', '1'),
+  'HP': _isNumberList, 'HL': _isNumberList, 'HC': _isNumberList,
+  'HN': _isNumberList,
+  'HB': lambda line: line == '' or _isNumberList(line),
+  'TB': lambda line: _error_pattern.match(line) is not None,
+  'TS': lambda line: len(line) == 1,
+  'TX': lambda line: len(line) == 1,
+  'VE': lambda line: 'Version' in line,
+}
+
+# Commands that make the controller hold back replies to later queries for
+# an unknown time.
+WAIT_MNEMONICS = set(['WS', 'WP', 'HW', 'HQ', 'RS'])
+
+_mnemonic_pattern = re.compile(r'^\s*\d*\s*([A-Za-z]{2})\s*(.*?)\s*$')
+
+def mnemonic(line):
+  """
+  Returns the upper case two letter mnemonic of a command line.
+  """
+  match = _mnemonic_pattern.match(line)
+  return match.group(1).upper() if match else ''
+
+class Query(object):
+  """
+  A query written to the controller that is waiting for its reply.
+  """
+
+  def __init__(self, line, deadline, reply=None):
+    self.line = line
+    self.mnemonic = mnemonic(line)
+    self.deadline = deadline
+    self.reply = reply
+    self.response = None
+    self.done = False
+    self.sent_at = None
+    self.sequence = 0
+
+  def accepts(self, line):
+    """
+    Returns True if the stripped line has the format of this query's reply.
+    """
+    validate = VALIDATORS.get(self.mnemonic)
+    if validate is None:
+      return line != ''
+    return validate(line)
+
+class QueryEngine(object):
+  """
+  Correlates replies read from an EPS300 serial port with their queries.
+
+  The statistics attribute counts replies, stray lines, timeouts and
+  resynchronizations. An attached monitoring.ErrorMonitor is told of every
+  valid reply.
+  """
+
+  default_deadline = 0.25
+  wait_deadline = 120.0
+  deadlines = {'VE': 0.5, 'TB': 0.5, 'ID': 0.5}
+  retries = 1
+  # Port timeout of a single readline(). Set once, since every change of a
+  # pyserial timeout reconfigures the port.
+  read_timeout = 0.05
+
+  def __init__(self, io, terminator='\r', observer=None):
+    """
+    Arguments:
+    io -- Open serial port of the controller.
+    terminator -- String appended to command lines.
+    observer -- Optional shadow.ShadowState whose record(line, response,
+                sequence) is called for every reply, with the sequence
+                number it gave the query line, and invalidate() after every
+                timeout.
+    """
+    self.io = io
+    self.io.timeout = self.read_timeout
+    self.terminator = terminator
+    self.observer = observer
+    self.outstanding = collections.deque()
+    self.blocked_until = 0.0
+    self.expected_wait = None
+    self.statistics = collections.Counter()
+    self.instruments = None
+    self.monitor = None
+
+  def sent(self, line, reply=None):
+    """
+    Registers a command line that has just been written.
+
+    Returns the Query awaiting the reply if the command produces one.
+    """
+    now = time.time()
+    command = mnemonic(line)
+    if command == 'WT':
+      try:
+        delay = float(line.split('WT', 1)[1] or 0) / 1000.0
+      except ValueError:
+        delay = 0.0
+      self.blocked_until = max(self.blocked_until, now) + delay
+    elif command in WAIT_MNEMONICS:
+      self.blocked_until = now + (self.expected_wait or self.wait_deadline)
+    if not batching.expectsReply(line):
+      return None
+    deadline = (max(now, self.blocked_until)
+                + self.deadlines.get(command, self.default_deadline))
+    query = Query(line, deadline, reply)
+    query.sent_at = now
+    if self.observer is not None:
+      query.sequence = self.observer.sequence
+    self.outstanding.append(query)
+    return query
+
+  def expectWaits(self, seconds):
+    """
+    Sets how long the wait commands written next may hold back replies, in
+    place of wait_deadline; None restores wait_deadline.
+
+    Returns the previous setting.
+    """
+    previous, self.expected_wait = self.expected_wait, seconds
+    return previous
+
+  def answered(self, line, response, reply=None):
+    """
+    Registers a query answered without contacting the controller.
+
+    The response is handed out in turn like that of any other query.
+    """
+    query = Query(line, None, reply)
+    query.response = response
+    self.outstanding.append(query)
+    return query
+
+  def discard(self):
+    """
+    Forgets all outstanding queries and returns those still awaiting a reply.
+
+    Replies to them that still arrive are dropped as strays.
+    """
+    waiting = [query for query in self.outstanding if query.response is None]
+    for query in self.outstanding:
+      query.done = True
+    self.outstanding.clear()
+    return waiting
+
+  def read(self):
+    """
+    Returns the reply to the most recent outstanding query.
+
+    Replies to older queries that nobody collected are discarded. With no
+    query outstanding a line is read with the default deadline.
+    """
+    if self.outstanding:
+      return self.collect(self.outstanding[-1])
+    return self._readLine(time.time() + self.default_deadline)
+
+  def collect(self, query):
+    """
+    Reads replies up to and including that of the given query.
+
+    Replies to earlier queries are handed to their PendingReply, if any.
+    """
+    while self.outstanding and not query.done:
+      current = self.outstanding[0]
+      if current.response is None:
+        current.response = self._receive(current)
+        if self.observer is not None:
+          self.observer.record(current.line, current.response,
+                               current.sequence)
+      self.outstanding.popleft()
+      current.done = True
+      response = current.response
+      if current.reply is not None:
+        current.reply.set(response)
+      elif current is not query:
+        self.statistics['uncollected'] += 1
+      if current is query:
+        break
+    return query.response
+
+  def _receive(self, query):
+    for attempt in xrange(self.retries + 1):
+      while True:
+        line = self._readLine(query.deadline)
+        if not line.endswith('\n'):
+          break
+        if query.accepts(line.strip()):
+          self.statistics['replies'] += 1
+          self.blocked_until = 0.0
+          if self.instruments is not None:
+            self.instruments.roundTrip(query.mnemonic,
+                                       time.time() - query.sent_at)
+          if self.monitor is not None:
+            self.monitor.answered(query.line)
+          return line
+        self.statistics['stray'] += 1
+      self.statistics['timeouts'] += 1
+      if self.observer is not None:
+        self.observer.invalidate()
+      self.resync(retry=attempt < self.retries)
+    self.outstanding.popleft()
+    raise ControllerTimeout('No reply to %r within its deadline.' % query.line)
+
+  def resync(self, retry=True):
+    """
+    Discards all replies in flight and waits for a fresh version reply.
+
+    The outstanding queries are then written again in order, except for the
+    oldest one when retry is False.
+    """
+    self.statistics['resyncs'] += 1
+    self.io.flushInput()
+    self.io.write('VE?' + self.terminator)
+    deadline = time.time() + self.deadlines['VE'] * 2
+    while True:
+      line = self._readLine(deadline)
+      if not line or 'Version' in line:
+        break
+    self.blocked_until = 0.0
+    for query in list(self.outstanding)[0 if retry else 1:]:
+      if query.response is not None:
+        continue
+      self.io.write(query.line + self.terminator)
+      query.sent_at = time.time()
+      query.deadline = (query.sent_at
+        + self.deadlines.get(query.mnemonic, self.default_deadline))
+
+  def _readLine(self, deadline):
+    """
+    Reads one line, returning early at the terminator or partially at the
+    deadline.
+
+    The port timeout stays at read_timeout; readline() is repeated until the
+    deadline, which may therefore be overrun by up to read_timeout.
+    """
+    line = ''
+    while not line.endswith('\n') and time.time() < deadline:
+      chunk = self.io.readline()
+      if not chunk:
+        continue
+      if self.instruments is not None:
+        self.instruments.read(len(chunk))
+      line += chunk
+    return line
@@ -0,0 +1,305 @@
+"""
+Append-only on-disk recording of measurement runs.
+
+A run is a directory holding one raw binary file per stream of fixed-size
+records (camera frames, the positions of every group or axis, the serial
+command lines) plus streams.json describing their NumPy dtypes, and
+results.jsonl with one derived result per line. Records are collected in a
+preallocated buffer of buffer_rows rows and appended to their file when the
+buffer fills, on flush() and at least every flush_interval seconds, so memory
+stays bounded and a crash loses at most the last interval. Files are only
+ever appended to; a partly written last record is ignored when loading and
+dropped before the run is appended to again.
+
+Recording a measurement::
+
+    recorder = recording.Recorder('runs/2014-06-12')
+    recorder.attach(eps)
+    focal = utilities.FocalPoint(eps, 1, lbp, recorder=recorder)
+    focal.findFocalPoint()
+    focal.outputInfo()
+    recorder.close()
+
+Loading maps the stream files into memory without copying them::
+
+    run = recording.loadRun('runs/2014-06-12')
+    frames = run.stream('frames')
+    print frames['power'].mean(), run.results[-1]
+"""
+
+import json
+import numpy
+import os
+import time
+
+COMMAND_DTYPE = numpy.dtype([('host_time', 'f8'), ('direction', 'S1'),
+                             ('line', 'S128')])
+
+def _writeAtomically(path, text):
+  temporary = path + '.tmp'
+  with open(temporary, 'w') as output:
+    output.write(text)
+    output.flush()
+    os.fsync(output.fileno())
+  os.rename(temporary, path)
+
+def _dtypeFromJson(descr):
+  fields = []
+  for field in descr:
+    if len(field) == 3:
+      fields.append((str(field[0]), str(field[1]), tuple(field[2])))
+    else:
+      fields.append((str(field[0]), str(field[1])))
+  return numpy.dtype(fields)
+
+class _Stream(object):
+  """
+  Buffered appends of fixed-size records to one file.
+  """
+
+  def __init__(self, path, dtype, buffer_rows):
+    self.path = path
+    self.dtype = dtype
+    self.buffer = numpy.zeros(buffer_rows, dtype=dtype)
+    self.count = 0
+    self.file = open(path, 'ab')
+    # Drop a record left incomplete by a crash before appending to it.
+    size = os.path.getsize(path)
+    self.file.truncate(size - size % dtype.itemsize)
+    self.rows = size // dtype.itemsize
+
+  def append(self, row):
+    self.buffer[self.count] = row
+    self.count += 1
+    if self.count == len(self.buffer):
+      self.write()
+
+  def extend(self, rows):
+    if self.count + len(rows) > len(self.buffer):
+      self.write()
+    if len(rows) >= len(self.buffer):
+      self.file.write(numpy.ascontiguousarray(rows, dtype=self.dtype)
+                      .tostring())
+      self.rows += len(rows)
+      return
+    self.buffer[self.count:self.count + len(rows)] = rows
+    self.count += len(rows)
+
+  def write(self):
+    if self.count:
+      self.file.write(self.buffer[:self.count].tostring())
+      self.rows += self.count
+      self.count = 0
+
+  def flush(self):
+    self.write()
+    self.file.flush()
+    os.fsync(self.file.fileno())
+
+  def close(self):
+    self.flush()
+    self.file.close()
+
+class Recorder(object):
+  """
+  Writes the streams and results of one run into a directory.
+  """
+
+  def __init__(self, path, buffer_rows=4096, flush_interval=5.0):
+    """
+    Arguments:
+    path -- Run directory; created if missing. Existing streams are
+            appended to.
+    buffer_rows -- Records held in memory per stream before writing.
+    flush_interval -- Longest time in seconds between flushes to disk.
+    """
+    self.path = path
+    if not os.path.isdir(path):
+      os.makedirs(path)
+    self.buffer_rows = buffer_rows
+    self.flush_interval = flush_interval
+    self.last_flush = time.time()
+    self.streams = {}
+    self.dtypes = {}
+    manifest = os.path.join(path, 'streams.json')
+    if os.path.exists(manifest):
+      with open(manifest) as existing:
+        for name, descr in json.load(existing).items():
+          self.dtypes[str(name)] = _dtypeFromJson(descr)
+    self.results = open(os.path.join(path, 'results.jsonl'), 'a')
+
+  def addStream(self, name, dtype):
+    """
+    Declares a stream of records of the given NumPy dtype.
+    """
+    dtype = numpy.dtype(dtype)
+    if name in self.streams:
+      return self.streams[name]
+    if name in self.dtypes and self.dtypes[name] != dtype:
+      raise ValueError('Stream %r was recorded with another dtype.' % name)
+    self.streams[name] = _Stream(os.path.join(self.path, name + '.bin'),
+                                 dtype, self.buffer_rows)
+    if name not in self.dtypes:
+      self.dtypes[name] = dtype
+      _writeAtomically(os.path.join(self.path, 'streams.json'),
+                       json.dumps(dict((key, value.descr) for key, value
+                                       in self.dtypes.items()), indent=1))
+    return self.streams[name]
+
+  def append(self, name, row, dtype=None):
+    """
+    Appends one record, given as a tuple in field order, to a stream.
+
+    The stream is declared with dtype on first use.
+    """
+    stream = self.streams.get(name) or self.addStream(name, dtype)
+    stream.append(row)
+    self._tick()
+
+  def extend(self, name, rows):
+    """
+    Appends a structured array of records to a stream.
+    """
+    stream = self.streams.get(name) or self.addStream(name, rows.dtype)
+    stream.extend(rows)
+    self._tick()
+
+  def recordFrames(self, rows):
+    """
+    Appends camera frames given as a structured array.
+    """
+    self.extend('frames', rows)
+
+  def recordPosition(self, source, host_time, position):
+    """
+    Appends the position of a group or axis.
+    """
+    position = numpy.atleast_1d(numpy.asarray(position, dtype='f8'))
+    self.append('positions_%s' % source, (host_time, position),
+                [('host_time', 'f8'), ('position', 'f8', (len(position),))])
+
+  def recordCommand(self, line, direction='>', host_time=None):
+    """
+    Appends a serial line written ('>') to or read ('<') from a controller.
+    """
+    if host_time is None:
+      host_time = time.time()
+    self.append('commands', (host_time, direction, line.strip()),
+                COMMAND_DTYPE)
+
+  def recordResult(self, name, value, host_time=None):
+    """
+    Appends a derived result, any JSON serializable value, to results.jsonl.
+    """
+    if host_time is None:
+      host_time = time.time()
+    self.results.write(json.dumps({'name': name, 'host_time': host_time,
+                                   'value': value}) + '\n')
+    self.flush()
+
+  def attach(self, controller):
+    """
+    Records every serial line exchanged with a StageController.
+    """
+    port = RecordingPort(controller.io, self)
+    controller.io = port
+    controller.engine.io = port
+
+  def _tick(self):
+    if time.time() - self.last_flush >= self.flush_interval:
+      self.flush()
+
+  def flush(self):
+    """
+    Writes all buffered records and forces them to disk.
+    """
+    for stream in self.streams.values():
+      stream.flush()
+    self.results.flush()
+    os.fsync(self.results.fileno())
+    self.last_flush = time.time()
+
+  def close(self):
+    """
+    Flushes and closes all files of the run.
+    """
+    self.flush()
+    for stream in self.streams.values():
+      stream.close()
+    self.streams.clear()
+    self.results.close()
+
+class RecordingPort(object):
+  """
+  A serial port wrapper that records every line written and read.
+  """
+
+  def __init__(self, io, recorder):
+    self.__dict__['_io'] = io
+    self.__dict__['_recorder'] = recorder
+
+  def write(self, data):
+    for line in data.split('\r'):
+      if line.strip():
+        self._recorder.recordCommand(line, '>')
+    return self._io.write(data)
+
+  def readline(self):
+    line = self._io.readline()
+    if line:
+      self._recorder.recordCommand(line, '<')
+    return line
+
+  def __getattr__(self, name):
+    return getattr(self._io, name)
+
+  def __setattr__(self, name, value):
+    setattr(self._io, name, value)
+
+class RecordedRun(object):
+  """
+  A recorded run with its streams mapped read-only into memory.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    with open(os.path.join(path, 'streams.json')) as manifest:
+      self.dtypes = dict((str(name), _dtypeFromJson(descr)) for name, descr
+                         in json.load(manifest).items())
+    self.results = []
+    results = os.path.join(path, 'results.jsonl')
+    if os.path.exists(results):
+      with open(results) as lines:
+        for line in lines:
+          try:
+            self.results.append(json.loads(line))
+          except ValueError:
+            break
+
+  @property
+  def names(self):
+    return sorted(self.dtypes)
+
+  def stream(self, name):
+    """
+    Returns the records of a stream as a read-only memory-mapped array.
+    """
+    dtype = self.dtypes[name]
+    path = os.path.join(self.path, name + '.bin')
+    rows = os.path.getsize(path) // dtype.itemsize if os.path.exists(path) \
+           else 0
+    if rows == 0:
+      return numpy.zeros(0, dtype=dtype)
+    return numpy.memmap(path, dtype=dtype, mode='r', shape=(rows,))
+
+  def positions(self, source):
+    """
+    Returns the recorded positions of a group or axis.
+    """
+    return self.stream('positions_%s' % source)
+
+def loadRun(path):
+  """
+  Opens a recorded run for analysis.
+  """
+  return RecordedRun(path)
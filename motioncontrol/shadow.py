@@ -0,0 +1,222 @@
+"""
+Host-side shadow of EPS300 axis and group parameters.
+
+The ShadowState watches every command line sent to the controller and every
+reply read back. Parameters that only change when the host sets them (units,
+velocities, accelerations, jerk and group membership) are kept so that queries
+for them can be answered without a serial round trip and setters that would
+not change anything can be skipped. A value taken from a setter is only used
+once the controller has accepted it: a later reply to a query for it, or an
+error check (TB? or TX) that finds no error after the setter was written,
+confirms it, while a setter the controller rejects leaves the parameter to be
+asked of the controller again. Motor power is recorded as well but never
+trusted: the controller turns motors off by itself on a trip, a following
+error or a limit, so motor on and off commands are always sent and MO? is
+always asked of the controller. Axes confirmed homed are marked so that they
+need not be homed again. Everything is forgotten on a controller reset, an
+abort, the start of a stored program, a reply timeout or an error read from
+the error FIFO.
+"""
+
+import monitoring
+import re
+
+# Axis parameters set and queried with the same mnemonic.
+AXIS_PARAMETERS = set(['AC', 'AE', 'AG', 'AU', 'BA', 'FE', 'FR', 'GR', 'JK',
+                       'SH', 'SN', 'VA', 'VU'])
+
+# Group parameters set and queried with the same mnemonic.
+GROUP_PARAMETERS = set(['HA', 'HD', 'HE', 'HJ', 'HV'])
+
+_line_pattern = re.compile(r'^\s*(\d*)\s*([A-Za-z]{2})\s*(.*?)\s*$')
+
+def _split(line):
+  match = _line_pattern.match(line)
+  if not match:
+    return '', '', ''
+  prefix, mnemonic, parameter = match.groups()
+  return prefix, mnemonic.upper(), parameter
+
+def _same(cached, parameter):
+  try:
+    return float(cached) == float(parameter)
+  except ValueError:
+    return cached.strip() == parameter.strip()
+
+class ShadowState(object):
+  """
+  Cache of controller parameters filled from setters and query replies.
+
+  Values are kept as reply strings keyed by (axis or group number, mnemonic).
+  Motor power is kept under the 'MO' mnemonic, group existence under 'HN'
+  and completed home searches under 'OR'. Every written line is numbered;
+  values set by setters not yet confirmed are kept in unconfirmed with the
+  number of their line. The statistics attribute counts answered queries and
+  skipped setters.
+  """
+
+  def __init__(self):
+    self.enabled = True
+    self.values = {}
+    self.groups = None
+    self.sequence = 0
+    self.unconfirmed = {}
+    self.statistics = {'answered': 0, 'skipped': 0, 'invalidations': 0}
+
+  def invalidate(self):
+    """
+    Forgets everything known about the controller.
+    """
+    self.values.clear()
+    self.unconfirmed.clear()
+    self.groups = None
+    self.statistics['invalidations'] += 1
+
+  def _forget(self, prefix, mnemonics):
+    for mnemonic in mnemonics:
+      self.values.pop((prefix, mnemonic), None)
+      self.unconfirmed.pop((prefix, mnemonic), None)
+
+  def _set(self, prefix, mnemonic, parameter):
+    self.values[(prefix, mnemonic)] = parameter
+    self.unconfirmed[(prefix, mnemonic)] = self.sequence
+
+  def _confirm(self, sequence):
+    for key, written in self.unconfirmed.items():
+      if written < sequence:
+        del self.unconfirmed[key]
+
+  def _groupAxes(self, prefix):
+    axes = self.values.get((prefix, 'HN'))
+    if axes is None:
+      return []
+    return [axis.strip() for axis in axes.split(',')]
+
+  def setHomed(self, axis):
+    """
+    Marks an axis whose home search has completed.
+    """
+    self.values[(str(axis), 'OR')] = '1'
+
+  def isHomed(self, axis):
+    """
+    Returns True if the axis was homed since the last invalidation.
+    """
+    return self.enabled and self.values.get((str(axis), 'OR')) == '1'
+
+  def lookup(self, line, count=True):
+    """
+    Returns the cached reply line to a query, or None if it must be sent.
+
+    count -- Count a returned reply as answered in the statistics.
+    """
+    if not self.enabled:
+      return None
+    prefix, mnemonic, parameter = _split(line)
+    if mnemonic == 'HB' and self.groups is not None:
+      if ('', 'HB') in self.unconfirmed:
+        return None
+      value = ','.join(sorted(self.groups, key=int))
+    elif parameter != '?':
+      return None
+    elif mnemonic in AXIS_PARAMETERS or mnemonic in GROUP_PARAMETERS \
+        or mnemonic == 'HN':
+      if (prefix, mnemonic) in self.unconfirmed:
+        return None
+      value = self.values.get((prefix, mnemonic))
+    else:
+      return None
+    if value is None:
+      return None
+    if count:
+      self.statistics['answered'] += 1
+    return value + '\r\n'
+
+  def isRedundant(self, line):
+    """
+    Returns True if sending a setter would not change the controller state.
+
+    Repeating an unconfirmed setter is redundant as well: the controller
+    either holds the value already or has rejected it once.
+    """
+    if not self.enabled:
+      return False
+    prefix, mnemonic, parameter = _split(line)
+    if parameter and parameter != '?' and (mnemonic in AXIS_PARAMETERS
+                                           or mnemonic in GROUP_PARAMETERS):
+      cached = self.values.get((prefix, mnemonic))
+      redundant = cached is not None and _same(cached, parameter)
+    else:
+      redundant = False
+    if redundant:
+      self.statistics['skipped'] += 1
+    return redundant
+
+  def sent(self, line):
+    """
+    Updates the shadow for a command line written to the controller.
+
+    Only lines actually written are passed here, so commands of a discarded
+    batch or of a failed write never reach the shadow.
+    """
+    self.sequence += 1
+    prefix, mnemonic, parameter = _split(line)
+    if mnemonic in ('RS', 'AB', 'EX'):
+      self.invalidate()
+    elif parameter == '?' or not mnemonic:
+      return
+    elif mnemonic == 'SN' and parameter:
+      self._forget(prefix, AXIS_PARAMETERS)
+      self._set(prefix, mnemonic, parameter)
+    elif (mnemonic in AXIS_PARAMETERS or mnemonic in GROUP_PARAMETERS) \
+        and parameter:
+      self._set(prefix, mnemonic, parameter)
+    elif mnemonic in ('MO', 'MF'):
+      self.values[(prefix, 'MO')] = '1' if mnemonic == 'MO' else '0'
+    elif mnemonic == 'OR':
+      self.values.pop((prefix, 'OR'), None)
+    elif mnemonic in ('HO', 'HF'):
+      state = '1' if mnemonic == 'HO' else '0'
+      self.values[(prefix, 'HO')] = state
+      for axis in self._groupAxes(prefix):
+        self.values[(axis, 'MO')] = state
+    elif mnemonic == 'HN' and parameter:
+      self._forget(prefix, GROUP_PARAMETERS | set(['HN', 'HO']))
+      self._set(prefix, 'HN', parameter)
+      if self.groups is not None:
+        self.groups.add(prefix)
+        self.unconfirmed[('', 'HB')] = self.sequence
+    elif mnemonic == 'HX':
+      self._forget(prefix, GROUP_PARAMETERS | set(['HN', 'HO']))
+      if self.groups is not None:
+        self.groups.discard(prefix)
+        self.unconfirmed[('', 'HB')] = self.sequence
+
+  def record(self, line, response, sequence=0):
+    """
+    Fills the shadow from the reply to a query line.
+
+    sequence is the number the query line got when it was written. A reply
+    confirms the setters written before the query and is ignored for a
+    parameter set again since.
+    """
+    prefix, mnemonic, parameter = _split(line)
+    value = response.strip()
+    if mnemonic == 'TB':
+      if value.split(',')[0].strip() not in ('0', ''):
+        self.invalidate()
+      else:
+        self._confirm(sequence)
+    elif mnemonic == 'TX':
+      if value and not ord(value[0]) & monitoring.ACTIVITY_ERRORS:
+        self._confirm(sequence)
+    elif mnemonic == 'HB':
+      if self.unconfirmed.get(('', 'HB'), -1) < sequence:
+        self.groups = set(x.strip() for x in value.split(',') if x.strip())
+        self.unconfirmed.pop(('', 'HB'), None)
+    elif parameter == '?' and (mnemonic in AXIS_PARAMETERS
+                               or mnemonic in GROUP_PARAMETERS
+                               or mnemonic in ('HN', 'MO')):
+      if self.unconfirmed.get((prefix, mnemonic), -1) < sequence:
+        self.values[(prefix, mnemonic)] = value
+        self.unconfirmed.pop((prefix, mnemonic), None)
@@ -0,0 +1,350 @@
+"""
+Sharing the controller and camera ports between processes.
+
+A PortServer owns the serial ports of one EPS300 and one HD-LBP and accepts
+clients on a Unix socket. Command lines written by a client are passed to the
+controller in order, the replies to that client's queries are read by the
+server and sent back to it alone, and every camera frame is decoded once and
+sent to every client subscribed to the camera. Start the server once::
+
+    from motioncontrol import sharing
+    sharing.serve('/dev/ttyUSB0', '/dev/ttyUSB1')
+
+Clients then connect without opening or querying the ports. They are
+StageController and LaserBeamProfiler objects, with their Stage axes, whose
+I/O goes through the server::
+
+    eps = sharing.SharedStageController()
+    lbp = sharing.SharedLaserBeamProfiler()
+    eps.axis1.move(0.5)
+    print eps.axis1.position(), lbp.read()['power']
+
+Clients do not keep a shadow of the controller state since other clients may
+change it. Replies that arrive while another client's wait command holds the
+controller are delayed for every client, as they would be on the port itself.
+"""
+
+import camera
+import collections
+import controller
+import json
+import os
+import queries
+import Queue
+import socket
+import threading
+import time
+
+DEFAULT_PATH = '/tmp/motioncontrol.sock'
+
+class _Connection(object):
+  """
+  JSON messages, one per line, over a stream socket.
+  """
+
+  def __init__(self, sock):
+    self.sock = sock
+    self.buffer = ''
+
+  def send(self, message):
+    self.sock.sendall(json.dumps(message) + '\n')
+
+  def receive(self, timeout=None):
+    """
+    Returns the next message, or None if none is complete within timeout.
+
+    Raises IOError once the other side has closed the connection.
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    while '\n' not in self.buffer:
+      if deadline is not None:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+          return None
+        self.sock.settimeout(remaining)
+      else:
+        self.sock.settimeout(None)
+      try:
+        chunk = self.sock.recv(65536)
+      except socket.timeout:
+        return None
+      if not chunk:
+        raise IOError('The port server connection was closed.')
+      self.buffer += chunk
+    line, self.buffer = self.buffer.split('\n', 1)
+    return json.loads(line)
+
+  def inWaiting(self):
+    return len(self.buffer)
+
+  def close(self):
+    self.sock.close()
+
+def _connect(path):
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  sock.connect(path)
+  return _Connection(sock)
+
+class _Subscriber(object):
+  """
+  A client receiving camera frames, with a bounded backlog.
+  """
+
+  def __init__(self, connection, backlog):
+    self.connection = connection
+    self.frames = Queue.Queue(backlog)
+    self.dropped = 0
+
+  def put(self, records):
+    try:
+      self.frames.put_nowait(records)
+    except Queue.Full:
+      self.dropped += len(records)
+
+class PortServer(object):
+  """
+  Owns the controller and camera ports and serves them to local clients.
+  """
+
+  def __init__(self, controller_device, camera_device=None, path=DEFAULT_PATH,
+               backlog=256):
+    """
+    Arguments:
+    controller_device -- Serial port path or open port of the EPS300.
+    camera_device -- Serial port path or open port of the HD-LBP, if any.
+    path -- Path of the Unix socket clients connect to.
+    backlog -- Batches of camera frames held for a slow subscriber before
+               further frames are dropped for it.
+    """
+    self.controller = controller.StageController(controller_device)
+    self.controller.shadow.enabled = False
+    self.version = self.controller.readFirmwareVersion()
+    self.camera = None
+    if camera_device is not None:
+      self.camera = camera.LaserBeamProfiler(camera_device)
+    self.path = path
+    self.backlog = backlog
+    self.lock = threading.Lock()
+    self.subscribers = []
+    self.subscribers_lock = threading.Lock()
+    self.running = True
+    if os.path.exists(path):
+      try:
+        _connect(path).close()
+      except socket.error:
+        os.unlink(path)
+      else:
+        raise IOError('A port server is already listening on %s.' % path)
+    self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self.listener.bind(path)
+    self.listener.listen(16)
+    self.listener.settimeout(0.5)
+    self.threads = [threading.Thread(target=self._accept)]
+    if self.camera is not None:
+      self.threads.append(threading.Thread(target=self._pump))
+    for thread in self.threads:
+      thread.daemon = True
+      thread.start()
+
+  def execute(self, data):
+    """
+    Writes command lines to the controller and returns the replies.
+
+    The replies are those of every command in the lines that produces one,
+    in order, with None for a reply that did not arrive in time.
+    """
+    engine = self.controller.engine
+    lines = [line for line in data.split(self.controller.io_end)
+             if line.strip()]
+    if not lines:
+      return []
+    with self.lock:
+      self.controller._write(lines)
+      pending = [engine.sent(command) for line in lines
+                 for command in line.split(';')]
+      replies = []
+      for query in pending:
+        if query is None:
+          continue
+        try:
+          replies.append(engine.collect(query))
+        except queries.ControllerTimeout:
+          replies.append(None)
+    return replies
+
+  def _accept(self):
+    while self.running:
+      try:
+        sock, address = self.listener.accept()
+      except socket.timeout:
+        continue
+      except socket.error:
+        break
+      sock.settimeout(None)
+      client = threading.Thread(target=self._serve, args=(sock,))
+      client.daemon = True
+      client.start()
+
+  def _serve(self, sock):
+    connection = _Connection(sock)
+    try:
+      while self.running:
+        message = connection.receive()
+        operation = message.get('op')
+        if operation == 'write':
+          connection.send({'replies': self.execute(message['data'])})
+        elif operation == 'version':
+          connection.send({'version': self.version})
+        elif operation == 'subscribe' and self.camera is not None:
+          self._stream(connection)
+          return
+        else:
+          connection.send({'error': 'Unsupported request %r.' % operation})
+    except (IOError, socket.error, ValueError):
+      pass
+    finally:
+      connection.close()
+
+  def _stream(self, connection):
+    subscriber = _Subscriber(connection, self.backlog)
+    with self.subscribers_lock:
+      self.subscribers.append(subscriber)
+    try:
+      while self.running:
+        try:
+          records = subscriber.frames.get(timeout=0.5)
+        except Queue.Empty:
+          continue
+        connection.send({'frames': records})
+    finally:
+      with self.subscribers_lock:
+        self.subscribers.remove(subscriber)
+
+  def _pump(self):
+    while self.running:
+      records = self.camera._receive()
+      if records:
+        for subscriber in list(self.subscribers):
+          subscriber.put(records)
+
+  def close(self):
+    """
+    Stops serving and removes the socket.
+    """
+    self.running = False
+    for thread in self.threads:
+      thread.join()
+    self.listener.close()
+    if os.path.exists(self.path):
+      os.unlink(self.path)
+
+def serve(controller_device, camera_device=None, path=DEFAULT_PATH):
+  """
+  Runs a PortServer until interrupted.
+  """
+  server = PortServer(controller_device, camera_device, path)
+  try:
+    while True:
+      time.sleep(1)
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.close()
+
+class _ControllerPort(object):
+  """
+  Serial port look-alike exchanging controller lines through a PortServer.
+
+  Replies are returned by the server as soon as the written lines have been
+  answered and are then read from here like from the port.
+  """
+
+  def __init__(self, path):
+    self.connection = _connect(path)
+    self.replies = collections.deque()
+    self.timeout = 1
+
+  def _result(self, key):
+    message = self.connection.receive()
+    if 'error' in message:
+      raise IOError(message['error'])
+    return message[key]
+
+  def write(self, data):
+    self.connection.send({'op': 'write', 'data': data})
+    self.replies.extend(self._result('replies'))
+
+  def readline(self):
+    if self.replies:
+      return self.replies.popleft() or ''
+    return ''
+
+  def inWaiting(self):
+    return sum(len(line or '') for line in self.replies)
+
+  def flushInput(self):
+    self.replies.clear()
+
+  def version(self):
+    self.connection.send({'op': 'version'})
+    return self._result('version')
+
+  def close(self):
+    self.connection.close()
+
+class SharedStageController(controller.StageController):
+  """
+  A StageController using the controller port of a PortServer.
+  """
+
+  def __init__(self, path=DEFAULT_PATH):
+    """
+    Connects to the PortServer listening on the Unix socket path.
+    """
+    controller.StageController.__init__(self, _ControllerPort(path))
+    self.shadow.enabled = False
+
+  def readFirmwareVersion(self):
+    """
+    Report the controller firmware version read when the server started.
+    """
+    return self.io.version()
+
+  def close(self):
+    """
+    Disconnects from the server.
+    """
+    self.io.close()
+
+class SharedLaserBeamProfiler(camera.LaserBeamProfiler):
+  """
+  A LaserBeamProfiler receiving the frames decoded by a PortServer.
+
+  The background reader is started at once so that frames are taken from the
+  server as they arrive.
+  """
+
+  def __init__(self, path=DEFAULT_PATH, history=1024):
+    """
+    Subscribes to the camera of the PortServer listening on path.
+    """
+    connection = _connect(path)
+    connection.send({'op': 'subscribe'})
+    camera.LaserBeamProfiler.__init__(self, connection, history)
+    self.timeout = 1.0
+    self.start()
+
+  def _receive(self):
+    message = self.io.receive(self.timeout)
+    if message is None:
+      return []
+    records = message.get('frames', [])
+    self._store(records)
+    return records
+
+  def close(self):
+    """
+    Stops the reader and disconnects from the server.
+    """
+    self.stop()
+    self.io.close()
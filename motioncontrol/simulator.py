@@ -0,0 +1,1392 @@
+"""
+Simulated Newport EPS300 motion controller and HD-LBP laser beam profiler.
+
+The simulated devices stand in for the serial ports used by
+controller.StageController and camera.LaserBeamProfiler so that measurement
+routines can be exercised and profiled without the optics bench. Time is
+virtual: every byte on the serial links and every idle read advances a shared
+clock, so runs are deterministic and usually much faster than real time.
+
+Simple usage::
+
+    from motioncontrol import simulator, controller, camera, utilities
+
+    bench = simulator.SimulatedBench()
+    with bench.clock.patch():
+      eps = controller.StageController(bench.eps300)
+      lbp = camera.LaserBeamProfiler(bench.profiler)
+      eps.initializeGroup(1, [2, 3])
+      beam = utilities.ConstrainToBeam(eps, 1, lbp)
+      beam.findBeam(-125)
+    print bench.eps300.statistics, bench.clock.time()
+"""
+
+import bisect
+import collections
+import contextlib
+import kinematics
+import math
+import random
+import re
+import sys
+import time
+
+# Error messages of the EPS300 error FIFO. Axis specific errors are reported
+# as 100 * axis + code.
+GENERAL_ERRORS = {
+  0: 'NO ERROR DETECTED',
+  6: 'COMMAND DOES NOT EXIST',
+  7: 'PARAMETER OUT OF RANGE',
+  9: 'AXIS NUMBER OUT OF RANGE',
+  13: 'GROUP NUMBER MISSING',
+  14: 'GROUP NUMBER OUT OF RANGE',
+  15: 'GROUP NUMBER NOT ASSIGNED',
+  16: 'GROUP NUMBER ALREADY ASSIGNED',
+  17: 'GROUP AXIS OUT OF RANGE',
+  18: 'GROUP AXIS ALREADY ASSIGNED',
+  19: 'GROUP AXIS DUPLICATED',
+  37: 'AXIS NUMBER MISSING',
+  38: 'COMMAND PARAMETER MISSING',
+}
+AXIS_ERRORS = {
+  1: 'PARAMETER OUT OF RANGE',
+  6: 'POSITIVE SOFTWARE LIMIT DETECTED',
+  7: 'NEGATIVE SOFTWARE LIMIT DETECTED',
+  10: 'MAXIMUM VELOCITY EXCEEDED',
+  11: 'MAXIMUM ACCELERATION EXCEEDED',
+  13: 'MOTOR NOT ENABLED',
+  20: 'HOMING ABORTED',
+  31: 'COMMAND NOT ALLOWED DUE TO GROUP ASSIGNMENT',
+}
+
+class SimulatedClock(object):
+  """
+  Virtual time shared by the simulated devices.
+  """
+
+  def __init__(self, start=0.0):
+    self.now = float(start)
+
+  def time(self):
+    """
+    Returns the current virtual time in seconds.
+    """
+    return self.now
+
+  def sleep(self, seconds):
+    """
+    Advances virtual time instead of blocking.
+    """
+    self.advance(seconds)
+
+  def advance(self, seconds):
+    """
+    Moves the clock forward by the given number of seconds.
+    """
+    if seconds > 0:
+      self.now += seconds
+
+  def advanceTo(self, when):
+    """
+    Moves the clock forward to the given time if it lies in the future.
+    """
+    if when > self.now:
+      self.now = when
+
+  @contextlib.contextmanager
+  def patch(self, *modules):
+    """
+    Replaces the `time` module used by the given modules with this clock.
+
+    Calls to time.sleep() and time.time() within those modules then run in
+    virtual time. Without arguments every loaded module of this package that
+    imports time is patched. The original references are restored on exit.
+    """
+    if not modules:
+      package = __name__.rpartition('.')[0]
+      modules = [module for name, module in sys.modules.items()
+                 if module is not None and name.startswith(package)
+                 and getattr(module, 'time', None) is time]
+    saved = [(module, module.time) for module in modules]
+    try:
+      for module in modules:
+        module.time = self
+      yield self
+    finally:
+      for module, original in saved:
+        module.time = original
+
+class _Hold(object):
+  """
+  A stationary trajectory segment.
+  """
+
+  def __init__(self, position, start):
+    self.position = list(position)
+    self.start = start
+    self.end = start
+
+  def at(self, t):
+    return self.position
+
+  def speed(self, t):
+    return 0.0
+
+  def direction(self, t):
+    return [0.0] * len(self.position)
+
+class _Line(object):
+  """
+  A straight trajectory segment between two points.
+  """
+
+  def __init__(self, origin, target, profile_args, start, home_time=0.0):
+    self.origin = [float(x) for x in origin]
+    self.target = [float(x) for x in target]
+    length = math.sqrt(sum((b - a) ** 2 for a, b in zip(self.origin,
+                                                        self.target)))
+    self.unit = [(b - a) / length if length else 0.0
+                 for a, b in zip(self.origin, self.target)]
+    self.profile = kinematics.MotionProfile(length, *profile_args)
+    self.start = start
+    self.end = start + self.profile.duration + home_time
+
+  def at(self, t):
+    s = self.profile.distance(t - self.start)
+    return [a + s * u for a, u in zip(self.origin, self.unit)]
+
+  def speed(self, t):
+    return self.profile.speed(t - self.start)
+
+  def direction(self, t):
+    return self.unit
+
+class _Path(object):
+  """
+  A polyline trajectory followed without stopping at its corners.
+
+  Points appended before the deceleration has begun extend the path; the
+  profile is then re-planned over the whole length from the original start,
+  which is exact once the group cruises.
+  """
+
+  def __init__(self, origin, target, profile_args, start):
+    self.points = [[float(x) for x in origin]]
+    self.lengths = [0.0]
+    self.profile_args = profile_args
+    self.start = start
+    self.append(target)
+
+  def append(self, target):
+    target = [float(x) for x in target]
+    last = self.points[-1]
+    self.points.append(target)
+    self.lengths.append(self.lengths[-1] + math.sqrt(
+      sum((b - a) ** 2 for a, b in zip(last, target))))
+    self.profile = kinematics.MotionProfile(self.lengths[-1],
+                                            *self.profile_args)
+    self.end = self.start + self.profile.duration
+
+  def canExtend(self, t):
+    """
+    Returns True if a point appended at time t joins the path seamlessly.
+    """
+    profile = self.profile
+    return t < self.start + profile.t_accel + profile.t_cruise
+
+  def pending(self, t):
+    """
+    Returns the number of points not yet reached at time t.
+    """
+    s = self.profile.distance(t - self.start)
+    return len(self.lengths) - bisect.bisect_right(self.lengths, s)
+
+  def reaches(self, index):
+    """
+    Returns the time at which the point with the given index is reached.
+    """
+    target = self.lengths[index]
+    low, high = self.start, self.end
+    for _ in xrange(60):
+      middle = (low + high) / 2.0
+      if self.profile.distance(middle - self.start) < target:
+        low = middle
+      else:
+        high = middle
+    return high
+
+  def _leg(self, s):
+    return min(max(bisect.bisect_right(self.lengths, s), 1),
+               len(self.lengths) - 1)
+
+  def at(self, t):
+    s = self.profile.distance(t - self.start)
+    leg = self._leg(s)
+    a, b = self.points[leg - 1], self.points[leg]
+    span = self.lengths[leg] - self.lengths[leg - 1]
+    fraction = (s - self.lengths[leg - 1]) / span if span else 1.0
+    return [x + fraction * (y - x) for x, y in zip(a, b)]
+
+  def speed(self, t):
+    return self.profile.speed(t - self.start)
+
+  def direction(self, t):
+    leg = self._leg(self.profile.distance(t - self.start))
+    a, b = self.points[leg - 1], self.points[leg]
+    span = self.lengths[leg] - self.lengths[leg - 1]
+    return [(y - x) / span if span else 0.0 for x, y in zip(a, b)]
+
+class _Arc(object):
+  """
+  A circular trajectory segment of a two axis group.
+  """
+
+  def __init__(self, origin, center, sweep, profile_args, start):
+    self.center = [float(x) for x in center]
+    dx, dy = origin[0] - self.center[0], origin[1] - self.center[1]
+    self.radius = math.hypot(dx, dy)
+    self.theta = math.atan2(dy, dx)
+    self.sweep = math.radians(float(sweep))
+    self.profile = kinematics.MotionProfile(self.radius * abs(self.sweep),
+                                            *profile_args)
+    self.start = start
+    self.end = start + self.profile.duration
+
+  def _angle(self, t):
+    if not self.profile.length:
+      return self.theta
+    fraction = self.profile.distance(t - self.start) / self.profile.length
+    return self.theta + fraction * self.sweep
+
+  def at(self, t):
+    theta = self._angle(t)
+    return [self.center[0] + self.radius * math.cos(theta),
+            self.center[1] + self.radius * math.sin(theta)]
+
+  def speed(self, t):
+    return self.profile.speed(t - self.start)
+
+  def direction(self, t):
+    theta = self._angle(t)
+    sign = 1 if self.sweep >= 0 else -1
+    return [-sign * math.sin(theta), sign * math.cos(theta)]
+
+class _Stop(object):
+  """
+  A constant deceleration segment that brings a moving trajectory to rest.
+  """
+
+  def __init__(self, origin, unit, speed, deceleration, start):
+    self.origin = list(origin)
+    self.unit = list(unit)
+    self.initial_speed = speed
+    self.deceleration = float(deceleration)
+    self.start = start
+    self.end = start + (speed / self.deceleration if speed > 0 else 0.0)
+
+  def at(self, t):
+    tau = min(max(t - self.start, 0.0), self.end - self.start)
+    s = self.initial_speed * tau - self.deceleration * tau ** 2 / 2
+    return [a + s * u for a, u in zip(self.origin, self.unit)]
+
+  def speed(self, t):
+    if t >= self.end:
+      return 0.0
+    return self.initial_speed - self.deceleration * max(t - self.start, 0.0)
+
+  def direction(self, t):
+    return self.unit
+
+class SimulatedAxis(object):
+  """
+  Kinematic state of a single simulated stage.
+  """
+
+  def __init__(self, number, lower_limit=-125.0, upper_limit=125.0):
+    self.number = number
+    self.lower_limit = lower_limit
+    self.upper_limit = upper_limit
+    self.units = 2
+    self.velocity = 20.0
+    self.velocity_limit = 100.0
+    self.acceleration = 80.0
+    self.deceleration = 80.0
+    self.estop = 200.0
+    self.acceleration_limit = 400.0
+    self.jerk = 1000.0
+    self.following_error = 0.5
+    self.backlash = 0.0
+    self.home_preset = 0.0
+    self.step_resolution = 1.0
+    self.gear_ratio = 1.0
+    self.model = 'ILS250CC'
+    self.serial_number = 'B%06d' % (101000 + number)
+    self.reset(0.0)
+
+  def reset(self, t):
+    self.motor_on = False
+    self.homed = False
+    self.group = None
+    self.target = 0.0
+    self.segments = [(_Hold([0.0], t), 0)]
+
+  def profileArgs(self):
+    return (self.velocity, self.acceleration, self.deceleration, self.jerk)
+
+  def _segment(self, t):
+    for segment, index in reversed(self.segments):
+      if segment.start <= t:
+        return segment, index
+    return self.segments[0]
+
+  def prune(self, t):
+    """
+    Forgets trajectory segments superseded before time t.
+    """
+    while len(self.segments) > 1 and self.segments[1][0].start <= t:
+      self.segments.pop(0)
+
+  def positionAt(self, t):
+    segment, index = self._segment(t)
+    return segment.at(t)[index]
+
+  def isMoving(self, t):
+    segment, index = self._segment(t)
+    return t < segment.end
+
+  def moveEnd(self, t):
+    """
+    Returns the time at which the motion in progress at t finishes.
+    """
+    return max(t, self.segments[-1][0].end)
+
+  def follow(self, segment, index):
+    self.segments.append((segment, index))
+
+class SimulatedGroup(object):
+  """
+  A group of simulated axes moving along common vector trajectories.
+  """
+
+  def __init__(self, number, axes):
+    self.number = number
+    self.axes = axes
+    self.velocity = 10.0
+    self.acceleration = 100.0
+    self.deceleration = 100.0
+    self.jerk = 1000.0
+    self.estop = 200.0
+    self.on = False
+    self.target = None
+
+  def profileArgs(self):
+    return (self.velocity, self.acceleration, self.deceleration, self.jerk)
+
+  def positionAt(self, t):
+    return [axis.positionAt(t) for axis in self.axes]
+
+  def isMoving(self, t):
+    return any(axis.isMoving(t) for axis in self.axes)
+
+  def moveEnd(self, t):
+    return max(axis.moveEnd(t) for axis in self.axes)
+
+  def follow(self, segment):
+    for index, axis in enumerate(self.axes):
+      axis.follow(segment, index)
+
+class SerialLink(object):
+  """
+  Byte timing of a serial line with 8N1 framing.
+  """
+
+  def __init__(self, baudrate):
+    self.baudrate = baudrate
+    self.byte_time = 10.0 / baudrate
+    self.free_at = 0.0
+
+  def transmit(self, n_bytes, t):
+    """
+    Queues n_bytes for transmission at time t and returns the arrival time.
+    """
+    self.free_at = max(self.free_at, t) + n_bytes * self.byte_time
+    return self.free_at
+
+class SimulatedEPS300(object):
+  """
+  A serial port connected to a simulated EPS300 controller with three axes.
+
+  The object provides the subset of the pyserial interface used by
+  controller.StageController. Commands are executed in order; controller-side
+  waits (WT, WS, WP, HW) delay the execution of everything that follows them.
+  Stored programs (EP, QP, XX, EX with DL and JL) run on their own timeline,
+  so host commands keep being answered while a program executes. Group lines
+  sent while a group moves are queued in a point buffer of group_buffer
+  points and followed without stopping; HQ waits for free buffer slots.
+  The `statistics` attribute counts commands by mnemonic, serial lines and
+  bytes in each direction, started moves and read timeouts.
+  """
+
+  firmware = 'ESP300 Version 3.08 09/09/02'
+  command_latency = 0.0005
+  home_search_time = 0.5
+  error_fifo_size = 10
+  history = 1.0
+  program_steps = 100000
+  group_buffer = 20
+  line_pattern = re.compile(r'^\s*(\d*)\s*([A-Za-z]{2})\s*(.*?)\s*$')
+
+  def __init__(self, clock=None, baudrate=19200, timeout=1, **kwargs):
+    """
+    Creates a simulated controller.
+
+    Keyword arguments set the travel range of the axes:
+     lower_limit=-125 - Software travel limit of every axis.
+     upper_limit=125 - Software travel limit of every axis.
+    """
+    self.clock = clock or SimulatedClock()
+    self.timeout = timeout
+    self.downlink = SerialLink(baudrate)
+    self.uplink = SerialLink(baudrate)
+    lower = kwargs.pop('lower_limit', -125.0)
+    upper = kwargs.pop('upper_limit', 125.0)
+    self.axes = dict((n, SimulatedAxis(n, lower, upper)) for n in (1, 2, 3))
+    self.groups = {}
+    self.errors = collections.deque(maxlen=self.error_fifo_size)
+    self.replies = collections.deque()
+    self.busy_until = 0.0
+    self.programs = {}
+    self.recording = None
+    self.program_until = 0.0
+    self.partial = ''
+    self.statistics = {
+      'commands': collections.Counter(),
+      'lines_written': 0,
+      'lines_read': 0,
+      'bytes_written': 0,
+      'bytes_read': 0,
+      'moves': 0,
+      'timeouts': 0,
+    }
+    self.handlers = {
+      'AB': self._abort, 'AC': self._axisParameter('acceleration'),
+      'AE': self._axisParameter('estop'),
+      'AG': self._axisParameter('deceleration'),
+      'AU': self._axisParameter('acceleration_limit'),
+      'BA': self._axisParameter('backlash'), 'DH': self._defineHome,
+      'DP': self._desiredPosition, 'DV': self._desiredVelocity,
+      'FE': self._axisParameter('following_error'),
+      'FR': self._axisParameter('step_resolution'),
+      'GR': self._axisParameter('gear_ratio'), 'ID': self._stageID,
+      'JK': self._axisParameter('jerk'), 'MD': self._motionDone,
+      'MF': self._motorOff, 'MO': self._motorOn, 'MT': self._moveToLimit,
+      'MV': self._moveToLimit, 'MZ': self._moveToIndex, 'OR': self._home,
+      'PA': self._moveAbsolute, 'PR': self._moveRelative,
+      'RS': self._reset, 'SH': self._axisParameter('home_preset'),
+      'SN': self._units, 'ST': self._stop, 'TB': self._readError,
+      'TP': self._actualPosition, 'TS': self._status, 'TX': self._activity,
+      'VA': self._axisParameter('velocity'),
+      'VE': self._version, 'VU': self._axisParameter('velocity_limit'),
+      'WP': self._waitPosition, 'WS': self._waitStop, 'WT': self._waitTime,
+      'HA': self._groupParameter('acceleration'), 'HB': self._groupList,
+      'HC': self._groupArc, 'HD': self._groupParameter('deceleration'),
+      'HE': self._groupParameter('estop'), 'HF': self._groupOff,
+      'HJ': self._groupParameter('jerk'), 'HL': self._groupLine,
+      'HN': self._groupCreate, 'HO': self._groupOn,
+      'HP': self._groupPosition, 'HQ': self._groupBuffer,
+      'HS': self._groupStop,
+      'HV': self._groupParameter('velocity'), 'HW': self._groupWait,
+      'HX': self._groupDelete, 'HZ': self._groupSize,
+      'EP': self._enterProgram, 'QP': self._quitProgram,
+      'XX': self._eraseProgram, 'EX': self._executeProgram,
+      'DL': self._defineLabel, 'JL': self._jumpToLabel,
+    }
+
+  # Serial port interface.
+
+  def write(self, data):
+    """
+    Receives bytes from the host and executes every completed command line.
+    """
+    now = self.clock.time()
+    self.statistics['bytes_written'] += len(data)
+    arrival = self.downlink.transmit(len(data), now)
+    self.partial += data
+    while '\r' in self.partial:
+      line, self.partial = self.partial.split('\r', 1)
+      self.statistics['lines_written'] += 1
+      line = line.strip('\n')
+      for command in line.split(';'):
+        if command.strip():
+          self._dispatch(command, arrival)
+    return len(data)
+
+  def readline(self):
+    """
+    Returns the next reply line or an empty string after a timeout.
+    """
+    now = self.clock.time()
+    if not self.replies or self.replies[0][0] > now + (self.timeout or 0):
+      self.clock.advance(self.timeout or 0)
+      self.statistics['timeouts'] += 1
+      return ''
+    ready, line = self.replies.popleft()
+    self.clock.advanceTo(ready)
+    self.statistics['lines_read'] += 1
+    self.statistics['bytes_read'] += len(line)
+    return line
+
+  def read(self, size=1):
+    """
+    Returns up to size bytes of reply data.
+    """
+    data = ''
+    while len(data) < size:
+      line = self.readline()
+      if not line:
+        break
+      data += line
+    if len(data) > size:
+      self.replies.appendleft((self.clock.time(), data[size:]))
+      data = data[:size]
+    return data
+
+  def inWaiting(self):
+    """
+    Returns the number of reply bytes that have already arrived.
+    """
+    now = self.clock.time()
+    return sum(len(line) for ready, line in self.replies if ready <= now)
+
+  @property
+  def in_waiting(self):
+    return self.inWaiting()
+
+  def flushInput(self):
+    """
+    Discards reply lines that have already arrived.
+    """
+    now = self.clock.time()
+    while self.replies and self.replies[0][0] <= now:
+      self.replies.popleft()
+
+  reset_input_buffer = flushInput
+
+  def flushOutput(self):
+    pass
+
+  reset_output_buffer = flushOutput
+
+  def flush(self):
+    pass
+
+  def close(self):
+    pass
+
+  def isOpen(self):
+    return True
+
+  # Device state helpers used by the profiler and by tests of timing.
+
+  def axisPosition(self, axis, t=None):
+    """
+    Returns the actual position of the given axis number at time t.
+    """
+    if t is None:
+      t = self.clock.time()
+    return self.axes[axis].positionAt(t)
+
+  # Command execution.
+
+  def _dispatch(self, command, arrival):
+    match = self.line_pattern.match(command)
+    t = max(arrival, self.busy_until) + self.command_latency
+    if not match:
+      self._error(6, t)
+      return
+    prefix, mnemonic, parameter = match.groups()
+    mnemonic = mnemonic.upper()
+    self.statistics['commands'][mnemonic] += 1
+    if self.recording is not None and mnemonic != 'QP':
+      self.programs[self.recording].append(command.strip())
+      return
+    handler = self.handlers.get(mnemonic)
+    if handler is None:
+      self._error(6, t)
+      return
+    for axis in self.axes.values():
+      axis.prune(min(t, self.clock.time()) - self.history)
+    number = int(prefix) if prefix else None
+    reply = handler(number, parameter, t)
+    if reply is not None:
+      line = str(reply) + '\r\n'
+      self.replies.append((self.uplink.transmit(len(line), t), line))
+
+  def _error(self, code, t, axis=None):
+    if axis is not None:
+      message = AXIS_ERRORS.get(code, 'AXIS ERROR')
+      code = 100 * axis + code
+    else:
+      message = GENERAL_ERRORS.get(code, 'ERROR')
+    self.errors.append((code, int(t * 1000), message))
+
+  def _axis(self, number, t):
+    if number is None:
+      self._error(37, t)
+    elif number not in self.axes:
+      self._error(9, t)
+    else:
+      return self.axes[number]
+
+  def _group(self, number, t):
+    if number is None:
+      self._error(13, t)
+    elif number not in self.groups:
+      self._error(15, t)
+    else:
+      return self.groups[number]
+
+  @staticmethod
+  def _isQuery(parameter):
+    return parameter.endswith('?')
+
+  @staticmethod
+  def _format(value):
+    return '%.5f' % value
+
+  def _axisParameter(self, name):
+    def handler(number, parameter, t):
+      axis = self._axis(number, t)
+      if axis is None:
+        return None
+      if self._isQuery(parameter):
+        return self._format(getattr(axis, name))
+      try:
+        value = float(parameter)
+      except ValueError:
+        self._error(38, t)
+        return None
+      if name == 'velocity' and value > axis.velocity_limit:
+        self._error(10, t, number)
+      elif name in ('acceleration', 'deceleration') \
+          and value > axis.acceleration_limit:
+        self._error(11, t, number)
+      else:
+        setattr(axis, name, value)
+    return handler
+
+  def _groupParameter(self, name):
+    def handler(number, parameter, t):
+      group = self._group(number, t)
+      if group is None:
+        return None
+      if self._isQuery(parameter):
+        return self._format(getattr(group, name))
+      try:
+        setattr(group, name, float(parameter))
+      except ValueError:
+        self._error(38, t)
+    return handler
+
+  def _abort(self, number, parameter, t):
+    for axis in self.axes.values():
+      self._decelerate(axis, axis.estop, t)
+
+  def _decelerate(self, axis, deceleration, t):
+    if not axis.isMoving(t):
+      return
+    segment, index = axis._segment(t)
+    speed = segment.speed(t) * abs(segment.direction(t)[index])
+    sign = 1 if segment.direction(t)[index] >= 0 else -1
+    axis.follow(_Stop([axis.positionAt(t)], [sign], speed, deceleration, t), 0)
+
+  def _defineHome(self, number, parameter, t):
+    axis = self._axis(number, t)
+    if axis is None:
+      return None
+    if self._isQuery(parameter):
+      return self._format(axis.positionAt(t))
+    axis.follow(_Hold([float(parameter or 0)], t), 0)
+
+  def _desiredPosition(self, number, parameter, t):
+    axis = self._axis(number, t)
+    if axis is not None:
+      return self._format(axis.target)
+
+  def _desiredVelocity(self, number, parameter, t):
+    axis = self._axis(number, t)
+    if axis is not None:
+      segment, index = axis._segment(t)
+      return self._format(segment.speed(t) * abs(segment.direction(t)[index]))
+
+  def _stageID(self, number, parameter, t):
+    axis = self._axis(number, t)
+    if axis is not None:
+      return '%s, %s' % (axis.model, axis.serial_number)
+
+  def _motionDone(self, number, parameter, t):
+    axis = self._axis(number, t)
+    if axis is not None:
+      return '0' if axis.isMoving(t) else '1'
+
+  def _motorOff(self, number, parameter, t):
+    axis = self._axis(number, t)
+    if axis is not None:
+      self._decelerate(axis, axis.estop, t)
+      axis.motor_on = False
+
+  def _motorOn(self, number, parameter, t):
+    axis = self._axis(number, t)
+    if axis is None:
+      return None
+    if self._isQuery(parameter):
+      return '1' if axis.motor_on else '0'
+    axis.motor_on = True
+
+  def _startMove(self, axis, target, t, home_time=0.0):
+    """
+    Starts a single axis move after checking motor state and travel limits.
+    """
+    if not axis.motor_on:
+      self._error(13, t, axis.number)
+    elif axis.group is not None:
+      self._error(31, t, axis.number)
+    elif target > axis.upper_limit:
+      self._error(6, t, axis.number)
+    elif target < axis.lower_limit:
+      self._error(7, t, axis.number)
+    else:
+      axis.target = target
+      axis.follow(_Line([axis.positionAt(t)], [target], axis.profileArgs(), t,
+                        home_time), 0)
+      self.statistics['moves'] += 1
+      return True
+    return False
+
+  def _moveToLimit(self, number, parameter, t):
+    axis = self._axis(number, t)
+    if axis is None:
+      return None
+    if self._isQuery(parameter):
+      return '0' if axis.isMoving(t) else '1'
+    limit = axis.upper_limit if parameter.strip() == '+' else axis.lower_limit
+    self._startMove(axis, limit, t)
+
+  def _moveToIndex(self, number, parameter, t):
+    axis = self._axis(number, t)
+    if axis is None:
+      return None
+    if self._isQuery(parameter):
+      return '0' if axis.isMoving(t) else '1'
+    position = axis.positionAt(t)
+    if parameter.strip() == '+':
+      target = math.floor(position) + 1
+    else:
+      target = math.ceil(position) - 1
+    self._startMove(axis, target, t)
+
+  def _home(self, number, parameter, t):
+    axis = self._axis(number, t)
+    if axis is not None and self._startMove(axis, axis.home_preset, t,
+                                            self.home_search_time):
+      axis.homed = True
+
+  def _moveAbsolute(self, number, parameter, t):
+    axis = self._axis(number, t)
+    if axis is None:
+      return None
+    if self._isQuery(parameter):
+      return self._format(axis.target)
+    try:
+      target = float(parameter)
+    except ValueError:
+      self._error(38, t)
+      return None
+    self._startMove(axis, target, t)
+
+  def _moveRelative(self, number, parameter, t):
+    axis = self._axis(number, t)
+    if axis is None:
+      return None
+    if self._isQuery(parameter):
+      return self._format(axis.target)
+    try:
+      self._startMove(axis, axis.target + float(parameter), t)
+    except ValueError:
+      self._error(38, t)
+
+  def _reset(self, number, parameter, t):
+    for axis in self.axes.values():
+      axis.reset(t)
+    self.groups.clear()
+    self.errors.clear()
+    self.program_until = 0.0
+    self.busy_until = t + 1.0
+
+  def _units(self, number, parameter, t):
+    axis = self._axis(number, t)
+    if axis is None:
+      return None
+    if self._isQuery(parameter):
+      return str(axis.units)
+    try:
+      units = int(parameter)
+    except ValueError:
+      self._error(38, t)
+      return None
+    if 0 <= units <= 11:
+      axis.units = units
+    else:
+      self._error(1, t, number)
+
+  def _stop(self, number, parameter, t):
+    axis = self._axis(number, t)
+    if axis is not None:
+      self._decelerate(axis, axis.deceleration, t)
+
+  def _readError(self, number, parameter, t):
+    if self.errors:
+      return '%d, %d, %s' % self.errors.popleft()
+    return '0, %d, %s' % (int(t * 1000), GENERAL_ERRORS[0])
+
+  def _actualPosition(self, number, parameter, t):
+    axis = self._axis(number, t)
+    if axis is not None:
+      return self._format(axis.positionAt(t))
+
+  def _status(self, number, parameter, t):
+    bits = 0
+    for n, axis in self.axes.items():
+      if axis.isMoving(t):
+        bits |= 1 << (n - 1)
+      if axis.motor_on:
+        bits |= 1 << (n + 2)
+    return chr(0x40 | (bits & 0x3f))
+
+  def _activity(self, number, parameter, t):
+    bits = 0
+    if self.busy_until > t:
+      bits |= 0x01
+    if self.errors:
+      bits |= 0x02
+    if self.program_until > t:
+      bits |= 0x04
+    return chr(0x40 | bits)
+
+  def _version(self, number, parameter, t):
+    return self.firmware
+
+  def _waitPosition(self, number, parameter, t):
+    axis = self._axis(number, t)
+    if axis is not None:
+      self.busy_until = max(self.busy_until, axis.moveEnd(t))
+
+  def _waitStop(self, number, parameter, t):
+    axis = self._axis(number, t)
+    if axis is not None:
+      delay = float(parameter or 0) / 1000.0
+      self.busy_until = max(self.busy_until, axis.moveEnd(t) + delay)
+
+  def _waitTime(self, number, parameter, t):
+    self.busy_until = max(self.busy_until, t + float(parameter or 0) / 1000.0)
+
+  def _groupList(self, number, parameter, t):
+    return ','.join(str(n) for n in sorted(self.groups))
+
+  def _parseList(self, parameter, t):
+    try:
+      return [float(x) for x in parameter.split(',')]
+    except ValueError:
+      self._error(38, t)
+
+  def _groupReady(self, group, t):
+    if not group.on or not all(axis.motor_on for axis in group.axes):
+      self._error(13, t, group.axes[0].number)
+      return False
+    return True
+
+  def _groupLine(self, number, parameter, t):
+    group = self._group(number, t)
+    if group is None:
+      return None
+    if self._isQuery(parameter):
+      target = group.target or group.positionAt(t)
+      return ','.join(self._format(x) for x in target)
+    target = self._parseList(parameter, t)
+    if target is None or not self._groupReady(group, t):
+      return None
+    if len(target) != len(group.axes):
+      self._error(38, t)
+      return None
+    for axis, value in zip(group.axes, target):
+      if value > axis.upper_limit:
+        self._error(6, t, axis.number)
+        return None
+      if value < axis.lower_limit:
+        self._error(7, t, axis.number)
+        return None
+    group.target = target
+    segment = group.axes[0].segments[-1][0]
+    if isinstance(segment, _Path) and segment.end > t:
+      if segment.pending(t) >= self.group_buffer:
+        t = segment.reaches(len(segment.lengths) - self.group_buffer)
+        self.busy_until = max(self.busy_until, t)
+      if segment.canExtend(t):
+        segment.append(target)
+      else:
+        group.follow(_Path(segment.points[-1], target, group.profileArgs(),
+                           segment.end))
+    else:
+      group.follow(_Path(group.positionAt(t), target, group.profileArgs(), t))
+    self.statistics['moves'] += 1
+
+  def _groupArc(self, number, parameter, t):
+    group = self._group(number, t)
+    if group is None:
+      return None
+    if self._isQuery(parameter):
+      return ','.join(self._format(x) for x in group.positionAt(t))
+    arc = self._parseList(parameter, t)
+    if arc is None or not self._groupReady(group, t):
+      return None
+    if len(group.axes) != 2 or len(arc) != 3:
+      self._error(38, t)
+      return None
+    segment = _Arc(group.positionAt(t), arc[:2], arc[2], group.profileArgs(), t)
+    for index, axis in enumerate(group.axes):
+      for theta in (0.0, 0.25, 0.5, 0.75, 1.0):
+        value = segment.at(segment.start
+                           + theta * (segment.end - segment.start))[index]
+        if not axis.lower_limit <= value <= axis.upper_limit:
+          self._error(6 if value > axis.upper_limit else 7, t, axis.number)
+          return None
+    group.target = segment.at(segment.end)
+    group.follow(segment)
+    self.statistics['moves'] += 1
+
+  def _groupOff(self, number, parameter, t):
+    group = self._group(number, t)
+    if group is not None:
+      for axis in group.axes:
+        self._decelerate(axis, group.estop, t)
+        axis.motor_on = False
+      group.on = False
+
+  def _groupOn(self, number, parameter, t):
+    group = self._group(number, t)
+    if group is not None:
+      for axis in group.axes:
+        axis.motor_on = True
+      group.on = True
+
+  def _groupCreate(self, number, parameter, t):
+    if number is None:
+      self._error(13, t)
+      return None
+    if self._isQuery(parameter):
+      group = self._group(number, t)
+      if group is not None:
+        return ','.join(str(axis.number) for axis in group.axes)
+      return None
+    if number in self.groups:
+      self._error(16, t)
+      return None
+    try:
+      numbers = [int(x) for x in parameter.split(',')]
+    except ValueError:
+      self._error(38, t)
+      return None
+    if len(set(numbers)) != len(numbers):
+      self._error(19, t)
+    elif any(n not in self.axes for n in numbers):
+      self._error(17, t)
+    elif any(self.axes[n].group is not None for n in numbers):
+      self._error(18, t)
+    else:
+      axes = [self.axes[n] for n in numbers]
+      for axis in axes:
+        axis.group = number
+      self.groups[number] = SimulatedGroup(number, axes)
+
+  def _groupPosition(self, number, parameter, t):
+    group = self._group(number, t)
+    if group is not None:
+      return ', '.join(self._format(x) for x in group.positionAt(t))
+
+  def _groupStop(self, number, parameter, t):
+    group = self._group(number, t)
+    if group is None:
+      return None
+    if self._isQuery(parameter):
+      return '0' if group.isMoving(t) else '1'
+    if group.isMoving(t):
+      axis = group.axes[0]
+      segment, index = axis._segment(t)
+      group.follow(_Stop(group.positionAt(t), segment.direction(t),
+                         segment.speed(t), group.deceleration, t))
+
+  def _groupWait(self, number, parameter, t):
+    group = self._group(number, t)
+    if group is not None:
+      delay = float(parameter or 0) / 1000.0
+      self.busy_until = max(self.busy_until, group.moveEnd(t) + delay)
+
+  def _pendingPoints(self, group, t):
+    segment = group.axes[0].segments[-1][0]
+    if isinstance(segment, _Path):
+      return segment, segment.pending(t)
+    return None, 0
+
+  def _groupBuffer(self, number, parameter, t):
+    group = self._group(number, t)
+    if group is None:
+      return None
+    segment, pending = self._pendingPoints(group, t)
+    if self._isQuery(parameter):
+      return str(self.group_buffer - pending)
+    try:
+      free = int(parameter or 1)
+    except ValueError:
+      self._error(38, t)
+      return None
+    if not 0 <= free <= self.group_buffer:
+      self._error(7, t)
+    elif pending > self.group_buffer - free:
+      index = len(segment.lengths) - (self.group_buffer - free)
+      self.busy_until = max(self.busy_until, segment.reaches(index))
+
+  def _groupDelete(self, number, parameter, t):
+    group = self._group(number, t)
+    if group is not None:
+      for axis in group.axes:
+        axis.group = None
+      del self.groups[number]
+
+  def _groupSize(self, number, parameter, t):
+    group = self._group(number, t)
+    if group is not None:
+      return str(len(group.axes))
+
+  def _programNumber(self, number, t):
+    if number is None:
+      self._error(38, t)
+    elif not 1 <= number <= 100:
+      self._error(7, t)
+    else:
+      return number
+
+  def _enterProgram(self, number, parameter, t):
+    if self._programNumber(number, t) is not None:
+      self.programs[number] = []
+      self.recording = number
+
+  def _quitProgram(self, number, parameter, t):
+    self.recording = None
+
+  def _eraseProgram(self, number, parameter, t):
+    if not number:
+      self.programs.clear()
+    elif self._programNumber(number, t) is not None:
+      self.programs.pop(number, None)
+
+  def _defineLabel(self, number, parameter, t):
+    pass
+
+  def _jumpToLabel(self, number, parameter, t):
+    pass
+
+  def _expandProgram(self, commands, t):
+    """
+    Yields the commands of a stored program in execution order.
+
+    nnDL defines label nn; nnJLmm jumps back to it mm times, or forever if mm
+    is missing. Execution stops after program_steps commands.
+    """
+    labels = {}
+    parsed = []
+    for index, command in enumerate(commands):
+      prefix, mnemonic, parameter = self.line_pattern.match(command).groups()
+      mnemonic = mnemonic.upper()
+      if mnemonic == 'DL' and prefix:
+        labels[int(prefix)] = index
+      parsed.append((mnemonic, prefix, parameter))
+    jumps = {}
+    index = 0
+    steps = 0
+    while index < len(commands) and steps < self.program_steps:
+      mnemonic, prefix, parameter = parsed[index]
+      steps += 1
+      if mnemonic == 'JL':
+        label = int(prefix) if prefix else None
+        if label not in labels:
+          self._error(7, t)
+          return
+        remaining = jumps.get(index, int(parameter) if parameter else -1)
+        if remaining != 0:
+          jumps[index] = remaining - 1
+          index = labels[label]
+          continue
+        jumps.pop(index)
+      elif mnemonic != 'DL':
+        yield commands[index]
+      index += 1
+
+  def _executeProgram(self, number, parameter, t):
+    if self._programNumber(number, t) is None:
+      return
+    if number not in self.programs:
+      self._error(7, t)
+      return
+    try:
+      times = int(parameter or 1)
+    except ValueError:
+      self._error(38, t)
+      return
+    host_busy, n_replies = self.busy_until, len(self.replies)
+    self.busy_until = t
+    for i in xrange(times):
+      for command in self._expandProgram(self.programs[number], t):
+        self._dispatch(command, self.busy_until)
+        self.busy_until += self.command_latency
+    self.program_until = self.busy_until + self.command_latency
+    while len(self.replies) > n_replies:
+      self.replies.pop()
+    self.busy_until = host_busy
+
+class GaussianBeam(object):
+  """
+  A focused Gaussian laser beam crossing the plane of the camera stages.
+
+  The beam axis runs along the z stage axis and crosses x = x_offset at z = 0
+  with the given slope (mm of x per mm of z). Its 1/e^2 radius follows the
+  caustic w(z) = waist * sqrt(1 + ((z - waist_z) / z_R)^2) with
+  z_R = pi * waist^2 / (m_squared * wavelength). The waist moves by
+  waist_shift mm for every unit of mirror (axis 1) position.
+  """
+
+  def __init__(self, **kwargs):
+    """
+    Option=default values are as follows (lengths in mm, power in mW):
+    x_offset=12.0 - Beam x position at z = 0.
+    slope=0.02 - Beam x displacement per unit z.
+    power=1.0 - Total beam power.
+    waist=0.05 - 1/e^2 waist radius.
+    waist_z=30.0 - Waist position along z for mirror position 0.
+    waist_shift=0.0 - Waist displacement per unit mirror position.
+    wavelength=405e-6 - Laser wavelength.
+    m_squared=1.2 - Beam quality factor.
+    """
+    self.x_offset = kwargs.pop('x_offset', 12.0)
+    self.slope = kwargs.pop('slope', 0.02)
+    self.power = kwargs.pop('power', 1.0)
+    self.waist = kwargs.pop('waist', 0.05)
+    self.waist_z = kwargs.pop('waist_z', 30.0)
+    self.waist_shift = kwargs.pop('waist_shift', 0.0)
+    self.wavelength = kwargs.pop('wavelength', 405e-6)
+    self.m_squared = kwargs.pop('m_squared', 1.2)
+
+  def center(self, z):
+    """
+    Returns the x position of the beam axis at the given z.
+    """
+    return self.x_offset + self.slope * z
+
+  def focus(self, mirror=0.0):
+    """
+    Returns the z position of the beam waist for a mirror position.
+    """
+    return self.waist_z + self.waist_shift * mirror
+
+  def radius(self, z, mirror=0.0):
+    """
+    Returns the 1/e^2 beam radius at z.
+    """
+    rayleigh = math.pi * self.waist ** 2 / (self.m_squared * self.wavelength)
+    offset = (z - self.focus(mirror)) / rayleigh
+    return self.waist * math.sqrt(1 + offset ** 2)
+
+class SimulatedProfiler(object):
+  """
+  A serial port connected to a simulated HD-LBP beam profiler.
+
+  Frames of 14 space separated values terminated by ' \\n' are produced
+  back to back at the rate allowed by the serial line, or every frame_period
+  seconds if that is slower. Each frame samples the beam at the stage
+  position reported by the position callable at the start of the frame.
+  Reads on an empty buffer advance the clock to the next completed frame.
+  """
+
+  header = 'D'
+  buffer_size = 4096
+  levels = (13.5, 50.0, 80.0)
+
+  def __init__(self, clock, position, beam=None, **kwargs):
+    """
+    Creates a simulated profiler.
+
+    Arguments:
+    clock -- SimulatedClock shared with the stage controller.
+    position -- Callable returning (x, z, mirror) stage positions at time t.
+    beam -- GaussianBeam seen by the camera.
+
+    Option=default values are as follows:
+    baudrate=57600 - Serial line speed.
+    frame_period=0 - Minimum time between frame starts (s).
+    sensor_half_width=3.0 - Half width of the CCD (mm).
+    noise_floor=0.0002 - Power read with no beam on the sensor (mW).
+    power_noise=0.01 - Relative power noise.
+    centroid_noise=2.0 - Centroid noise (micrometers).
+    width_noise=0.01 - Relative noise of the projection widths.
+    seed=0 - Random seed for the noise.
+    """
+    self.clock = clock
+    self.position = position
+    self.beam = beam or GaussianBeam()
+    self.timeout = kwargs.pop('timeout', 1)
+    self.link = SerialLink(kwargs.pop('baudrate', 57600))
+    self.frame_period = kwargs.pop('frame_period', 0.0)
+    self.sensor_half_width = kwargs.pop('sensor_half_width', 3.0)
+    self.noise_floor = kwargs.pop('noise_floor', 0.0002)
+    self.power_noise = kwargs.pop('power_noise', 0.01)
+    self.centroid_noise = kwargs.pop('centroid_noise', 2.0)
+    self.width_noise = kwargs.pop('width_noise', 0.01)
+    self.random = random.Random(kwargs.pop('seed', 0))
+    self.reset_time = clock.time()
+    self.next_frame = clock.time()
+    self.frames = collections.deque()
+    self.statistics = {'frames': 0, 'bytes_read': 0}
+
+  def sample(self, t):
+    """
+    Returns the 14 measured values of a frame exposed at time t.
+    """
+    x, z, mirror = self.position(t)
+    beam = self.beam
+    radius = beam.radius(z, mirror)
+    offset = x - beam.center(z)
+    half = self.sensor_half_width
+    root2 = math.sqrt(2) / radius
+    fraction = 0.5 * (math.erf(root2 * (half - offset))
+                      + math.erf(root2 * (half + offset)))
+    power = beam.power * fraction * (1 + self.random.gauss(0, self.power_noise))
+    power = max(power, 0.0) + self.noise_floor * self.random.random()
+    noise = self.centroid_noise
+    if fraction > 0.01:
+      centroid_x = 1000.0 * offset + self.random.gauss(0, noise)
+      centroid_y = self.random.gauss(0, noise)
+      widths = [2000.0 * radius * math.sqrt(math.log(100.0 / level) / 2)
+                for level in self.levels]
+      scale_x = 1 + self.random.gauss(0, self.width_noise)
+      scale_y = 1 + self.random.gauss(0, self.width_noise)
+      heights = [w * scale_y for w in widths]
+      widths = [w * scale_x for w in widths]
+    else:
+      centroid_x = self.random.uniform(-half, half) * 1000.0
+      centroid_y = self.random.uniform(-half, half) * 1000.0
+      widths = heights = [0.0, 0.0, 0.0]
+    return ([t - self.reset_time, centroid_x, centroid_y, 1000.0 * radius]
+            + list(self.levels) + widths + heights + [power])
+
+  def _produce(self, now):
+    # Frames older than the host's receive buffer are overwritten unread.
+    oldest = now - self.buffer_size * self.link.byte_time
+    if self.next_frame < oldest:
+      self.next_frame = oldest
+      self.link.free_at = min(self.link.free_at, oldest)
+      self.frames.clear()
+    while self.next_frame <= now:
+      values = self.sample(self.next_frame)
+      frame = ' '.join([self.header] + ['%.4f' % v for v in values]) + ' \n'
+      done = self.link.transmit(len(frame), self.next_frame)
+      self.frames.append((done, frame))
+      self.statistics['frames'] += 1
+      self.next_frame = max(done, self.next_frame + self.frame_period)
+
+  def inWaiting(self):
+    """
+    Returns the number of bytes of completed frames, waiting for one if none.
+    """
+    now = self.clock.time()
+    self._produce(now)
+    waiting = sum(len(frame) for done, frame in self.frames if done <= now)
+    if not waiting:
+      self._produce(self.next_frame)
+      self.clock.advanceTo(self.frames[0][0])
+      waiting = len(self.frames[0][1])
+    return waiting
+
+  @property
+  def in_waiting(self):
+    return self.inWaiting()
+
+  def read(self, size=1):
+    """
+    Returns up to size bytes of completed frames.
+    """
+    now = self.clock.time()
+    self._produce(now)
+    data = ''
+    while self.frames and self.frames[0][0] <= now and len(data) < size:
+      done, frame = self.frames.popleft()
+      data += frame
+    if len(data) > size:
+      self.frames.appendleft((now, data[size:]))
+      data = data[:size]
+    self.statistics['bytes_read'] += len(data)
+    return data
+
+  def readline(self):
+    """
+    Returns the bytes up to and including the next newline.
+    """
+    data = ''
+    while not data.endswith('\n'):
+      self.inWaiting()
+      data += self.read(1)
+    return data
+
+  def flushInput(self):
+    self._produce(self.clock.time())
+    self.frames.clear()
+
+  reset_input_buffer = flushInput
+
+  def close(self):
+    pass
+
+  def isOpen(self):
+    return True
+
+class SimulatedBench(object):
+  """
+  A simulated EPS300 and HD-LBP sharing one clock and one laser beam.
+
+  The camera rides on the group formed by x_axis and z_axis; axis 1 carries
+  the mirror.
+  """
+
+  def __init__(self, beam=None, **kwargs):
+    """
+    Option=default values are as follows:
+    x_axis=2 - Controller axis moving the camera across the beam.
+    z_axis=3 - Controller axis moving the camera along the beam.
+    mirror_axis=1 - Controller axis moving the mirror.
+    seed=0 - Random seed for camera noise.
+    Remaining keyword arguments are passed to SimulatedProfiler.
+    """
+    self.clock = SimulatedClock()
+    self.beam = beam or GaussianBeam()
+    self.x_axis = kwargs.pop('x_axis', 2)
+    self.z_axis = kwargs.pop('z_axis', 3)
+    self.mirror_axis = kwargs.pop('mirror_axis', 1)
+    self.eps300 = SimulatedEPS300(self.clock)
+    self.profiler = SimulatedProfiler(self.clock, self.stagePosition,
+                                      self.beam, **kwargs)
+
+  def stagePosition(self, t):
+    """
+    Returns the (x, z, mirror) stage positions at time t.
+    """
+    return (self.eps300.axisPosition(self.x_axis, t),
+            self.eps300.axisPosition(self.z_axis, t),
+            self.eps300.axisPosition(self.mirror_axis, t))
@@ -0,0 +1,170 @@
+"""
+Time-aligned storage of camera frames and stage positions.
+
+Samples are appended to fixed-capacity NumPy structured arrays used as ring
+buffers, so memory stays bounded and appending does not allocate. Every row
+carries the host time at which it was taken, which lets stage positions be
+interpolated at the timestamps of camera frames::
+
+    store = telemetry.SampleStore(lbp.keys)
+    store.addFrame(lbp.read())
+    store.addPosition(1, eps.groupPosition(1))
+    frames = store.frames()
+    xz = store.positionAt(1, frames['host_time'])
+"""
+
+import numpy
+import time
+
+class RingColumns(object):
+  """
+  A structured array of fixed capacity that overwrites its oldest rows.
+  """
+
+  def __init__(self, dtype, capacity):
+    self.data = numpy.zeros(capacity, dtype=dtype)
+    self.capacity = capacity
+    self.count = 0
+
+  def __len__(self):
+    return min(self.count, self.capacity)
+
+  def append(self, row):
+    """
+    Stores one row given as a tuple in field order.
+    """
+    self.data[self.count % self.capacity] = row
+    self.count += 1
+
+  def extend(self, rows):
+    """
+    Stores a structured array of rows.
+    """
+    rows = rows[-self.capacity:]
+    n = len(rows)
+    first = self.count % self.capacity
+    head = min(n, self.capacity - first)
+    self.data[first:first + head] = rows[:head]
+    self.data[:n - head] = rows[head:]
+    self.count += n
+
+  def view(self):
+    """
+    Returns the stored rows oldest first.
+
+    The result is a view of the storage until the ring has wrapped around,
+    and a copy afterwards.
+    """
+    if self.count <= self.capacity:
+      return self.data[:self.count]
+    first = self.count % self.capacity
+    return numpy.concatenate((self.data[first:], self.data[:first]))
+
+  def clear(self):
+    self.count = 0
+
+class SampleStore(object):
+  """
+  Camera frames and stage positions recorded against the host clock.
+
+  Positions are kept per source, which is a group ID or a Stage axis number,
+  each with its own number of coordinates. If a recording.Recorder is set as
+  the recorder attribute every sample is also written to disk.
+  """
+
+  def __init__(self, keys, capacity=65536, position_capacity=16384):
+    """
+    Arguments:
+    keys -- Names of the camera frame values, as LaserBeamProfiler.keys.
+    capacity -- Number of frames kept.
+    position_capacity -- Number of positions kept for every source.
+    """
+    self.keys = list(keys)
+    fields = [('host_time', 'f8'), ('sequence', 'i8')]
+    self.frame_dtype = numpy.dtype(fields + [(key, 'f8') for key in self.keys])
+    self.camera = RingColumns(self.frame_dtype, capacity)
+    self.position_capacity = position_capacity
+    self.tracks = {}
+    self.recorder = None
+
+  def addFrame(self, frame):
+    """
+    Stores a frame dictionary as returned by LaserBeamProfiler.read().
+    """
+    row = ((frame.get('host_time', time.time()), frame.get('sequence', -1))
+           + tuple(frame[key] for key in self.keys))
+    self.camera.append(row)
+    if self.recorder is not None:
+      self.recorder.append('frames', row, self.frame_dtype)
+
+  def addFrames(self, frames):
+    """
+    Stores a list of frame dictionaries.
+    """
+    rows = numpy.empty(len(frames), dtype=self.frame_dtype)
+    for index, frame in enumerate(frames):
+      rows[index] = ((frame.get('host_time', time.time()),
+                      frame.get('sequence', -1))
+                     + tuple(frame[key] for key in self.keys))
+    self.camera.extend(rows)
+    if self.recorder is not None:
+      self.recorder.recordFrames(rows)
+
+  def addPosition(self, source, position, host_time=None):
+    """
+    Stores the position of a group or axis at host_time (default: now).
+    """
+    if host_time is None:
+      host_time = time.time()
+    coordinates = numpy.atleast_1d(numpy.asarray(position, dtype='f8'))
+    track = self.tracks.get(source)
+    if track is None:
+      dtype = numpy.dtype([('host_time', 'f8'),
+                           ('position', 'f8', (len(coordinates),))])
+      track = self.tracks[source] = RingColumns(dtype,
+                                                self.position_capacity)
+    track.append((host_time, coordinates))
+    if self.recorder is not None:
+      self.recorder.recordPosition(source, host_time, coordinates)
+
+  def frames(self):
+    """
+    Returns the stored frames oldest first as a structured array.
+    """
+    return self.camera.view()
+
+  def positions(self, source):
+    """
+    Returns the stored (host_time, position) rows of a source oldest first.
+    """
+    return self.tracks[source].view()
+
+  def positionAt(self, source, host_times):
+    """
+    Linearly interpolates the position of a source at the given host times.
+
+    Returns an array with one row of coordinates per time. Times outside the
+    recorded range get the first or last recorded position.
+    """
+    track = self.positions(source)
+    host_times = numpy.asarray(host_times, dtype='f8')
+    coordinates = track['position']
+    result = numpy.empty((len(host_times), coordinates.shape[1]))
+    for column in xrange(coordinates.shape[1]):
+      result[:, column] = numpy.interp(host_times, track['host_time'],
+                                       coordinates[:, column])
+    return result
+
+  def since(self, host_time):
+    """
+    Returns the frames taken after the given host time.
+    """
+    frames = self.frames()
+    return frames[frames['host_time'] > host_time]
+
+  def clear(self):
+    """
+    Forgets all samples.
+    """
+    self.camera.clear()
+    self.tracks.clear()
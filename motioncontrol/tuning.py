@@ -0,0 +1,155 @@
+"""
+Scan velocity tuning against the camera frame rate.
+
+A moving camera only registers the beam in the frames taken while the beam
+is on its sensor, so a scan must not cross that window faster than the
+camera and the search loop deliver frames. A VelocityTuner measures the
+frame rate of the HD-LBP, the rate of the search() polling loop and the beam
+width, and the resulting ScanTuning picks for every search rung the highest
+group velocity that still guarantees frames_across readings of the beam.
+Rungs whose stops alone are that dense run at max_velocity::
+
+    beam = utilities.ConstrainToBeam(eps, 1, lbp)
+    tuning = beam.tuneVelocity(frames_across=3)
+    print tuning.frame_rate, tuning.stepVelocity(5.0), tuning.flyVelocity()
+    beam.findBeam(-125)
+"""
+
+import numpy
+import time
+
+class ScanTuning(object):
+  """
+  Measured camera rates and the scan velocities they allow.
+
+  Attributes:
+  frame_rate -- Frames per second delivered by the camera.
+  poll_rate -- Group and camera polls per second of the search() loop.
+  beam_width -- 1/e^2 beam diameter on the sensor [mm], 0 if not yet seen.
+  sensor_width -- Width of the camera sensor [mm].
+  frames_across -- Readings required while the beam crosses the sensor.
+  max_velocity, min_velocity -- Bounds of the tuned velocities.
+  """
+
+  def __init__(self, frame_rate, poll_rate, sensor_width, frames_across=3,
+               max_velocity=30, min_velocity=0.1, beam_width=0.0):
+    self.frame_rate = frame_rate
+    self.poll_rate = poll_rate
+    self.sensor_width = sensor_width
+    self.frames_across = frames_across
+    self.max_velocity = max_velocity
+    self.min_velocity = min_velocity
+    self.beam_width = beam_width
+
+  def observe(self, frames, power_level):
+    """
+    Updates beam_width from the frames, a structured array as kept by a
+    telemetry.SampleStore, that saw the beam.
+    """
+    if len(frames) == 0:
+      return
+    seen = frames[frames['power'] > power_level]
+    if len(seen):
+      self.beam_width = float(numpy.median(seen['width_1'])) / 1000.0
+
+  def _bounded(self, velocity):
+    return max(self.min_velocity, min(self.max_velocity, velocity))
+
+  def stepVelocity(self, step_size):
+    """
+    Returns the group velocity for a search() rung of the given step size.
+
+    The beam registers while any of it is on the sensor. If the stops of the
+    rung alone give frames_across readings in that window the rung runs at
+    max_velocity; otherwise the readings taken while moving must.
+    """
+    window = self.sensor_width + self.beam_width
+    if abs(step_size) * self.frames_across <= window:
+      return self.max_velocity
+    rate = min(self.frame_rate, self.poll_rate)
+    return self._bounded(window * rate / self.frames_across)
+
+  def flyVelocity(self):
+    """
+    Returns the velocity of a fly-scan giving frames_across frames with the
+    whole beam on the sensor.
+    """
+    window = max(self.sensor_width - self.beam_width, self.beam_width)
+    return self._bounded(window * self.frame_rate / self.frames_across)
+
+  def __repr__(self):
+    return ('ScanTuning(frame_rate=%.1f, poll_rate=%.1f, beam_width=%.3f, '
+            'fly_velocity=%.2f)' % (self.frame_rate, self.poll_rate,
+                                    self.beam_width, self.flyVelocity()))
+
+class VelocityTuner(object):
+  """
+  Measures the camera rates seen by a ConstrainToBeam.
+  """
+
+  def __init__(self, constraint, **kwargs):
+    """
+    Option=default values are as follows:
+    frames_across=3 - Readings required while the beam crosses the sensor.
+    sensor_half_width=3.0 - Half width of the camera sensor (mm).
+    max_velocity=30 - Highest velocity chosen.
+    min_velocity=0.1 - Lowest velocity chosen.
+    samples=10 - Frames and polls timed by each measurement.
+    """
+    self.constraint = constraint
+    self.frames_across = kwargs.pop('frames_across', 3)
+    self.sensor_half_width = kwargs.pop('sensor_half_width', 3.0)
+    self.max_velocity = kwargs.pop('max_velocity', 30)
+    self.min_velocity = kwargs.pop('min_velocity', 0.1)
+    self.samples = kwargs.pop('samples', 10)
+
+  def measureFrameRate(self):
+    """
+    Returns the frame rate of the camera from the camera time of consecutive
+    frames.
+    """
+    camera = self.constraint.camera
+    camera.drain()
+    frames = []
+    last = time.time()
+    while len(frames) < self.samples:
+      frame = camera.waitNewer(last, timeout=1.0)
+      if frame is None:
+        break
+      last = frame['host_time']
+      frames.extend(camera.drain() or [frame])
+    self.constraint.store.addFrames(frames)
+    if len(frames) < 2:
+      return 0.0
+    times = numpy.array([frame['time'] for frame in frames])
+    span = times[-1] - times[0]
+    if span <= 0:
+      return 0.0
+    return (len(frames) - 1) / span
+
+  def measurePollRate(self):
+    """
+    Returns the rate of the search() loop, which queries the group motion
+    and reads the camera on every pass.
+    """
+    constraint = self.constraint
+    start = time.time()
+    for i in xrange(self.samples):
+      constraint.controller.groupIsMoving(constraint.group_id)
+      constraint.sample()
+    elapsed = time.time() - start
+    return self.samples / elapsed if elapsed > 0 else float('inf')
+
+  def tune(self):
+    """
+    Measures the rates and returns a ScanTuning.
+
+    The beam width is taken from the frames of the sample store that saw the
+    beam, if any.
+    """
+    constraint = self.constraint
+    tuning = ScanTuning(self.measureFrameRate(), self.measurePollRate(),
+                        2 * self.sensor_half_width, self.frames_across,
+                        self.max_velocity, self.min_velocity)
+    tuning.observe(constraint.store.frames(), constraint.power_level)
+    return tuning
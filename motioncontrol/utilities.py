@@ -2,15 +2,35 @@
 Utility classes for iTOP mirror measurements.
 """
 from numpy import array
+import calibration
+import caustic
+import contour
+import flyscan
+import localization
+import mapping
+import motion
+import telemetry
+import tuning
 import time
 import math
+import numpy
 
-def pauseForStage(stage):
+# Beam search strategies of ConstrainToBeam.findBeam.
+SCAN_MODES = ('step', 'fly', 'fit')
+
+# Search options a FocalPoint passes on to its ConstrainToBeam.
+TRAJECTORY_OPTIONS = ('scan_steps', 'step_velocity', 'fly_velocity',
+                      'fine_velocity', 'fine_range', 'max_drift', 'tuning',
+                      'tune_velocity')
+
+def pauseForStage(stage, delay=0):
   """
-  Hold python execution in null loop until stage is stopped.
+  Hold python execution until stage is stopped.
+
+  The wait is done by the controller and costs a single round trip. Returns a
+  motion.MotionResult with the final stage position.
   """
-  while stage.getMotionStatus():
-    pass
+  return motion.waitForStage(stage, delay)
 
 def clamp(value, min_value, max_value):
   """
@@ -39,19 +59,78 @@ class ConstrainToBeam(object):
     upper_limit_x=125 - Upper travel limit.
     upper_limit_z=125 - Upper travel limit.
     power=level - Beam-in-view power threshold.
+    store=None - telemetry.SampleStore receiving every camera frame and group
+                 position seen during searches. A new one is made if None.
+    scan_mode='step' - 'step' for the stepped search ladder of findBeam, 'fly'
+                       for continuous fly-scans, 'fit' for the model-based
+                       localization.BeamLocator.
+    scan_steps=[50, 25, 5, 1, 0.25, 0.12, 0.05, 0.01] - Step sizes of the
+                 successive searches of a 'step' findBeam.
+    step_velocity=5 - Group velocity of the stepped searches.
+    fly_velocity=20 - Group velocity of the coarse fly-scan.
+    fine_velocity=1 - Group velocity of the fine fly-scans.
+    fine_range=2 - Half width of the fine fly-scans around the coarse result.
+    tolerance=0.005 - Beam centre uncertainty at which 'fit' searches stop.
+    recorder=None - recording.Recorder receiving the samples of the store
+                    and the trajectories found.
+    calibrations=None - calibration.CalibrationStore holding trajectories of
+                        earlier sessions to be checked instead of searched.
+    bench=None - Bench name used in calibration keys. The controller's serial
+                 port name if None.
+    max_drift=0.1 - Largest change of a cached trajectory end accepted by
+                    its check.
+    tuning=None - tuning.ScanTuning choosing the group velocity of every
+                  'step' rung and of the coarse fly-scan instead of
+                  step_velocity and fly_velocity.
+    tune_velocity=False - Measure the tuning with tuneVelocity() before the
+                          first 'step' or 'fly' findBeam if none is given.
+
+    The number of group moves made by the last findBeam or checkBeam, or by
+    both ends of the last findSlope, is kept in moves.
     """
     self.controller = controller
     self.group_id = group_id
     self.camera = camera
+    self.store = kwargs.pop('store', None) or telemetry.SampleStore(camera.keys)
+    self.recorder = kwargs.pop('recorder', None)
+    if self.recorder is not None:
+      self.store.recorder = self.recorder
     self.lower_limit_x = kwargs.pop('lower_limit_x', -125)
     self.upper_limit_x = kwargs.pop('upper_limit_x',  125)
     self.lower_limit_z = kwargs.pop('lower_limit_z', -125)
     self.upper_limit_z = kwargs.pop('upper_limit_z',  125)
     self.power_level = kwargs.pop('power_level', 0.003)
+    self.scan_mode = kwargs.pop('scan_mode', 'step')
+    if self.scan_mode not in SCAN_MODES:
+      raise ValueError('Unknown scan mode %r; use one of %s.'
+                       % (self.scan_mode, ', '.join(SCAN_MODES)))
+    self.scan_steps = kwargs.pop('scan_steps',
+                                 [50.00, 25.00, 5.00, 1.00, 0.25, 0.12, 0.05,
+                                  0.01])
+    self.step_velocity = kwargs.pop('step_velocity', 5)
+    self.fly_velocity = kwargs.pop('fly_velocity', 20)
+    self.fine_velocity = kwargs.pop('fine_velocity', 1)
+    self.fine_range = kwargs.pop('fine_range', 2)
+    self.tolerance = kwargs.pop('tolerance', 0.005)
+    self.calibrations = kwargs.pop('calibrations', None)
+    self.bench = kwargs.pop('bench', None)
+    self.max_drift = kwargs.pop('max_drift', 0.1)
+    self.tuning = kwargs.pop('tuning', None)
+    self.tune_velocity = kwargs.pop('tune_velocity', False)
+    self.moves = 0
+    self.localization = None
     self.r_initial = array([0, 0])
     self.r_final = array([0, 0])
     self.slope = array([0, 0])
 
+  def sample(self):
+    """
+    Reads the camera and records the frame in the sample store.
+    """
+    reading = self.camera.read()
+    self.store.addFrame(reading)
+    return reading
+
   def search(self, start_point, stop_point, step_size):
 	"""
 	Searches through a range of position steps for the beam.
@@ -75,10 +154,12 @@ class ConstrainToBeam(object):
 	steps.append([x_stop, z_stop])
 	for position in steps:
 		self.controller.groupMoveLine(self.group_id, position)
+		self.moves += 1
 		while self.controller.groupIsMoving(self.group_id):
-			if (self.camera.read()['power'] > self.power_level):
+			if (self.sample()['power'] > self.power_level):
 				beam_seen = True
-		cam_reading = self.camera.read()
+		self.store.addPosition(self.group_id, position)
+		cam_reading = self.sample()
 		if (cam_reading['power'] < self.power_level and beam_seen):
 			print "Passed the beam."
 			return position
@@ -90,7 +171,7 @@ class ConstrainToBeam(object):
 				return position
 	else:
 		print "Something's not right..."
-		cam_reading = self.camera.read()
+		cam_reading = self.sample()
 		if cam_reading['power'] > self.power_level:
 			if -20 < cam_reading['centroid_x'] < 20:
 				print "On the beam within thermal fluctuations."
@@ -110,28 +191,179 @@ class ConstrainToBeam(object):
     """
     Centers the beam on a camera attached to given stage group.
     """
-    self.controller.groupVelocity(self.group_id, 30)
+    if self.scan_mode == 'fly':
+      if self.tuning is None and self.tune_velocity:
+        self.tuneVelocity()
+      return self.flyFindBeam(z_coordinate)
+    if self.scan_mode == 'fit':
+      return self.fitFindBeam(z_coordinate)
+    if self.tuning is None and self.tune_velocity:
+      self.tuneVelocity()
+    approach = 30 if self.tuning is None else self.tuning.max_velocity
     start_point = [self.lower_limit_x, z_coordinate]
-    self.controller.groupMoveLine(self.group_id, start_point)
+    with self.controller.batch():
+      self.controller.groupVelocity(self.group_id, approach)
+      self.controller.groupMoveLine(self.group_id, start_point)
+    self.moves = 1
     self.controller.pauseForGroup(self.group_id)
     time.sleep(1)
-    self.controller.groupVelocity(self.group_id, 5)
-    scan_steps = [50.00, 25.00, 5.00, 1.00, 0.25, 0.12, 0.05, 0.01]
+    velocity = self.step_velocity
     scan_range = self.upper_limit_x - self.lower_limit_x
-    for step_number, step_size in enumerate(scan_steps):
+    for step_number, step_size in enumerate(self.scan_steps):
+      if self.tuning is not None:
+        velocity = self.tuning.stepVelocity(step_size)
+      self.controller.groupVelocity(self.group_id, velocity)
       sign = (-1)**step_number
       stop_point = map(sum, zip(start_point, [sign*scan_range, 0]))
+      rung_start = time.time()
       start_point = self.search(start_point, stop_point, step_size)
+      if self.tuning is not None:
+        self.tuning.observe(self.store.since(rung_start), self.power_level)
       scan_range = 2.0 * step_size
     return self.controller.groupPosition(self.group_id)
 
+  def flyFindBeam(self, z_coordinate):
+    """
+    Centers the beam on the camera using fly-scans at the given z.
+
+    One coarse fly-scan across the full x range locates the beam; two fine
+    fly-scans in opposite directions around it refine the position, and
+    averaging them cancels the camera latency.
+    """
+    start_point = [self.lower_limit_x, z_coordinate]
+    stop_point = [self.upper_limit_x, z_coordinate]
+    fly_velocity = self.fly_velocity
+    approach = 30
+    if self.tuning is not None:
+      fly_velocity = self.tuning.flyVelocity()
+      approach = self.tuning.max_velocity
+    self.controller.groupVelocity(self.group_id, approach)
+    result = flyscan.scan(self, start_point, stop_point, fly_velocity)
+    self.moves = 2
+    crossing = flyscan.beamCrossing(result, self.power_level)
+    if crossing is None:
+      print "ERROR: Beam not detected."
+      self.controller.groupOff(self.group_id)
+      return [0, 0]
+    x_beam = crossing[0]
+    low = clamp(x_beam - self.fine_range, self.lower_limit_x,
+                self.upper_limit_x)
+    high = clamp(x_beam + self.fine_range, self.lower_limit_x,
+                 self.upper_limit_x)
+    estimates = []
+    for start, stop in ((low, high), (high, low)):
+      result = flyscan.scan(self, [start, z_coordinate], [stop, z_coordinate],
+                            self.fine_velocity)
+      self.moves += 2
+      crossing = flyscan.beamCrossing(result, self.power_level)
+      if crossing is not None:
+        estimates.append(crossing[0])
+    if estimates:
+      x_beam = sum(estimates) / len(estimates)
+    x_beam = clamp(x_beam, self.lower_limit_x, self.upper_limit_x)
+    self.controller.groupMoveLine(self.group_id, [x_beam, z_coordinate])
+    self.moves += 1
+    self.controller.pauseForGroup(self.group_id)
+    return self.controller.groupPosition(self.group_id)
+
+  def fitFindBeam(self, z_coordinate, hint=None):
+    """
+    Centers the beam on the camera at the given z with a BeamLocator.
+
+    The search starts at hint, by default the current x of the group. The
+    localization.Localization result is kept in localization.
+    """
+    locator = localization.BeamLocator(self, tolerance=self.tolerance)
+    self.localization = locator.locate(z_coordinate, hint)
+    self.moves = self.localization.moves
+    if self.localization.position is None:
+      print "ERROR: Beam not detected."
+      self.controller.groupOff(self.group_id)
+      return [0, 0]
+    return self.localization.position
+
+  def tuneVelocity(self, **kwargs):
+    """
+    Measures the camera frame rate, search loop rate and beam width and
+    keeps the resulting tuning.ScanTuning in tuning.
+
+    Keyword arguments are passed to tuning.VelocityTuner.
+    """
+    self.tuning = tuning.VelocityTuner(self, **kwargs).tune()
+    return self.tuning
+
+  def calibrationKey(self):
+	"""
+	Returns the key of this trajectory in a calibration.CalibrationStore.
+	"""
+	bench = self.bench
+	if bench is None:
+		bench = getattr(self.controller.io, 'port', None) or 'default'
+	axes = self.controller.query('HN', '?', self.group_id).strip().split(',')
+	return calibration.configurationKey(bench, self.group_id, axes,
+	  (self.lower_limit_x, self.upper_limit_x,
+	   self.lower_limit_z, self.upper_limit_z))
+
+  def checkBeam(self, point):
+	"""
+	Confirms a cached trajectory end with a single probe.
+
+	Returns the end corrected to the beam centre seen there, or None if the
+	beam is not within max_drift of it.
+	"""
+	locator = localization.BeamLocator(self, tolerance=self.tolerance)
+	found = locator.check(point[0], point[1])
+	self.moves = locator.moves
+	if found is None or abs(found[0] - point[0]) > self.max_drift:
+		return None
+	return [found[0], point[1]]
+
   def findSlope(self):
 	"""
 	Finds the trajectory of the stages needed to keep a beam centered on camera.
+
+	With a calibration store the cached ends of the trajectory are checked
+	first and the beam is only searched for at ends that fail their check.
+	The store is only written when an end moved by more than max_drift.
 	"""
-	self.r_initial = array(self.findBeam(self.lower_limit_z))
-	self.r_final = array(self.findBeam(self.upper_limit_z))
+	cached = None
+	if self.calibrations is not None:
+		key = self.calibrationKey()
+		cached = self.calibrations.load(key)
+	ends = []
+	checked = 0
+	moves = 0
+	changed = cached is None
+	for i, z in enumerate((self.lower_limit_z, self.upper_limit_z)):
+		end = None
+		if cached is not None:
+			end = self.checkBeam(cached['r_final' if i else 'r_initial'])
+			moves += self.moves
+		if end is None:
+			end = self.findBeam(z)
+			moves += self.moves
+		else:
+			checked += 1
+		if cached is not None:
+			old = cached['r_final' if i else 'r_initial']
+			changed = changed or math.hypot(end[0] - old[0],
+			                                end[1] - old[1]) > self.max_drift
+		ends.append(end)
+	self.moves = moves
+	self.r_initial = array(ends[0])
+	self.r_final = array(ends[1])
 	self.slope = self.r_final - self.r_initial
+	# findBeam reports a beam it could not find as [0, 0].
+	if self.calibrations is not None and changed and \
+	   [0, 0] not in map(list, ends):
+		self.calibrations.save(key, self.r_initial.tolist(),
+		                       self.r_final.tolist())
+	if self.recorder is not None:
+		self.recorder.recordResult('slope', {
+		  'r_initial': self.r_initial.tolist(),
+		  'r_final': self.r_final.tolist(),
+		  'slope': self.slope.tolist(),
+		  'checked': checked})
 	return self.slope
 
   def position(self, fraction):
@@ -143,13 +375,101 @@ class ConstrainToBeam(object):
     else:
       return (self.r_initial + fraction * self.slope).tolist()
 
+  def followBeam(self, start=0.0, stop=1.0, spacing=1.0, velocity=None):
+    """
+    Moves the stage group continuously along the beam trajectory.
+
+    The trajectory between the fractions start and stop is streamed through
+    the group point buffer with a point every spacing millimeters. Returns a
+    motion.MotionResult.
+    """
+    path = contour.clampPath(contour.beamPath(self, start, stop, spacing),
+                             [self.lower_limit_x, self.lower_limit_z],
+                             [self.upper_limit_x, self.upper_limit_z])
+    return self.controller.groupMoveContour(self.group_id, path,
+                                            velocity=velocity)
+
+  def mapBeam(self, x_step, z_step, order='serpentine', fly=False,
+              velocity=None, frames_per_point=1, mask=None):
+    """
+    Maps power and centroid over an x-z grid within the travel limits.
+
+    The grid points are visited in the given order ('serpentine', 'nearest'
+    or 'raster') to keep the group travel short, or each row is fly-scanned
+    if fly is set. Returns a mapping.BeamMap; see mapping.rasterMap().
+    """
+    beam_map = mapping.rasterMap(self, x_step, z_step, order, fly, velocity,
+                                 frames_per_point, mask)
+    self.moves = beam_map.moves
+    if self.recorder is not None:
+      self.recorder.recordResult('map', {
+        'x': beam_map.x.tolist(),
+        'z': beam_map.z.tolist(),
+        'power': numpy.where(numpy.isnan(beam_map.power), None,
+                             beam_map.power).tolist(),
+        'travel': beam_map.travel,
+        'elapsed': beam_map.elapsed})
+    return beam_map
+
+class MirrorFocus(object):
+  """
+  Beam waist found at one mirror position of FocalPoint.sweepMirror().
+
+  Attributes:
+  mirror_position -- Mirror (axis 1) position.
+  waist_z, waist_z_error -- Waist position along z and its standard error.
+  r_focal -- Group position at the waist.
+  caustic -- Caustic fits of the widths and heights.
+  remeasured -- True if the trajectory had to be found again.
+  elapsed -- Seconds from the start of the mirror wait to the fit.
+  """
+
+  def __init__(self, mirror_position, waist_z, waist_z_error, r_focal,
+               caustic, remeasured, elapsed):
+    self.mirror_position = mirror_position
+    self.waist_z = waist_z
+    self.waist_z_error = waist_z_error
+    self.r_focal = array(r_focal).tolist()
+    self.caustic = caustic
+    self.remeasured = remeasured
+    self.elapsed = elapsed
+
+  def info(self):
+    """
+    Returns the result as a JSON serializable dictionary.
+    """
+    return {'mirror_position': self.mirror_position,
+            'waist_z': self.waist_z,
+            'waist_z_error': self.waist_z_error,
+            'r_focal': self.r_focal,
+            'm_squared': [fit.m_squared for fit in self.caustic],
+            'remeasured': self.remeasured}
+
+  def __repr__(self):
+    return 'MirrorFocus(%g: waist_z=%.4f +- %.4f)' % (
+      self.mirror_position, self.waist_z, self.waist_z_error)
+
 class FocalPoint(object):
   def __init__(self, controller, group_id, camera, **kwargs):
 	self.controller = controller
 	self.mirror = self.controller.axis1
 	self.group_id = group_id
 	self.camera = camera
-	self.trajectory = ConstrainToBeam(self.controller, self.group_id, self.camera)
+	self.trajectory = ConstrainToBeam(self.controller, self.group_id, self.camera,
+	                                  store=kwargs.pop('store', None),
+	                                  scan_mode=kwargs.pop('scan_mode', 'step'),
+	                                  tolerance=kwargs.pop('tolerance', 0.005),
+	                                  recorder=kwargs.pop('recorder', None),
+	                                  calibrations=kwargs.pop('calibrations',
+	                                                          None),
+	                                  bench=kwargs.pop('bench', None),
+	                                  **dict((key, kwargs.pop(key))
+	                                         for key in TRAJECTORY_OPTIONS
+	                                         if key in kwargs))
+	self.recorder = self.trajectory.recorder
+	self.scan_mode = self.trajectory.scan_mode
+	self.moves = 0
+	self.store = self.trajectory.store
 	self.beam_crossing_found = False
 	##
 	self.lower_limit_x = kwargs.pop('lower_limit_x', -125)
@@ -157,48 +477,195 @@ class FocalPoint(object):
 	self.lower_limit_z = kwargs.pop('lower_limit_z', -125)
 	self.upper_limit_z = kwargs.pop('upper_limit_z',  125)
 	self.power_level = kwargs.pop('power_level', 0.003)
+	self.wavelength = kwargs.pop('wavelength', 405e-6)
+	self.blocked_position = kwargs.pop('blocked_position', 0)
+	self.unblocked_position = kwargs.pop('unblocked_position', 50)
 	self.slope = array([0, 0])
 	self.r_focal = array([0, 0])
+	self.caustic = None
 	##
 
+  def sample(self):
+	"""
+	Reads the camera and records the frame in the sample store.
+	"""
+	return self.trajectory.sample()
+
   def moveOnBeam(self, position):
 	self.controller.groupMoveLine(self.group_id,
         self.trajectory.position(position))
 
-  def findFocalPoint(self):#, mirror_position):
+  def findFocalPoint(self, mirror_position=None):
+	"""
+	Finds the beam trajectory, then the beam waist along it with the mirror
+	at mirror_position, by default unblocked_position.
+
+	Use sweepMirror() for a series of mirror positions.
+	"""
 	self.mirror.on()
-	#self.mirror.position(250 - mirror_position)
-	#pauseForStage(self.mirror)
-    # Block the free beam. Done manually for now. TODO: get an automatic block.
-	##
-	unblockedPos = 50
-	blockedPos = 0
 	self.mirror.acceleration(50)
 	self.mirror.velocity(30)
-	self.mirror.position(blockedPos)
-	pauseForStage(self.mirror)
-	##
-	
-	self.slope = self.trajectory.findSlope()
+	self.measureTrajectory()
 	
     # Unblock the free beam. Done manually for now.
 	##
-	self.mirror.position(unblockedPos)
+	if mirror_position is None:
+		mirror_position = self.unblocked_position
+	self.mirror.position(mirror_position)
 	pauseForStage(self.mirror)
 	##
 	
 	self.controller.groupVelocity(self.group_id, 5)
 	#
 	# move cam to focal point
-	
-	#1: move along beam
-	#2: find power spike
-	#3: refine position
-	#self.r_focal = array(self.findBeam2(self.lower_limit_z))
-	self.r_focal = array(self.findBeam2(self.slope))
-	#
-	#
-	
+	self.findFocus()
+	self.controller.groupMoveLine(self.group_id, self.r_focal.tolist())
+	self.controller.pauseForGroup(self.group_id)
+	return self.r_focal
+
+  def measureTrajectory(self):
+	"""
+	Blocks the free beam with the mirror and finds the beam trajectory.
+	"""
+    # Block the free beam. Done manually for now. TODO: get an automatic block.
+	self.mirror.position(self.blocked_position)
+	pauseForStage(self.mirror)
+	self.slope = self.trajectory.findSlope()
+	return self.slope
+
+  def findFocus(self, velocity=5, level=1):
+	"""
+	Locates the beam waist in one pass along the beam trajectory.
+
+	The camera group travels the trajectory found by findSlope() while every
+	frame is recorded, and the projection widths and heights at the given
+	level (1-3) are each fitted with a caustic.CausticFit, kept in caustic.
+	Returns the waist z and its standard error, combined from both fits, and
+	keeps the group position at the waist in r_focal.
+	"""
+	return self.fitFocus(self.focusPass(velocity), level)
+
+  def focusPass(self, velocity=5, reverse=False):
+	"""
+	Drives the camera group along the whole trajectory at the given velocity
+	and returns the flyscan.FlyScanResult. With reverse set the pass runs
+	from the final end of the trajectory to the initial one.
+	"""
+	trajectory = self.trajectory
+	self.checkTrajectory()
+	ends = [trajectory.r_initial.tolist(),
+	        (trajectory.r_initial + trajectory.slope).tolist()]
+	if reverse:
+		ends.reverse()
+	return flyscan.scan(trajectory, ends[0], ends[1], velocity)
+
+  def fitFocus(self, result, level=1):
+	"""
+	Fits the caustic of the frames of a focus pass as for findFocus().
+
+	r_focal is kept on the trajectory, and within the travel limits, even if
+	the waist lies beyond its ends. Raises ValueError if there is no
+	trajectory, the pass has too few frames or a fit has no error estimate.
+	"""
+	trajectory = self.trajectory
+	self.checkTrajectory()
+	host_time = result.frames['host_time']
+	if len(host_time) < 2:
+		raise ValueError('Too few frames in the focus pass for a caustic fit.')
+	# Frames arrive about one frame period after their exposure.
+	latency = numpy.median(numpy.diff(host_time))
+	z = self.store.positionAt(self.group_id, host_time - latency)[:, 1]
+	width, height = caustic.frameDiameters(result.frames, level)
+	self.caustic = (caustic.fitCaustic(z, width, self.wavelength),
+	                caustic.fitCaustic(z, height, self.wavelength))
+	errors = [fit.waist_z_error for fit in self.caustic]
+	if not all(0 < error < float('inf') for error in errors):
+		raise ValueError('The caustic fit gave no waist error estimate.')
+	weights = [1 / error ** 2 for error in errors]
+	waist_z = sum(w * fit.waist_z for w, fit in zip(weights, self.caustic))
+	waist_z /= sum(weights)
+	waist_z_error = 1 / math.sqrt(sum(weights))
+	fraction = (waist_z - trajectory.r_initial[1]) / float(trajectory.slope[1])
+	r_focal = trajectory.r_initial + clamp(fraction, 0, 1) * trajectory.slope
+	self.r_focal = array([
+	  clamp(r_focal[0], trajectory.lower_limit_x, trajectory.upper_limit_x),
+	  clamp(r_focal[1], trajectory.lower_limit_z, trajectory.upper_limit_z)])
+	return waist_z, waist_z_error
+
+  def checkTrajectory(self):
+	"""
+	Raises ValueError unless findSlope() found a trajectory along z.
+
+	findBeam reports a beam it could not find as [0, 0].
+	"""
+	trajectory = self.trajectory
+	ends = (trajectory.r_initial.tolist(), trajectory.r_final.tolist())
+	if trajectory.slope[1] == 0 or [0, 0] in ends:
+		raise ValueError('No beam trajectory; findSlope() did not find the '
+		                 'beam at both ends.')
+
+  def onTrajectory(self, result):
+	"""
+	Returns True if the beam stayed on the camera, within the max_drift of
+	the trajectory, throughout a focus pass.
+	"""
+	frames = result.frames
+	if len(frames) == 0:
+		return False
+	seen = frames['power'] > self.power_level
+	if seen.mean() < 0.9:
+		return False
+	offset = numpy.percentile(numpy.abs(frames['centroid_x'][seen]), 95)
+	return offset / 1000.0 <= self.trajectory.max_drift
+
+  def sweepMirror(self, positions, velocity=5, level=1):
+	"""
+	Locates the beam waist for each of a series of mirror positions.
+
+	A generator yielding a MirrorFocus per position, in order, as soon as
+	its caustic is fitted. The mirror already travels to the next position
+	while a pass is fitted and its result is handled by the caller, and the
+	passes run along the trajectory in alternating directions. The
+	trajectory is found once and reused while the passes stay on the beam;
+	otherwise it is found again and the pass repeated. ValueError is raised
+	if the beam is not found again or the repeated pass leaves it too::
+
+	    for focus in fp.sweepMirror(range(20, 80, 2)):
+	      print focus.mirror_position, focus.waist_z
+	"""
+	positions = list(positions)
+	self.mirror.on()
+	self.mirror.acceleration(50)
+	self.mirror.velocity(30)
+	if not self.slope.any():
+		self.measureTrajectory()
+	if positions:
+		self.mirror.position(positions[0])
+	reverse = False
+	for index, position in enumerate(positions):
+		start = time.time()
+		pauseForStage(self.mirror)
+		result = self.focusPass(velocity, reverse)
+		remeasured = not self.onTrajectory(result)
+		if remeasured:
+			self.measureTrajectory()
+			self.mirror.position(position)
+			pauseForStage(self.mirror)
+			reverse = False
+			result = self.focusPass(velocity, reverse)
+			if not self.onTrajectory(result):
+				raise ValueError('The beam was lost at mirror position %g.'
+				                 % position)
+		reverse = not reverse
+		if index + 1 < len(positions):
+			self.mirror.position(positions[index + 1])
+		waist_z, waist_z_error = self.fitFocus(result, level)
+		focus = MirrorFocus(position, waist_z, waist_z_error, self.r_focal,
+		                    self.caustic, remeasured, time.time() - start)
+		if self.recorder is not None:
+			self.recorder.recordResult('mirror_focus', focus.info())
+		yield focus
+
   def searchAlongBeam(self, start_point, stop_point, step_size):
 	"""
 	Searches through a range of position steps for the beam.
@@ -227,13 +694,15 @@ class FocalPoint(object):
 		#self.moveOnBeam(self, position)
 		#self.controller.groupMoveLine(self.group_id,self.trajectory.position(position))
 		self.controller.groupMoveLine(self.group_id, position)
+		self.moves += 1
 		while self.controller.groupIsMoving(self.group_id):
-			if (self.camera.read()['power'] > self.power_level):
+			if (self.sample()['power'] > self.power_level):
 				##
 				#define new power level based on level of a single beam
 				##
 				beam_seen = True
-		cam_reading = self.camera.read()
+		self.store.addPosition(self.group_id, position)
+		cam_reading = self.sample()
 		if (cam_reading['power'] < self.power_level and beam_seen):
 			print "Passed the beam."
 			return position
@@ -245,7 +714,7 @@ class FocalPoint(object):
 				return position
 	else:
 		print "Something's not right..."
-		cam_reading = self.camera.read()
+		cam_reading = self.sample()
 		if cam_reading['power'] > self.power_level:
 			if -20 < cam_reading['centroid_x'] < 20:
 				print "On the beam within thermal fluctuations."
@@ -265,6 +734,12 @@ class FocalPoint(object):
 	"""
 	Centers the beam on a camera attached to given stage group.
 	"""
+	if self.scan_mode == 'fit':
+		x, z = self.controller.groupPosition(self.group_id)[:2]
+		position = self.trajectory.fitFindBeam(z, x)
+		self.moves = self.trajectory.moves
+		return position
+	self.moves = 0
 	self.controller.groupVelocity(self.group_id, 30)
     #start_point = [self.lower_limit_x, z_coordinate]
 	##
@@ -291,10 +766,24 @@ class FocalPoint(object):
 	return self.controller.groupPosition(self.group_id)
 	
   def outputInfo(self):
-	#grab all variables to output
-	#print "temp output"
-	#give the outut a name (ex A=output) and save to a file
-	#f = open (pathname)
-	#f.write ('string\n')
-	#f.close()
-	return 0
\ No newline at end of file
+	"""
+	Returns the results of the measurement as a dictionary.
+
+	The dictionary is also written to the recorder, if any, as a
+	'focal_point' result.
+	"""
+	info = {
+	  'r_initial': array(self.trajectory.r_initial).tolist(),
+	  'r_final': array(self.trajectory.r_final).tolist(),
+	  'slope': array(self.slope).tolist(),
+	  'r_focal': array(self.r_focal).tolist(),
+	}
+	if self.caustic is not None:
+		info['caustic'] = [dict((name, getattr(fit, name)) for name in
+		                        ('waist_z', 'waist_z_error', 'waist_diameter',
+		                         'divergence', 'rayleigh', 'm_squared',
+		                         'residual', 'n_points'))
+		                   for fit in self.caustic]
+	if self.recorder is not None:
+		self.recorder.recordResult('focal_point', info)
+	return info
\ No newline at end of file
@@ -13,5 +13,6 @@ setup(
     long_description=open('README.txt').read(),
     install_requires=[
         "pyserial >= 2.6",
+        "numpy",
     ],
 )
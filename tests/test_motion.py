@@ -0,0 +1,60 @@
+"""
+Motion waits on the simulated bench.
+
+Run from the repository root with::
+
+    python -m unittest discover tests
+"""
+
+import unittest
+
+from motioncontrol import controller, kinematics, motion, simulator
+
+class LongMoveTest(unittest.TestCase):
+  """
+  Controller waits for moves that take longer than the default wait deadline
+  of the query engine.
+  """
+
+  def setUp(self):
+    self.bench = simulator.SimulatedBench()
+    self.clock = self.bench.clock.patch()
+    self.clock.__enter__()
+    self.eps = controller.StageController(self.bench.eps300)
+    self.eps.initializeGroup(1, [2, 3], velocity=0.5)
+
+  def tearDown(self):
+    self.clock.__exit__(None, None, None)
+
+  def testGroupMoveLongerThanWaitDeadline(self):
+    self.eps.groupMoveLine(1, [50, -50])
+    result = self.eps.pauseForGroup(1)
+    self.assertGreater(result.elapsed, self.eps.engine.wait_deadline)
+    self.assertEqual(result.position, [50.0, -50.0])
+    self.assertEqual(result.polls, 0)
+    self.assertEqual(self.eps.engine.statistics['timeouts'], 0)
+    self.assertEqual(self.eps.groupPosition(1), [50.0, -50.0])
+
+  def testStageMoveLongerThanWaitDeadline(self):
+    self.eps.axis1.on()
+    self.eps.axis1.velocity(0.2)
+    self.eps.axis1.move(30)
+    result = motion.waitForStage(self.eps.axis1)
+    self.assertGreater(result.elapsed, self.eps.engine.wait_deadline)
+    self.assertEqual(result.position, 30.0)
+    self.assertEqual(self.eps.engine.statistics['timeouts'], 0)
+
+  def testUnpredictableMoveIsPolled(self):
+    estimate = kinematics.MoveEstimator.groupDynamics
+    kinematics.MoveEstimator.groupDynamics = \
+      lambda estimator, group_id: kinematics.Dynamics(0, 0)
+    try:
+      self.eps.groupMoveLine(1, [50, -50])
+      result = self.eps.pauseForGroup(1)
+    finally:
+      kinematics.MoveEstimator.groupDynamics = estimate
+    self.assertEqual(result.position, [50.0, -50.0])
+    self.assertGreater(result.polls, 0)
+
+if __name__ == '__main__':
+  unittest.main()